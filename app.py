@@ -1,28 +1,66 @@
 import tkinter as tk
 from tkinter import filedialog
 import threading
-import queue
-import librosa
-import sounddevice as sd
+import argparse
+import logging
+import functools
+import importlib
 import numpy as np
 import cadence_inference
 import bluetooth_receive
+import runner_server
 import time
+from audio_output import CallbackAudioOutput, find_output_device
+from fusion import FusionController
+from ui_state import UIState
+from song_cache import SongAnalysisCache
+from library_indexer import LibraryIndex, DEFAULT_INDEX_PATH
+from track_selector import BpmIndex, PlaybackQueue, TrackSource, StretchedSource, nearest_alias
+from renditions import RenditionRenderer, RenditionSource, rendition_rates
+from phase_lock import PhaseLockController
+from multiprocess_pipeline import PipelineSupervisor, CADENCE, STRIDE, HR, cadence_worker, hr_worker
+from metrics import REGISTRY, configure_logging, serve_http, serve_unix
+from session_log import SessionWriter, session_path
+import os
+from collections import deque
+
+log = logging.getLogger("jogmusic.app")
+_render_seconds = REGISTRY.histogram("audio.render_seconds")
+_write_wait_seconds = REGISTRY.histogram("audio.write_wait_seconds")
+
+# Slow to import and not needed to draw the window; loaded in the background once it is up
+DEFERRED_IMPORTS = ("scipy.signal", "sounddevice")
+
+
+def preload_modules(names=DEFERRED_IMPORTS):
+    """Import slow modules ahead of first use, so pressing Play or the first packet does not stall."""
+    for name in names:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            log.warning("Could not preload module", extra={"target": name, "error": str(e)})
+        else:
+            log.debug("Preloaded module", extra={"target": name, "seconds": time.perf_counter() - start})
 
 class RealTimeAudioPlayer:
-    def __init__(self, root, cadence_queue, bluetooth_queue):
-        print(sd.query_devices())
-        sd.default.device = 6
+    def __init__(self, root, block_size=1024, latency=0.05, control_rate=5.0, ui_rate=10, song_cache=None,
+                 min_rate=0.8, max_rate=1.25, crossfade_seconds=3.0, preload_seconds=20.0, audio_device=None,
+                 session=None):
         self.root = root
 
-        self.cadence_queue = cadence_queue
-        self.bluetooth_queue = bluetooth_queue
         self.root.title("Real-Time Audio Speed Control")
 
         # UI Elements
         self.load_button = tk.Button(root, text="Load Audio", command=self.load_audio)
         self.load_button.pack(pady=10)
 
+        self.library_button = tk.Button(root, text="Index Library", command=self.index_library)
+        self.library_button.pack(pady=10)
+
+        self.library_label = tk.Label(root, text="Library: not indexed")
+        self.library_label.pack(pady=5)
+
         self.play_button = tk.Button(root, text="Play", state=tk.DISABLED, command=self.play_audio)
         self.play_button.pack(pady=10)
 
@@ -48,6 +86,19 @@ class RealTimeAudioPlayer:
         self.current_hr_label = tk.Label(root, text="Current HR: Unknown")
         self.current_hr_label.pack(pady=5)
         
+        self.audio_stats_label = tk.Label(root, text="Underruns: 0 | Xruns: 0")
+        self.audio_stats_label.pack(pady=5)
+
+        self.fusion_stats_label = tk.Label(root, text="Fusion CPU: 0.0%")
+        self.fusion_stats_label.pack(pady=5)
+
+        self.phase_label = tk.Label(root, text="Beat phase: unlocked")
+        self.phase_label.pack(pady=5)
+
+        self.debug_button = tk.Button(root, text="Debug", command=self.open_debug_panel)
+        self.debug_button.pack(pady=5)
+        self.debug_panel = None
+
         self.mode_label = tk.Label(root, text="Current Mode: warmup")
         self.mode_label.pack(pady=10)
 
@@ -74,8 +125,34 @@ class RealTimeAudioPlayer:
         self.audio_data = None
         self.sample_rate = None
         self.song_bpm = None
-
+        self.beat_times = None
+        self.song_cache = song_cache if song_cache is not None else SongAnalysisCache()
+        self.library = None
+        self.bpm_index = None
+        # Playback rates are kept in this range, which also bounds the stretcher's work
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.crossfade_seconds = crossfade_seconds
+        self.preload_seconds = preload_seconds
+        self.recent_tracks = deque(maxlen=10)
+        self.preloading = threading.Event()
+        if os.path.exists(DEFAULT_INDEX_PATH):
+            self.library = LibraryIndex(cache=self.song_cache)
+            self.bpm_index = BpmIndex(self.library.tracks())
+        self.block_size = block_size
+        self.latency = latency
+        # Index or name fragment, resolved when playback starts (see find_output_device)
+        self.audio_device = audio_device
+        self.audio_output = None
+        self.playback_queue = None
+        # Pre-stretched copies of the playing and upcoming tracks, rendered in a background process
+        self.renderer = RenditionRenderer(self.song_cache, rendition_rates(min_rate, max_rate))
+
+        # Optional SessionWriter recording modes and playback speed for post-run analysis
+        self.session = session
         self.mode = "warmup"
+        if session is not None:
+            session.mode(time.time(), self.mode)
 
         self.resting_hr = 60
         self.warmed_hr = 120
@@ -83,23 +160,95 @@ class RealTimeAudioPlayer:
         self.hr_delta = self.warmed_hr - self.resting_hr
         self.hr_target = self.resting_hr + self.hr_delta * 1.5
 
-        # Start a thread to update speed based on cadence data
-        threading.Thread(target=self.update_speed_from_cadence, daemon=True).start()
+        self.resting_hr_readings = deque(maxlen=5)
+
+        # Footfall events nudge the rate so beats land on steps
+        self.phase_lock = PhaseLockController(
+            self.locate_song_position,
+            output_latency=lambda: self.audio_output.output_latency() if self.audio_output is not None else 0.0)
+
+        # Cadence and HR producers post into the controller, which wakes only when data arrives
+        self.fusion = FusionController(self.compute_speed, on_speed=self.on_speed_changed,
+                                       on_cadence=self.on_cadence_changed, on_hr=self.on_hr_reading,
+                                       control_rate=control_rate)
+
+        # Worker threads only write to this snapshot; the Tk thread redraws changed fields
+        self.ui_rate = ui_rate
+        self.ui_state = UIState()
+        self.ui_fields = {
+            "speed": (self.speed_label, "text", lambda v: f"Playback Speed: {v:.2f}x (controlled by cadence and HR data)"),
+            "bpm": (self.bpm_label, "text", lambda v: "Song BPM: Analysing..." if v is None else f"Song BPM: {int(v)} BPM"),
+            "cadence": (self.cadence_label, "text", lambda v: f"Cadence: {v:.2f} steps/min"),
+            "resting_hr": (self.resting_hr_label, "text", lambda v: f"Resting HR: {v}"),
+            "current_hr": (self.current_hr_label, "text", lambda v: f"Current HR: {v}"),
+            "mode": (self.mode_label, "text", lambda v: f"Current Mode: {v}"),
+            "audio_stats": (self.audio_stats_label, "text", lambda v: f"Underruns: {v[0]} | Xruns: {v[1]}"),
+            "fusion_stats": (self.fusion_stats_label, "text",
+                             lambda v: f"Fusion CPU: {v[0]:.1f}% | dropped {v[1]} | lag {v[2]:.0f} ms"),
+            "track_ready": (self.play_button, "state", lambda v: tk.NORMAL if v else tk.DISABLED),
+            "phase": (self.phase_label, "text", lambda v: "Beat phase: unlocked" if v is None else
+                      f"Beat phase: {v[0]:+.2f} beats | latency {v[1]:.0f} ms"),
+            "library": (self.library_label, "text", lambda v: f"Library: {v}"),
+            "library_busy": (self.library_button, "state", lambda v: tk.DISABLED if v else tk.NORMAL),
+        }
+        REGISTRY.gauge("fusion", self.fusion.stats)
+        REGISTRY.gauge("audio.output", lambda: self.audio_output.stats() if self.audio_output is not None else None)
+        REGISTRY.gauge("phase_lock", self.phase_lock.latency_budget)
+        REGISTRY.gauge("speed", lambda: self.current_speed)
+        self.refresh_ui()
+        self.fusion.start()
 
     def set_mode(self, mode):
         self.mode = mode
-        self.mode_label.config(text=f"Current Mode: {mode}")
-        print(f"Mode set to: {mode}")
+        self.ui_state.set(mode=mode)
+        if self.session is not None:
+            self.session.mode(time.time(), mode)
+        log.info("Mode set", extra={"mode": mode})
+        REGISTRY.trace("app.mode", mode=mode)
 
     def load_audio(self):
         file_path = filedialog.askopenfilename(filetypes=[("Audio Files", "*.wav *.mp3 *.flac *.ogg")])
         if file_path:
-            self.audio_file = file_path
-            self.audio_data, self.sample_rate = librosa.load(file_path, sr=None)
-            self.play_button.config(state=tk.NORMAL)
-            print(f"Loaded {file_path}")
+            self.ui_state.set(track_ready=False, bpm=None)
+            # Decoding and tempo analysis can take seconds on a cache miss; keep them off the Tk thread
+            threading.Thread(target=self.load_track, args=[file_path], daemon=True).start()
 
-        self.calculate_bpm()
+    def load_track(self, file_path):
+        try:
+            analysis = self.song_cache.load(file_path)
+        except Exception as e:
+            log.error("Could not load track", extra={"path": file_path, "error": str(e)})
+            return
+        self.audio_file = file_path
+        self.audio_data = analysis["audio"]
+        self.sample_rate = analysis["sample_rate"]
+        self.beat_times = analysis["beat_times"]
+        self.song_bpm = analysis["tempo"]
+        self.recent_tracks.append(os.path.abspath(file_path))
+        self.ui_state.set(bpm=self.song_bpm, track_ready=True)
+        log.info("Loaded track", extra={"path": file_path, "bpm": self.song_bpm})
+        self.renderer.submit(file_path)
+
+    def index_library(self):
+        directory = filedialog.askdirectory()
+        if directory:
+            self.ui_state.set(library_busy=True, library="scanning...")
+            threading.Thread(target=self.scan_library, args=[directory], daemon=True).start()
+
+    def scan_library(self, directory):
+        if self.library is None:
+            self.library = LibraryIndex(cache=self.song_cache)
+        try:
+            result = self.library.scan(
+                directory, progress=lambda done, total, path: self.ui_state.set(library=f"analysed {done}/{total}"))
+            self.bpm_index = BpmIndex(self.library.tracks())
+            self.ui_state.set(library=f"{len(self.bpm_index)} tracks "
+                                      f"({result['analyzed']} new, {result['failed']} failed)")
+        except Exception as e:
+            log.error("Library scan failed", extra={"error": str(e)})
+            self.ui_state.set(library="scan failed")
+        finally:
+            self.ui_state.set(library_busy=False)
 
     def play_audio(self):
         if self.audio_data is None:
@@ -118,171 +267,322 @@ class RealTimeAudioPlayer:
         self.stream = None
         self.stop_button.config(state=tk.DISABLED)
 
-    def calculate_bpm(self):
-        if self.audio_data is not None:
-            tempo = librosa.feature.tempo(y=self.audio_data, sr=self.sample_rate)[0]
-            self.song_bpm = tempo
-            self.bpm_label.config(text=f"Song BPM: {int(tempo)} BPM")
-            print(f"Calculated BPM for the song: {tempo} BPM")
+    def open_debug_panel(self):
+        from debug_panel import DebugPanel
+
+        if self.debug_panel is None or not self.debug_panel.winfo_exists():
+            self.debug_panel = DebugPanel(self.root, REGISTRY)
+        self.debug_panel.lift()
+
+    def refresh_ui(self):
+        if self.audio_output is not None:
+            stats = self.audio_output.stats()
+            self.ui_state.set(audio_stats=(stats['underruns'], stats['xruns']))
+        stats = self.fusion.stats()
+        inputs = (stats['cadence_input'], stats['hr_input'])
+        self.ui_state.set(fusion_stats=(round(stats['cpu_fraction'] * 100, 1),
+                                        sum(i['dropped'] + i['stale'] for i in inputs),
+                                        round(max(i['lag'] for i in inputs) * 1e3)))
+        if self.phase_lock.correction() != 1.0:
+            budget = self.phase_lock.latency_budget()
+            self.ui_state.set(phase=(round(self.phase_lock.phase_error, 2), round(budget["total_ms"])))
+        else:
+            self.ui_state.set(phase=None)
+
+        for name, value in self.ui_state.take_changes().items():
+            widget, option, formatter = self.ui_fields[name]
+            widget.config(**{option: formatter(value)})
+        self.root.after(int(1000 / self.ui_rate), self.refresh_ui)
+
+    def make_source(self, info, output_rate):
+        """
+        Play from precomputed renditions when all of them are on disk, otherwise stretch live.
+        :param info: Track dict as built by track_info.
+        :param output_rate: Sample rate of the running output stream.
+        """
+        path, audio, sample_rate = info["path"], info["audio"], info["sample_rate"]
+        renditions = self.song_cache.renditions(path) if path else {}
+        if len(renditions) >= len(self.renderer.rates):
+            return RenditionSource(renditions, sample_rate, output_rate, len(audio), info)
+        return StretchedSource(TrackSource(audio, sample_rate, output_rate, info))
+
+    @staticmethod
+    def track_info(path, analysis, tempo=None):
+        """
+        :return: Everything a source and the player need to know about one track, kept together so a
+            crossfade swaps all of it at once.
+        """
+        return {"path": path, "audio": analysis["audio"], "sample_rate": analysis["sample_rate"],
+                "tempo": analysis["tempo"] if tempo is None else tempo, "beat_times": analysis["beat_times"]}
+
+    def prerender_next_track(self):
+        """
+        Render the track preload_next_track is likely to pick, so it can play from renditions.
+        """
+        try:
+            cadence = self.fusion.cadence or self.song_bpm
+            choice = self.bpm_index.pick(cadence, exclude=self.recent_tracks)
+            if choice is not None:
+                self.song_cache.load(choice[0])
+                self.renderer.submit(choice[0])
+        except Exception as e:
+            log.warning("Could not prerender next track", extra={"error": str(e)})
+
+    def preload_next_track(self, playback_queue, output_rate):
+        """
+        Pick the library track that needs the least stretching at the current cadence,
+        make sure it is decoded, and queue it for a crossfade.
+        """
+        try:
+            cadence = self.fusion.cadence or self.song_bpm
+            choice = self.bpm_index.pick(cadence, exclude=self.recent_tracks)
+            if choice is None:
+                return
+            path, tempo, _ = choice
+            analysis = self.song_cache.load(path)
+            playback_queue.set_next(self.make_source(self.track_info(path, analysis, tempo), output_rate))
+            self.recent_tracks.append(path)
+            log.info("Queued next track", extra={"path": path, "bpm": tempo, "cadence": cadence})
+        except Exception as e:
+            log.warning("Could not queue next track", extra={"error": str(e)})
+        finally:
+            self.preloading.clear()
+
+    def on_track_switch(self, source):
+        # Stop then Play restarts from these, so they must all describe the same track
+        self.audio_file = source.info["path"]
+        self.audio_data = source.info["audio"]
+        self.sample_rate = source.info["sample_rate"]
+        self.beat_times = source.info["beat_times"]
+        self.song_bpm = source.info["tempo"]
+        self.ui_state.set(bpm=self.song_bpm)
+        REGISTRY.trace("app.track_switch", path=self.audio_file, bpm=self.song_bpm)
+        if self.bpm_index is not None:
+            threading.Thread(target=self.prerender_next_track, daemon=True).start()
+
+    def locate_song_position(self, wall_time):
+        """
+        Follow the audio clock back from a wall-clock time to the song position heard then.
+        :return: Tuple (seconds into the active track, its beat times), or None when not playing.
+        """
+        output, playback_queue = self.audio_output, self.playback_queue
+        if output is None or playback_queue is None:
+            return None
+        # Sources stretch before mixing, so output frames and mixed stream samples coincide
+        frame = output.frame_at(wall_time)
+        if frame is None:
+            return None
+        seconds, source = playback_queue.track_position(frame)
+        if seconds is None or seconds < 0:
+            return None
+        return seconds, source.info.get("beat_times")
 
     def audio_playback(self):
-        chunk_size = int(self.sample_rate * 0.1)
-        playback_pos = 0
+        import sounddevice as sd
+
+        try:
+            device = find_output_device(self.audio_device)
+        except ValueError as e:
+            log.error("Audio device not found", extra={"error": str(e)})
+            return
+        # The stream keeps the rate of the track it started with; later tracks are resampled to it
+        output_rate = self.sample_rate
+        chunk_size = int(output_rate * 0.1)
+        # Mixes the current track with the queued one, so track changes are gapless
+        info = {"path": self.audio_file, "audio": self.audio_data, "sample_rate": self.sample_rate,
+                "tempo": self.song_bpm, "beat_times": self.beat_times}
+        # Each source stretches itself: from precomputed renditions when available, otherwise with
+        # a streaming phase vocoder that keeps its state across chunks so the rate can change per block
+        source = self.make_source(info, output_rate)
+        playback_queue = PlaybackQueue(source, crossfade_seconds=self.crossfade_seconds,
+                                       on_switch=self.on_track_switch)
+        # This thread only produces audio; the stream callback copies it out of a ring buffer
+        output = CallbackAudioOutput(output_rate, block_size=self.block_size, latency=self.latency,
+                                     device=device)
+        self.audio_output = output
+        self.playback_queue = playback_queue
+        if self.bpm_index is not None:
+            threading.Thread(target=self.prerender_next_track, daemon=True).start()
 
         try:
-            with sd.OutputStream(samplerate=self.sample_rate, channels=1) as stream:
-                while not self.stop_flag.is_set() and playback_pos < len(self.audio_data):
-                    end_pos = min(playback_pos + chunk_size, len(self.audio_data))
-                    chunk = self.audio_data[playback_pos:end_pos]
-                    if len(chunk) == 0:
-                        break
-                    stretched_chunk = librosa.effects.time_stretch(chunk, rate=self.current_speed)
-                    stream.write(stretched_chunk.astype(np.float32))
-                    playback_pos = end_pos
+            output.start()
+            while not self.stop_flag.is_set():
+                if (self.bpm_index is not None and playback_queue.next is None
+                        and playback_queue.remaining_seconds() < self.preload_seconds
+                        and not self.preloading.is_set()):
+                    self.preloading.set()
+                    threading.Thread(target=self.preload_next_track, args=[playback_queue, output_rate],
+                                     daemon=True).start()
+
+                render_start = time.perf_counter()
+                self.phase_lock.process_pending()
+                rate = self.current_speed * self.phase_lock.correction()
+                playback_queue.rate = min(max(rate, self.min_rate), self.max_rate)
+                chunk = playback_queue.read(chunk_size)
+                if len(chunk) == 0:
+                    break
+                write_start = time.perf_counter()
+                _render_seconds.observe(write_start - render_start)
+                output.write(chunk, self.stop_flag)
+                _write_wait_seconds.observe_since(write_start)
+            if not self.stop_flag.is_set():
+                output.drain(self.stop_flag)
         except sd.PortAudioError as e:
-            print(f"PortAudioError: {e}")
+            log.error("PortAudio error", extra={"error": str(e)})
         except Exception as e:
-            print(f"Unexpected error during playback: {e}")
+            log.exception("Unexpected error during playback")
+        finally:
+            self.playback_queue = None
+            output.stop()
     
-    def resting_mode(self):
-        resting_hr = list()
-
-        while self.mode == "resting":
-                try:
-                    hr_data = self.bluetooth_queue.get_nowait()
-                except queue.Empty:
-                    print("No HR data received.")
-                    continue
-        
-                resting_hr.append(hr_data)
-                resting_hr = resting_hr[-5:]
-                self.resting_hr = sum(resting_hr) / 5
-                self.resting_hr_label.config(text=f"Resting HR: {self.resting_hr}")
-            
-
+    def resting_mode(self, hr_data):
+        self.resting_hr_readings.append(hr_data)
+        self.resting_hr = sum(self.resting_hr_readings) / len(self.resting_hr_readings)
+        self.ui_state.set(resting_hr=self.resting_hr)
 
         self.hr_delta = self.warmed_hr - self.resting_hr
         self.hr_target = self.resting_hr + self.hr_delta * 1.5
-        return
     
-    def workout_mode(self, cadence_avg, hr_data):
+    def workout_mode(self, cadence_avg, hr_data, bpm):
         if hr_data < self.hr_target and cadence_avg < 180:
-            new_speed = (cadence_avg + 5) / self.song_bpm
+            new_speed = (cadence_avg + 5) / bpm
         else:
-            new_speed = cadence_avg / self.song_bpm
+            new_speed = cadence_avg / bpm
         return new_speed
     
-    def slowdown_mode(self, cadence_avg, hr_data):
+    def slowdown_mode(self, cadence_avg, hr_data, bpm):
         if hr_data > self.resting_hr:
-            new_speed = (cadence_avg - 5) / self.song_bpm
+            new_speed = (cadence_avg - 5) / bpm
         else:
-            new_speed = cadence_avg / self.song_bpm
+            new_speed = cadence_avg / bpm
         return new_speed
 
 
 
-    def update_speed_from_cadence(self):
-        cadence_chunk = []
-
-        while True:
-
-            try:                
-                try:
-                    cadence_data = self.cadence_queue.get_nowait()
-                except queue.Empty:
-                    pass
-                
-                try:
-                    hr_data = self.bluetooth_queue.get_nowait()
-                    self.current_hr_label.config(text=f"Current HR: {hr_data}")
-                except queue.Empty:
-                    pass
-                
-                print(cadence_data)
-                cadence_chunk.append(cadence_data)
-                
-                if len(cadence_chunk) >= 20:
-                    cadence_avg = sum(cadence_chunk[-20:]) / 20
-                    self.cadence_label.config(text=f"Cadence: {cadence_avg:.2f} steps/min")
-                    cadence_chunk = []                
-                
-                
-                if self.mode == "resting":
-                    self.resting_mode()
-
-                if self.song_bpm and cadence_data > 0:
-
-                    if self.mode == "warmup":
-                        new_speed = cadence_avg / self.song_bpm
-                    
-                    elif self.mode == "workout":
-                        new_speed = self.workout_mode(cadence_avg, hr_data)
-
-                    elif self.mode == "slow down":
-                        new_speed = self.slowdown_mode(cadence_avg, hr_data)
-                    
-                    else:
-                        new_speed = 1.0
-
-                    self.current_speed = new_speed
-                    self.speed_label.config(text=f"Playback Speed: {new_speed:.2f}x (controlled by cadence and HR data)")
-                    print(f"Updated speed to {new_speed:.2f}x based on cadence and HR data.")
-            except queue.Empty:
-                continue
-            except AttributeError as e:
-                print(f"Attribute error: {e}")
-                continue
-
-    """
-    def update_speed_from_cadence(self):
-        cadence_chunk = []
-        while True:
+    def compute_speed(self, cadence_avg, hr_data):
+        if not self.song_bpm or self.mode == "resting":
+            return None
+
+        # Match against half or double time when that needs less stretching
+        bpm = nearest_alias(self.song_bpm, cadence_avg)
+        self.phase_lock.beats_per_step = self.song_bpm / bpm
+        if self.mode == "warmup" or hr_data is None:
+            new_speed = cadence_avg / bpm
+        elif self.mode == "workout":
+            new_speed = self.workout_mode(cadence_avg, hr_data, bpm)
+        elif self.mode == "slow down":
+            new_speed = self.slowdown_mode(cadence_avg, hr_data, bpm)
+        else:
+            new_speed = 1.0
+        return min(max(new_speed, self.min_rate), self.max_rate)
+
+    def on_hr_reading(self, hr_data):
+        self.ui_state.set(current_hr=hr_data)
+        if self.mode == "resting":
+            self.resting_mode(hr_data)
+
+    def on_cadence_changed(self, cadence_avg):
+        self.ui_state.set(cadence=round(cadence_avg, 2))
+
+    def on_speed_changed(self, new_speed):
+        self.current_speed = new_speed
+        self.ui_state.set(speed=round(new_speed, 2))
+        if self.session is not None:
+            self.session.speed(time.time(), new_speed)
+        log.debug("Updated speed", extra={"speed": new_speed})
+
+if __name__ == '__main__':
+    started = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Real-time audio speed control from cadence and heart rate")
+    parser.add_argument("--multiprocess", action="store_true",
+                        help="run UDP/cadence and Bluetooth ingestion in separate processes")
+    parser.add_argument("--audio-device", default=None,
+                        help="output device index or name fragment (default: $JOGMUSIC_AUDIO_DEVICE, "
+                             "else the system default)")
+    parser.add_argument("--cadence-server", nargs="?", const=runner_server.DEFAULT_SOCKET, default=None,
+                        metavar="SOCKET", help="take cadence from a shared runner_server instead of the phone")
+    parser.add_argument("--runner", default=None,
+                        help="with --cadence-server: runner to follow, e.g. session-7 or 192.168.1.20:50123 "
+                             "(default: the first runner seen)")
+    parser.add_argument("--udp-host", default="192.168.22.72", help="address to receive phone packets on")
+    parser.add_argument("--udp-port", type=int, default=12345)
+    parser.add_argument("--session-log", default=None,
+                        help="session file to record this run to (default: a new file in "
+                             "~/.cache/jogmusic/sessions; inspect with session_log.py)")
+    parser.add_argument("--no-session-log", action="store_true", help="do not record the run")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve metrics as JSON on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-socket", default=None, help="serve metrics on this UNIX socket")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+
+    configure_logging(args.log_level.upper())
+    if args.metrics_port is not None:
+        serve_http(args.metrics_port)
+    if args.metrics_socket is not None:
+        serve_unix(args.metrics_socket)
+
+    session = None
+    if not args.no_session_log:
+        session = SessionWriter(args.session_log or session_path())
+        REGISTRY.gauge("session", session.stats)
+        log.info("Recording session", extra={"path": session.path})
+
+    # Create the application
+    root = tk.Tk()
+    app = RealTimeAudioPlayer(root, audio_device=args.audio_device, session=session)
+    supervisor = None
+
+    def start_sensors():
+        """Bind the sensor inputs and load the slow modules once the window is on screen."""
+        global supervisor
+        log.info("Window ready", extra={"startup_s": time.perf_counter() - started})
+        REGISTRY.trace("app.window_ready", seconds=time.perf_counter() - started)
+        address = (args.udp_host, args.udp_port)
+        if args.cadence_server:
+            # A group session: the server owns the phones, this player follows one runner
+            threading.Thread(target=preload_modules, args=[("sounddevice",)], daemon=True).start()
+            threading.Thread(target=runner_server.subscribe, args=[app.fusion.cadence_input],
+                             kwargs={"runner": args.runner, "socket_path": args.cadence_server,
+                                     "stride_queue": app.phase_lock.input}, daemon=True).start()
+            threading.Thread(target=bluetooth_receive.main, args = [app.fusion.hr_input],
+                             kwargs = {"session": session}, daemon=True).start()
+        elif args.multiprocess:
+            # Sensor workers stream records over shared memory; this process only plays and draws
+            # Each worker records its own streams next to the app's session file
+            stem = os.path.splitext(session.path)[0] if session is not None else None
+            workers = {
+                "cadence": functools.partial(cadence_worker, address=address,
+                                             session_path=stem and stem + ".cadence.jms"),
+                "hr": functools.partial(hr_worker, session_path=stem and stem + ".hr.jms"),
+            }
+            supervisor = PipelineSupervisor({CADENCE: app.fusion.cadence_input, STRIDE: app.phase_lock.input,
+                                             HR: app.fusion.hr_input}, workers=workers)
+            supervisor.start()
+            threading.Thread(target=preload_modules, args=[("sounddevice",)], daemon=True).start()
+        else:
+            # Start the sensor threads; they post straight into the fusion controller
+            threading.Thread(target=preload_modules, daemon=True).start()
             try:
-                print(self.cadence_queue.qsize())
-                cadence_data = self.cadence_queue.get(timeout=1) if not self.cadence_queue.empty() else 0
-                print(self.bluetooth_queue.qsize())
-                hr_data = self.bluetooth_queue.get_nowait() if not self.bluetooth_queue.empty() else None
-
-                print("Cadence Data: ", cadence_data)
-                print("HR Data: ", hr_data)
-
-                cadence_chunk.append(cadence_data)
-                if len(cadence_chunk) >= 30:
-                    cadence_avg = sum(cadence_chunk[-30:]) / 30
-                    self.cadence_label.config(text=f"Cadence: {cadence_avg:.2f} steps/min")
-                    cadence_chunk = []
-
-                if self.song_bpm and cadence_avg > 0:
-                    mode_functions = {
-                        "resting": self.resting_mode,
-                        "warmup": lambda: cadence_avg / self.song_bpm,
-                        "workout": lambda: self.workout_mode(cadence_avg, hr_data),
-                        "slow down": lambda: self.slowdown_mode(cadence_avg, hr_data)
-                    }
-                    new_speed = mode_functions.get(self.mode, lambda: 1.0)()
-                    with self.lock:
-                        self.current_speed = new_speed
-                    self.speed_label.config(text=f"Playback Speed: {new_speed:.2f}x (controlled by cadence and HR data)")
-                    print(f"Updated speed to {new_speed:.2f}x based on cadence and HR data.")
-
-            except queue.Empty:
-                continue
-            except Exception as e:
-                print(f"Error in cadence update: {e}")
-    """
-# Initialize the cadence queue
-cadence_queue = queue.Queue()
-sock = cadence_inference.wifi_connect()
-
-
-
-# Start the cadence thread
-threading.Thread(target=cadence_inference.main, args = [sock, cadence_queue], daemon=True).start()
-
-bluetooth_queue = queue.Queue()
-threading.Thread(target=bluetooth_receive.main, args = [bluetooth_queue], daemon=True).start()
-
-# Create the application
-root = tk.Tk()
-app = RealTimeAudioPlayer(root, cadence_queue, bluetooth_queue)
-root.mainloop()
+                sock = cadence_inference.wifi_connect(*address)
+            except OSError as e:
+                log.error("Could not listen for phone packets", extra={"address": address, "error": str(e)})
+            else:
+                threading.Thread(target=cadence_inference.main, args = [sock, app.fusion.cadence_input],
+                                 kwargs = {"stride_queue": app.phase_lock.input, "session": session},
+                                 daemon=True).start()
+            threading.Thread(target=bluetooth_receive.main, args = [app.fusion.hr_input],
+                             kwargs = {"session": session}, daemon=True).start()
+
+    def on_close():
+        if supervisor is not None:
+            supervisor.stop()
+        app.renderer.shutdown()
+        if session is not None:
+            session.close()
+        root.destroy()
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    # Runs after the first redraw, so nothing below delays the window appearing
+    root.after_idle(start_sensors)
+
+    root.mainloop()
@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+import numpy as np
+
+# sounddevice is imported on first use: loading PortAudio and probing the host APIs is slow
+
+DEVICE_ENV_VAR = "JOGMUSIC_AUDIO_DEVICE"
+
+
+def find_output_device(spec=None):
+    """
+    Resolve an output device from a configured index or name.
+    :param spec: Device index, or a case-insensitive fragment of its name. Defaults to the
+        JOGMUSIC_AUDIO_DEVICE environment variable; if neither is set the system default is used.
+    :return: Device index, or None for the system default.
+    :raises ValueError: If no output device matches spec.
+    """
+    import sounddevice as sd
+
+    if spec is None:
+        spec = os.environ.get(DEVICE_ENV_VAR) or None
+    if spec is None:
+        return None
+    if isinstance(spec, int) or str(spec).isdigit():
+        return int(spec)
+    devices = sd.query_devices()
+    for index, device in enumerate(devices):
+        if device["max_output_channels"] > 0 and str(spec).lower() in device["name"].lower():
+            return index
+    names = ", ".join(d["name"] for d in devices if d["max_output_channels"] > 0)
+    raise ValueError(f"No output device matches {spec!r} (available: {names})")
+
+
+class AudioRingBuffer:
+    """
+    Single-producer/single-consumer ring buffer over a preallocated float32 array.
+
+    The producer only advances the write counter and the consumer only advances
+    the read counter, so neither side takes a lock. Counters grow monotonically
+    and are reduced modulo the capacity when indexing.
+    """
+
+    def __init__(self, capacity):
+        """
+        :param capacity: Number of samples the buffer can hold.
+        """
+        self.capacity = int(capacity)
+        self._data = np.zeros(self.capacity, dtype=np.float32)
+        self._write_count = 0
+        self._read_count = 0
+
+    def available(self):
+        """Number of samples ready to be read."""
+        return self._write_count - self._read_count
+
+    def free(self):
+        """Number of samples that can be written without overwriting unread data."""
+        return self.capacity - self.available()
+
+    def write(self, samples):
+        """
+        Copy as many samples as fit into the buffer.
+        :param samples: 1-D float32 array.
+        :return: Number of samples written.
+        """
+        n = min(len(samples), self.free())
+        if n <= 0:
+            return 0
+        start = self._write_count % self.capacity
+        first = min(n, self.capacity - start)
+        self._data[start:start + first] = samples[:first]
+        if n > first:
+            self._data[:n - first] = samples[first:n]
+        self._write_count += n
+        return n
+
+    def read_into(self, out):
+        """
+        Copy up to len(out) samples into out.
+        :param out: 1-D float32 array to fill.
+        :return: Number of samples copied.
+        """
+        n = min(len(out), self.available())
+        if n <= 0:
+            return 0
+        start = self._read_count % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._data[start:start + first]
+        if n > first:
+            out[first:n] = self._data[:n - first]
+        self._read_count += n
+        return n
+
+    def clear(self):
+        """Discard unread samples. Only call while the consumer is stopped."""
+        self._read_count = self._write_count
+
+
+class CallbackAudioOutput:
+    """
+    sounddevice output stream fed from an AudioRingBuffer.
+
+    The stream callback runs on the PortAudio thread and only copies samples out
+    of the ring buffer, so stalls in Python threads delay the producer but not
+    the audio device as long as the buffer holds enough audio. start() opens
+    the device, but the stream only runs once write() has prefilled the ring
+    buffer, so playback does not begin with underruns.
+    """
+
+    def __init__(self, sample_rate, block_size=1024, latency=0.05, buffer_seconds=0.5, device=None,
+                 prefill_blocks=2):
+        """
+        :param sample_rate: Output sample rate in Hz.
+        :param block_size: Frames per callback.
+        :param latency: Device latency in seconds, or 'low'/'high'.
+        :param buffer_seconds: Capacity of the ring buffer in seconds.
+        :param device: sounddevice device id or name, None for the default device.
+        :param prefill_blocks: Blocks queued before the stream starts.
+        """
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.latency = latency
+        self.device = device
+        self.ring = AudioRingBuffer(max(int(sample_rate * buffer_seconds), 2 * block_size))
+        self.prefill = min(prefill_blocks * block_size, self.ring.capacity)
+
+        self.underruns = 0  # callbacks that found the ring buffer short
+        self.xruns = 0      # underflows reported by PortAudio itself
+        self.frames_played = 0
+        # (output frame, wall-clock time it reaches the DAC) for the latest callback
+        self._dac_anchor = None
+        self._draining = threading.Event()
+        self._stream = None
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            self.xruns += 1
+        # Translate PortAudio's stream clock into time.time() for the first frame of this block
+        dac_time = time.time() + (time_info.outputBufferDacTime - time_info.currentTime)
+        self._dac_anchor = (self.frames_played, dac_time)
+        out = outdata[:, 0]
+        n = self.ring.read_into(out)
+        if n < frames:
+            out[n:] = 0
+            if not self._draining.is_set():
+                self.underruns += 1
+        self.frames_played += n
+
+    def start(self):
+        import sounddevice as sd
+
+        self._draining.clear()
+        self._stream = sd.OutputStream(samplerate=self.sample_rate, channels=1, dtype='float32',
+                                       blocksize=self.block_size, latency=self.latency,
+                                       device=self.device, callback=self._callback)
+
+    def _start_stream(self):
+        if self._stream is not None and not self._stream.active:
+            self._stream.start()
+
+    def write(self, samples, stop_event=None):
+        """
+        Block until all samples are queued, sleeping while the ring buffer is full.
+        :param samples: 1-D float32 array.
+        :param stop_event: Optional threading.Event that aborts the wait.
+        :return: False if stop_event was set before everything was queued.
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        wait = self.block_size / self.sample_rate
+        pos = 0
+        while pos < len(samples):
+            if stop_event is not None and stop_event.is_set():
+                return False
+            written = self.ring.write(samples[pos:])
+            pos += written
+            if self.ring.available() >= self.prefill:
+                self._start_stream()
+            if pos < len(samples):
+                if stop_event is not None:
+                    stop_event.wait(wait)
+                else:
+                    time.sleep(wait)
+        return True
+
+    def drain(self, stop_event=None):
+        """Wait until the ring buffer has been played out."""
+        self._draining.set()
+        self._start_stream()  # in case less than the prefill was ever written
+        wait = self.block_size / self.sample_rate
+        while self.ring.available() > 0:
+            if stop_event is None:
+                time.sleep(wait)
+            elif stop_event.wait(wait):
+                return
+
+    def stop(self):
+        self._draining.set()
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+        self.ring.clear()
+        self._dac_anchor = None
+
+    def frame_at(self, wall_time):
+        """
+        :param wall_time: A time.time() value.
+        :return: Index of the output frame audible at wall_time, or None before the first callback.
+        """
+        anchor = self._dac_anchor
+        if anchor is None:
+            return None
+        frame, dac_time = anchor
+        return frame + (wall_time - dac_time) * self.sample_rate
+
+    def output_latency(self):
+        """
+        :return: Seconds between queueing a sample and hearing it (ring buffer fill plus device latency).
+        """
+        device_latency = self._stream.latency if self._stream is not None else 0.0
+        return self.ring.available() / self.sample_rate + device_latency
+
+    def stats(self):
+        """
+        :return: Dict with underrun and xrun counters, buffered seconds and played frames.
+        """
+        return {
+            "underruns": self.underruns,
+            "xruns": self.xruns,
+            "buffered_seconds": self.ring.available() / self.sample_rate,
+            "frames_played": self.frames_played,
+        }
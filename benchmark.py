@@ -0,0 +1,757 @@
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+from time_stretch import StreamingTimeStretcher
+from cadence_inference import (StreamingStrideEstimator, estimate_stride_rate, SampleRingBuffer, TimestampRing,
+                               UniformResampler)
+
+
+def bench_time_stretch(rates=(0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.3, 1.4, 1.5), sample_rate=44100,
+                       duration=10.0, chunk_seconds=0.1):
+    """
+    Measure the real-time factor of the streaming stretcher at several rates.
+    A real-time factor below 1 means processing is faster than playback.
+    :param rates: Stretch rates to test.
+    :param sample_rate: Sample rate of the synthetic test signal in Hz.
+    :param duration: Length of the test signal in seconds.
+    :param chunk_seconds: Size of the chunks fed to the stretcher in seconds.
+    :return: List of dicts with rate, output seconds, elapsed seconds and real-time factor.
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sample_rate * duration)) / sample_rate
+    signal = (0.5 * np.sin(2 * np.pi * 440 * t) + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+    chunk_size = int(sample_rate * chunk_seconds)
+
+    results = []
+    for rate in rates:
+        stretcher = StreamingTimeStretcher(rate=rate)
+        produced = 0
+        start = time.perf_counter()
+        for pos in range(0, len(signal), chunk_size):
+            produced += len(stretcher.process(signal[pos:pos + chunk_size]))
+        elapsed = time.perf_counter() - start
+        output_seconds = produced / sample_rate
+        results.append({
+            "rate": rate,
+            "output_seconds": output_seconds,
+            "elapsed_seconds": elapsed,
+            "real_time_factor": elapsed / output_seconds if output_seconds else float("inf"),
+        })
+    return results
+
+
+def print_time_stretch(results):
+    print(f"{'rate':>6} {'output s':>10} {'elapsed s':>10} {'RTF':>8}")
+    for r in results:
+        print(f"{r['rate']:>6.2f} {r['output_seconds']:>10.2f} {r['elapsed_seconds']:>10.3f} {r['real_time_factor']:>8.4f}")
+
+
+def bench_renditions(rates=(0.85, 1.0, 1.15), sample_rate=44100, duration=10.0, chunk_seconds=0.1):
+    """
+    Compare real-time playback cost of live stretching with reading precomputed renditions.
+    The rate wobbles around each base rate so rendition switches and crossfades are included.
+    :return: List of dicts with rate, live and rendition real-time factors and the one-off render time.
+    """
+    from renditions import RenditionSource, render_rendition, rendition_rates
+    from track_selector import StretchedSource, TrackSource
+
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sample_rate * duration)) / sample_rate
+    signal = (0.5 * np.sin(2 * np.pi * 440 * t) + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+    start = time.perf_counter()
+    renditions = {rate: render_rendition(signal, rate) for rate in rendition_rates()}
+    render_seconds = time.perf_counter() - start
+    chunk_size = int(sample_rate * chunk_seconds)
+
+    results = []
+    for rate in rates:
+        factors = {}
+        for name, source in (("live", StretchedSource(TrackSource(signal, sample_rate, sample_rate))),
+                             ("rendition", RenditionSource(renditions, sample_rate, sample_rate, len(signal)))):
+            produced = 0
+            start = time.perf_counter()
+            for i in range(int(duration / chunk_seconds)):
+                source.rate = rate * (1 + 0.05 * np.sin(i / 10))
+                chunk = source.read(chunk_size)
+                if len(chunk) == 0:
+                    break
+                produced += len(chunk)
+            factors[name] = (time.perf_counter() - start) / (produced / sample_rate)
+        results.append({
+            "rate": rate,
+            "live_rtf": factors["live"],
+            "rendition_rtf": factors["rendition"],
+            "render_seconds": render_seconds,
+        })
+    return results
+
+
+def print_renditions(results):
+    print(f"{'rate':>6} {'live RTF':>10} {'rendition RTF':>14}   (rendering all rates once: "
+          f"{results[0]['render_seconds']:.2f} s)")
+    for r in results:
+        print(f"{r['rate']:>6.2f} {r['live_rtf']:>10.4f} {r['rendition_rtf']:>14.5f}")
+
+
+def synthetic_gait(cadence, sampling_rate, duration, amplitude=14.0, noise=0.5, seed=0):
+    """
+    Generate (n, 3) accelerometer samples for steady running at a known cadence.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(sampling_rate * duration)) / sampling_rate
+    samples = np.zeros((len(t), 3))
+    samples[:, 2] = 9.8 + amplitude * np.sin(2 * np.pi * cadence / 60 * t)
+    samples += noise * rng.standard_normal(samples.shape)
+    return samples
+
+
+def bench_cadence(cadences=(150, 165, 180), sampling_rate=50, duration=30.0, buffer_size=100):
+    """
+    Compare per-sample latency and cadence of the batch and streaming estimators.
+    :return: List of dicts, one per cadence, with latencies in microseconds and both estimates.
+    """
+    results = []
+    for cadence in cadences:
+        samples = synthetic_gait(cadence, sampling_rate, duration)
+
+        buffer = []
+        batch_rates = []
+        start = time.perf_counter()
+        for sample in samples:
+            buffer.append(sample)
+            if len(buffer) > buffer_size:
+                buffer.pop(0)
+            try:
+                result = estimate_stride_rate(buffer, sampling_rate)
+            except ValueError:
+                # filtfilt rejects buffers shorter than its padding, as in main()
+                continue
+            if result is not None:
+                batch_rates.append(result[0])
+        batch_us = (time.perf_counter() - start) / len(samples) * 1e6
+
+        estimator = StreamingStrideEstimator(window=buffer_size)
+        streaming_rates = []
+        start = time.perf_counter()
+        for sample in samples:
+            estimator.update(sample, sampling_rate)
+            if estimator.stride_rate is not None:
+                streaming_rates.append(estimator.stride_rate)
+        streaming_us = (time.perf_counter() - start) / len(samples) * 1e6
+
+        batch_rate = float(np.median(batch_rates)) if batch_rates else None
+        streaming_rate = float(np.median(streaming_rates)) if streaming_rates else None
+        results.append({
+            "true_cadence": cadence,
+            "batch_cadence": batch_rate,
+            "streaming_cadence": streaming_rate,
+            "batch_us_per_sample": batch_us,
+            "streaming_us_per_sample": streaming_us,
+        })
+    return results
+
+
+def print_cadence(results):
+    print(f"{'true':>6} {'batch':>8} {'stream':>8} {'batch us':>10} {'stream us':>10}")
+    for r in results:
+        batch = f"{r['batch_cadence']:.1f}" if r['batch_cadence'] is not None else "-"
+        streaming = f"{r['streaming_cadence']:.1f}" if r['streaming_cadence'] is not None else "-"
+        print(f"{r['true_cadence']:>6} {batch:>8} {streaming:>8} "
+              f"{r['batch_us_per_sample']:>10.1f} {r['streaming_us_per_sample']:>10.1f}")
+
+
+def gait_trace(segments, sampling_rate=50, jitter=0.0, noise=0.5, seed=0):
+    """
+    Generate accelerometer samples for a run made of consecutive segments.
+    The step phase is continuous across segments, so a change of cadence
+    looks like a real walk-to-run transition rather than a jump.
+    :param segments: List of (seconds, cadence, amplitude) tuples.
+    :param sampling_rate: Nominal sampling rate in Hz.
+    :param jitter: Standard deviation of the sample timing error, as a fraction of the interval.
+    :param noise: Standard deviation of the sensor noise in m/s^2.
+    :return: Tuple (timestamps, samples, true cadence per sample).
+    """
+    rng = np.random.default_rng(seed)
+    n = int(sampling_rate * sum(seconds for seconds, _, _ in segments))
+    nominal = np.arange(n) / sampling_rate
+    # Samples are taken at the jittered times but delivered as if they were uniform,
+    # which is what a phone with an irregular sensor clock does
+    timestamps = nominal + jitter / sampling_rate * rng.standard_normal(n)
+    timestamps = np.maximum.accumulate(timestamps)
+
+    boundaries = np.cumsum([seconds for seconds, _, _ in segments])
+    index = np.minimum(np.searchsorted(boundaries, timestamps, side='right'), len(segments) - 1)
+    cadence = np.array([c for _, c, _ in segments], dtype=np.float64)[index]
+    amplitude = np.array([a for _, _, a in segments], dtype=np.float64)[index]
+    phase = 2 * np.pi * np.cumsum(cadence / 60 * np.diff(timestamps, prepend=0.0))
+
+    samples = np.zeros((n, 3))
+    samples[:, 2] = 9.8 + amplitude * np.sin(phase)
+    samples += noise * rng.standard_normal(samples.shape)
+    return timestamps, samples, cadence
+
+
+# name -> (segments, sampling rate, timing jitter, noise)
+SCENARIOS = {
+    "steady_150": ([(30, 150, 14.0)], 50, 0.0, 0.5),
+    "steady_165": ([(30, 165, 14.0)], 50, 0.0, 0.5),
+    "steady_180": ([(30, 180, 14.0)], 50, 0.0, 0.5),
+    "noisy_165": ([(30, 165, 14.0)], 50, 0.0, 3.0),
+    "jitter_165": ([(30, 165, 14.0)], 50, 0.3, 0.5),
+    "fast_sensor_165": ([(30, 165, 14.0)], 200, 0.0, 0.5),
+    "walk_to_run": ([(20, 115, 9.0), (20, 170, 14.0)], 50, 0.1, 0.5),
+}
+
+
+class _BatchVariant:
+    """Refilters the last window of samples on every block, like main(streaming=False)."""
+
+    def __init__(self, window=100, resample_rate=None, **params):
+        self.buffer = SampleRingBuffer(window)
+        self.times = TimestampRing(window)
+        self.resampler = UniformResampler(resample_rate) if resample_rate else None
+        self.params = params
+
+    def process(self, timestamps, samples):
+        self.times.extend(timestamps)
+        sampling_rate = self.times.sampling_rate() or 50
+        if self.resampler is not None:
+            timestamps, samples = self.resampler.process(timestamps, samples)
+            sampling_rate = self.resampler.rate
+        self.buffer.extend(samples)
+        try:
+            result = estimate_stride_rate(self.buffer.view(), sampling_rate, **self.params)
+        except ValueError:
+            return None
+        return result[0] if result is not None else None
+
+
+class _StreamingVariant:
+    """StreamingStrideEstimator fed block by block, like main(streaming=True)."""
+
+    def __init__(self, window=100, resample_rate=None, **params):
+        self.estimator = StreamingStrideEstimator(window=window, **params)
+        self.times = TimestampRing(window)
+        self.resampler = UniformResampler(resample_rate) if resample_rate else None
+
+    def process(self, timestamps, samples):
+        self.times.extend(timestamps)
+        sampling_rate = self.times.sampling_rate() or 50
+        if self.resampler is not None:
+            timestamps, samples = self.resampler.process(timestamps, samples)
+            sampling_rate = self.resampler.rate
+        self.estimator.update_block(samples, sampling_rate, timestamps)
+        return self.estimator.stride_rate
+
+
+# name -> factory of an object with process(timestamps, samples) -> cadence or None
+ESTIMATORS = {
+    "batch": lambda: _BatchVariant(),
+    "batch_resampled": lambda: _BatchVariant(resample_rate=50),
+    "streaming": lambda: _StreamingVariant(),
+    "streaming_resampled": lambda: _StreamingVariant(resample_rate=50),
+    "streaming_resampled_h4": lambda: _StreamingVariant(resample_rate=50, height=4),
+}
+
+
+def _run_estimator(factory, timestamps, samples, block_size):
+    estimator = factory()
+    estimates = []
+    block_times = []
+    for start in range(0, len(samples), block_size):
+        stop = start + block_size
+        begin = time.perf_counter()
+        cadence = estimator.process(timestamps[start:stop], samples[start:stop])
+        block_times.append(time.perf_counter() - begin)
+        estimates.append((min(stop, len(samples)) - 1, cadence))
+    return estimates, np.array(block_times)
+
+
+def bench_cadence_suite(scenarios=None, estimators=None, traces=(), block_size=5, warmup=5.0):
+    """
+    Run every estimator variant over every scenario and recorded trace.
+    :param scenarios: Dict like SCENARIOS; defaults to all of them.
+    :param estimators: Dict like ESTIMATORS; defaults to all of them.
+    :param traces: (path, true cadence or None) pairs of replay.py recordings.
+    :param block_size: Samples handed to the estimator per call, like one drain() in main().
+    :param warmup: Seconds at the start of each trace excluded from the error.
+    :return: List of dicts with one result per (scenario, estimator): us_per_sample,
+        samples_per_sec, p99_block_us, peak_memory_kib, coverage and, when the true
+        cadence is known, mean_abs_error and p95_abs_error in steps per minute.
+    """
+    scenarios = SCENARIOS if scenarios is None else scenarios
+    estimators = ESTIMATORS if estimators is None else estimators
+
+    inputs = []
+    for name, (segments, sampling_rate, jitter, noise) in scenarios.items():
+        inputs.append((name, *gait_trace(segments, sampling_rate, jitter, noise)))
+    if traces:
+        from replay import recorded_samples
+        for path, cadence in traces:
+            timestamps, samples = recorded_samples(path)
+            truth = np.full(len(samples), cadence, dtype=np.float64) if cadence is not None else None
+            inputs.append((path, timestamps, samples, truth))
+
+    results = []
+    for name, timestamps, samples, truth in inputs:
+        if len(samples) == 0:
+            continue
+        for variant, factory in estimators.items():
+            estimates, block_times = _run_estimator(factory, timestamps, samples, block_size)
+            # Memory is measured in a second pass so tracing does not distort the timings
+            tracemalloc.start()
+            _run_estimator(factory, timestamps, samples, block_size)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            scored = [(i, c) for i, c in estimates if timestamps[i] - timestamps[0] >= warmup]
+            valid = [(i, c) for i, c in scored if c is not None]
+            result = {
+                "trace": name,
+                "estimator": variant,
+                "samples": len(samples),
+                "us_per_sample": float(block_times.sum() / len(samples) * 1e6),
+                "samples_per_sec": float(len(samples) / block_times.sum()),
+                "p99_block_us": float(np.percentile(block_times, 99) * 1e6),
+                "peak_memory_kib": peak / 1024,
+                "coverage": len(valid) / len(scored) if scored else 0.0,
+                "mean_abs_error": None,
+                "p95_abs_error": None,
+            }
+            if truth is not None and valid:
+                errors = np.abs(np.array([c - truth[i] for i, c in valid]))
+                result["mean_abs_error"] = float(errors.mean())
+                result["p95_abs_error"] = float(np.percentile(errors, 95))
+            results.append(result)
+    return results
+
+
+def print_cadence_suite(results):
+    print(f"{'trace':<18} {'estimator':<24} {'us/sample':>9} {'samples/s':>10} {'KiB':>7} "
+          f"{'cover':>6} {'MAE':>6} {'p95':>6}")
+    for r in results:
+        mae = f"{r['mean_abs_error']:.1f}" if r['mean_abs_error'] is not None else "-"
+        p95 = f"{r['p95_abs_error']:.1f}" if r['p95_abs_error'] is not None else "-"
+        print(f"{r['trace']:<18} {r['estimator']:<24} {r['us_per_sample']:>9.1f} {r['samples_per_sec']:>10.0f} "
+              f"{r['peak_memory_kib']:>7.1f} {r['coverage']:>6.2f} {mae:>6} {p95:>6}")
+
+
+def _trace_argument(text):
+    path, _, cadence = text.partition(':')
+    return path, float(cadence) if cadence else None
+
+
+def bench_metrics(n=200000, repeats=15):
+    """
+    Cost of the instrumentation primitives, and of instrumenting the cadence DSP loop the way main() does.
+    The DSP loop is timed repeats times each way, alternating, and the fastest passes are compared.
+    :return: Dict with nanoseconds per call for each primitive and the relative DSP loop overhead.
+    """
+    import io
+    import logging
+    from metrics import Registry, RateLimitFilter, StructuredFormatter
+
+    registry = Registry()
+    counter = registry.counter("bench.counter")
+    histogram = registry.histogram("bench.histogram")
+    log = logging.getLogger("jogmusic.bench")
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(StructuredFormatter())
+    handler.addFilter(RateLimitFilter(3600))
+    log.handlers[:] = [handler]
+    log.propagate = False
+    log.setLevel(logging.INFO)
+
+    def per_call(fn):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return (time.perf_counter() - start) / n * 1e9
+
+    results = {
+        "counter_inc_ns": per_call(counter.inc),
+        "histogram_observe_ns": per_call(lambda: histogram.observe(1e-4)),
+        "histogram_observe_since_ns": per_call(lambda: histogram.observe_since(time.perf_counter())),
+        "trace_ns": per_call(lambda: registry.trace("bench", value=1)),
+        "log_below_level_ns": per_call(lambda: log.debug("bench", extra={"value": 1})),
+        "log_rate_limited_ns": per_call(lambda: log.info("bench", extra={"value": 1})),
+        "snapshot_us": per_call(registry.snapshot) / 1e3,
+        "noop_lambda_ns": per_call(lambda: None),
+    }
+
+    # The DSP loop with and without the calls main() makes per block
+    samples = synthetic_gait(165, 50, 60.0)
+    times = np.arange(len(samples)) / 50
+
+    def dsp_pass(instrumented):
+        estimator = StreamingStrideEstimator()
+        start = time.perf_counter()
+        for pos in range(0, len(samples), 5):
+            block_start = time.perf_counter()
+            events = estimator.update_block(samples[pos:pos + 5], 50, times[pos:pos + 5])
+            if instrumented:
+                histogram.observe_since(block_start)
+                if events:
+                    counter.inc(len(events))
+                    histogram.observe(time.time() - times[pos])
+        return time.perf_counter() - start
+
+    # Untimed warm-up pass: the first one pays for the lazy scipy.signal import and filter design
+    dsp_pass(False)
+    dsp = {False: [], True: []}
+    for _ in range(repeats):
+        for instrumented in (False, True):
+            dsp[instrumented].append(dsp_pass(instrumented))
+    # A pass takes ~10 ms, so scheduler noise only ever adds time; the fastest pass of each kind is the cost
+    results["dsp_overhead_percent"] = (min(dsp[True]) / min(dsp[False]) - 1) * 100
+    return results
+
+
+def print_metrics(results):
+    for name, value in results.items():
+        print(f"{name:<28} {value:>10.1f}")
+
+
+class _Collector:
+    """Queue stand-in that keeps every item with its arrival time."""
+
+    def __init__(self):
+        self.items = []
+
+    def put(self, item, block=True, timeout=None, timestamp=None):
+        self.items.append((time.time(), item))
+
+    def put_nowait(self, item):
+        self.put(item)
+
+
+def bench_pipeline(rates=(50, 500, 2000), cadence=165.0, duration=20.0, hr=140):
+    """
+    Run cadence_inference.main and a HeartRateReader against the replay harness:
+    synthetic phone frames over local UDP and heart-rate lines over a pty.
+    Frames are replayed in real time; high sampling rates stand in for load.
+    :param rates: Accelerometer sampling rates in Hz to test.
+    :return: List of dicts with throughput, cadence error, footfall latency and HR readings per rate.
+    """
+    import cadence_inference
+    from bluetooth_receive import HeartRateReader
+    from replay import Replayer, synthetic_records
+
+    results = []
+    for rate in rates:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        sock.bind(("127.0.0.1", 0))
+        cadences, strides, hrs = _Collector(), _Collector(), _Collector()
+        stop_event = threading.Event()
+        pipeline = threading.Thread(target=cadence_inference.main, args=[sock, cadences],
+                                    kwargs={"stride_queue": strides, "stop_event": stop_event}, daemon=True)
+        replayer = Replayer(sock.getsockname())
+        reader = HeartRateReader(port=replayer.serial_port, read_timeout=0.2, settle_seconds=0.0)
+        hr_thread = threading.Thread(target=reader.run, args=[lambda ts, value: hrs.put(value)], daemon=True)
+        pipeline.start()
+        hr_thread.start()
+        time.sleep(0.2)  # let the reader open the pty
+
+        elapsed = replayer.play(synthetic_records(rate, duration, cadence, hr))
+        time.sleep(1.5)  # let the last datagrams drain
+        stop_event.set()
+        reader.stop()
+        pipeline.join()
+        hr_thread.join()
+        replayer.close()
+
+        estimates = [value for _, value in cadences.items if value]
+        # Skip the warm-up half of the run
+        steady = estimates[len(estimates) // 2:]
+        measured = float(np.median(steady)) if steady else None
+        latencies = [arrival - step_time for arrival, step_time in strides.items]
+        results.append({
+            "rate": rate,
+            "samples_per_sec": rate * duration / elapsed,
+            "true_cadence": cadence,
+            "measured_cadence": measured,
+            "cadence_error": abs(measured - cadence) if measured is not None else None,
+            "footfall_latency_ms": float(np.median(latencies)) * 1e3 if latencies else None,
+            "hr_readings": len(hrs.items),
+        })
+    return results
+
+
+def print_pipeline(results):
+    print(f"{'rate':>6} {'samples/s':>10} {'cadence':>8} {'error':>7} {'latency ms':>11} {'HR':>4}")
+    for r in results:
+        measured = f"{r['measured_cadence']:.1f}" if r['measured_cadence'] is not None else "-"
+        error = f"{r['cadence_error']:.1f}" if r['cadence_error'] is not None else "-"
+        latency = f"{r['footfall_latency_ms']:.1f}" if r['footfall_latency_ms'] is not None else "-"
+        print(f"{r['rate']:>6} {r['samples_per_sec']:>10.0f} {measured:>8} {error:>7} {latency:>11} {r['hr_readings']:>4}")
+
+
+def bench_session_log(hours=2.0, sampling_rate=50, frame_samples=10):
+    """
+    Cost of recording a session and of analysing it afterwards.
+    Writes a synthetic run the way main() does (one accel block and one cadence value per
+    frame, HR every second), then summarises it and builds the plot envelope from the file.
+    :return: Dict with per-call write cost, write throughput, file size, and the time and
+        Python heap peak of opening, summarising and binning the log.
+    """
+    import os
+    import tempfile
+    from session_log import SessionLog, SessionWriter, summarize
+
+    n = int(hours * 3600 * sampling_rate)
+    samples = synthetic_gait(165, sampling_rate, n / sampling_rate).astype(np.float32)
+    times = 1.7e9 + np.arange(n) / sampling_rate
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.jms")
+        writer = SessionWriter(path)
+        start = time.perf_counter()
+        calls = 0
+        for pos in range(0, n, frame_samples):
+            writer.accel(times[pos:pos + frame_samples], samples[pos:pos + frame_samples])
+            writer.cadence(times[pos], 165.0)
+            calls += 2
+            if pos % sampling_rate == 0:
+                writer.hr(times[pos], 140)
+                calls += 1
+        write_seconds = time.perf_counter() - start
+        writer.close()
+        stats = writer.stats()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        session = SessionLog(path)
+        open_seconds = time.perf_counter() - start
+        summarize(session)
+        summary_seconds = time.perf_counter() - start - open_seconds
+        session.accel_envelope(1.0)
+        envelope_seconds = time.perf_counter() - start - open_seconds - summary_seconds
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            "hours": hours,
+            "records": stats["records"],
+            "dropped_records": stats["dropped_records"],
+            "file_mb": os.path.getsize(path) / 2 ** 20,
+            "write_us_per_call": write_seconds / calls * 1e6,
+            "write_records_per_sec": stats["records"] / write_seconds,
+            "open_ms": open_seconds * 1e3,
+            "summary_ms": summary_seconds * 1e3,
+            "envelope_ms": envelope_seconds * 1e3,
+            "analysis_peak_mb": peak / 2 ** 20,
+        }
+
+
+def print_session_log(results):
+    print(f"{results['hours']:.1f} h session: {results['records']} records "
+          f"({results['dropped_records']} dropped), {results['file_mb']:.1f} MB")
+    print(f"write: {results['write_us_per_call']:.1f} us/call, {results['write_records_per_sec'] / 1e6:.2f} M records/s")
+    print(f"analysis: open {results['open_ms']:.0f} ms, summary {results['summary_ms']:.0f} ms, "
+          f"envelope {results['envelope_ms']:.0f} ms, Python heap peak {results['analysis_peak_mb']:.1f} MB")
+
+
+def bench_multirunner(configs=((8, 1), (24, 1), (48, 1), (48, 2)), rate=100, duration=12.0):
+    """
+    Run a RunnerServer against many simulated phones replayed in real time from one
+    sender, each runner with its own cadence and session ID, and follow every runner
+    from a single subscriber.
+    :param configs: (runners, workers) pairs to test.
+    :param rate: Accelerometer sampling rate per runner in Hz.
+    :return: List of dicts with datagram throughput, worker CPU, the cadence error over
+        all runners, and the publish latency from the newest sample to the subscriber.
+    """
+    import heapq
+    import os
+    import resource
+    import tempfile
+    from replay import Replayer, synthetic_records
+    from runner_server import RunnerServer
+
+    results = []
+    for runners, workers in configs:
+        cadences = {f"session-{i + 1}": 150 + 35 * i / max(runners - 1, 1) for i in range(runners)}
+        with tempfile.TemporaryDirectory() as directory:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+            sock.bind(("127.0.0.1", 0))
+            server = RunnerServer(sock, workers=workers, socket_path=os.path.join(directory, "runners.sock"))
+            server.start()
+
+            received = []
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(server.socket_path)
+            client.sendall(b"subscribe *\n")
+
+            def follow():
+                for line in client.makefile('rb'):
+                    received.append((time.time(), json.loads(line)))
+
+            threading.Thread(target=follow, daemon=True).start()
+            children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            streams = [synthetic_records(rate, duration, cadence, seed=i, session_id=int(key.split("-")[1]))
+                       for i, (key, cadence) in enumerate(cadences.items())]
+            replayer = Replayer(sock.getsockname(), fake_serial=False)
+            elapsed = replayer.play(heapq.merge(*streams, key=lambda record: record[0]))
+            time.sleep(1.0)
+            replayer.close()
+            server.stop()
+            client.close()
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            worker_cpu = (children.ru_utime + children.ru_stime
+                          - children_before.ru_utime - children_before.ru_stime)
+
+        errors = []
+        latencies = []
+        for key, cadence in cadences.items():
+            estimates = [update["cadence"] for _, update in received
+                         if update["runner"] == key and update["cadence"]]
+            steady = estimates[len(estimates) // 2:]
+            errors.append(abs(float(np.median(steady)) - cadence) if steady else float("inf"))
+        for arrival, update in received:
+            latencies.append(arrival - update["t"])
+        stats = server.stats()
+        results.append({
+            "runners": runners,
+            "workers": workers,
+            "datagrams_per_sec": stats["datagrams"] / elapsed,
+            "samples_per_sec": runners * rate * duration / elapsed,
+            "worker_cpu_percent": worker_cpu / elapsed * 100,
+            "cadence_mae": float(np.mean(errors)),
+            "cadence_max_error": float(np.max(errors)),
+            "latency_p50_ms": float(np.percentile(latencies, 50)) * 1e3 if latencies else None,
+            "latency_p95_ms": float(np.percentile(latencies, 95)) * 1e3 if latencies else None,
+        })
+    return results
+
+
+def print_multirunner(results):
+    print(f"{'runners':>7} {'workers':>7} {'dgram/s':>8} {'samples/s':>10} {'CPU %':>6} {'MAE':>6} "
+          f"{'max err':>8} {'p50 ms':>7} {'p95 ms':>7}")
+    for r in results:
+        print(f"{r['runners']:>7} {r['workers']:>7} {r['datagrams_per_sec']:>8.0f} {r['samples_per_sec']:>10.0f} "
+              f"{r['worker_cpu_percent']:>6.1f} {r['cadence_mae']:>6.2f} {r['cadence_max_error']:>8.2f} "
+              f"{r['latency_p50_ms']:>7.1f} {r['latency_p95_ms']:>7.1f}")
+
+
+STARTUP_BUDGET = 0.5  # seconds from interpreter start until app.py is imported
+HEAVY_MODULES = ("scipy", "matplotlib", "sounddevice", "librosa")
+
+_STARTUP_PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+import app
+result = {"import_s": time.perf_counter() - start, "window_s": None,
+          "heavy": [m for m in %r if m in sys.modules]}
+if os.environ.get("DISPLAY"):
+    import tkinter as tk
+    root = tk.Tk()
+    app.RealTimeAudioPlayer(root)
+    root.update()
+    result["window_s"] = time.perf_counter() - start
+    root.destroy()
+print(json.dumps(result))
+"""
+
+
+def bench_startup(runs=5, budget=STARTUP_BUDGET, top=12):
+    """
+    Cold-start time of app.py in fresh interpreters, plus an import-time profile.
+    The window is only built when a display is available.
+    :return: Dict with median process, import and window times, the budget verdict,
+        heavy modules loaded at import and the slowest imports by self time.
+    """
+    import os
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    probe = _STARTUP_PROBE % (HEAVY_MODULES,)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", probe], cwd=here, capture_output=True, text=True, check=True)
+        sample = json.loads(out.stdout.strip().splitlines()[-1])
+        sample["process_s"] = time.perf_counter() - start
+        samples.append(sample)
+
+    # "import time: self [us] | cumulative | imported package" on stderr
+    profile = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=here,
+                             capture_output=True, text=True, check=True).stderr
+    imports = []
+    for line in profile.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[0].split(":")[-1].strip().isdigit():
+            imports.append((int(fields[0].split(":")[-1]) / 1e6, int(fields[1]) / 1e6, fields[2].strip()))
+    imports.sort(reverse=True)
+
+    def median(key):
+        values = [sample[key] for sample in samples if sample[key] is not None]
+        return float(np.median(values)) if values else None
+
+    import_s = median("import_s")
+    return {
+        "process_s": median("process_s"),
+        "import_s": import_s,
+        "window_s": median("window_s"),
+        "budget_s": budget,
+        "within_budget": import_s <= budget,
+        "heavy_modules": samples[-1]["heavy"],
+        "slowest_imports": [{"module": name, "self_s": own, "cumulative_s": total}
+                            for own, total, name in imports[:top]],
+    }
+
+
+def print_startup(results):
+    window = "n/a (no display)" if results["window_s"] is None else f"{results['window_s'] * 1e3:.0f} ms"
+    verdict = "within" if results["within_budget"] else "OVER"
+    print(f"process {results['process_s'] * 1e3:.0f} ms | import app {results['import_s'] * 1e3:.0f} ms "
+          f"({verdict} budget of {results['budget_s'] * 1e3:.0f} ms) | window {window}")
+    print(f"heavy modules loaded at import: {', '.join(results['heavy_modules']) or 'none'}")
+    print(f"{'module':<40} {'self ms':>8} {'cum ms':>8}")
+    for entry in results["slowest_imports"]:
+        print(f"{entry['module']:<40} {entry['self_s'] * 1e3:>8.1f} {entry['cumulative_s'] * 1e3:>8.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="JogMusic performance benchmarks")
+    parser.add_argument("benchmark", nargs="?", default="stretch",
+                        choices=["stretch", "renditions", "cadence", "suite", "pipeline", "metrics", "startup",
+                                 "session", "multirunner"])
+    parser.add_argument("--trace", type=_trace_argument, action="append", default=[],
+                        help="suite: recording made with replay.py, as PATH or PATH:CADENCE")
+    parser.add_argument("--json", help="suite: write results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    if args.benchmark == "stretch":
+        print_time_stretch(bench_time_stretch())
+    elif args.benchmark == "renditions":
+        print_renditions(bench_renditions())
+    elif args.benchmark == "cadence":
+        print_cadence(bench_cadence())
+    elif args.benchmark == "suite":
+        results = bench_cadence_suite(traces=args.trace)
+        if args.json == "-":
+            json.dump(results, sys.stdout, indent=2)
+        elif args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+        else:
+            print_cadence_suite(results)
+    elif args.benchmark == "metrics":
+        print_metrics(bench_metrics())
+    elif args.benchmark == "startup":
+        results = bench_startup()
+        print_startup(results)
+        if not results["within_budget"]:
+            sys.exit(1)
+    elif args.benchmark == "session":
+        print_session_log(bench_session_log())
+    elif args.benchmark == "multirunner":
+        print_multirunner(bench_multirunner())
+    elif args.benchmark == "pipeline":
+        print_pipeline(bench_pipeline())
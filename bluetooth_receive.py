@@ -1,49 +1,163 @@
+import logging
 import serial
+import threading
 import time
 import re
-import queue
 
-def main(bluetooth_queue):
-    #print("AAAA", bluetooth_queue)
-    print("This is working")
-    # Replace '/dev/rfcomm0' with your Bluetooth device port
-    bluetooth_port = '/dev/rfcomm0'
-    baud_rate = 9600  # Match your Bluetooth device's baud rate
+from channels import Channel, LATEST
+from metrics import REGISTRY, configure_logging
+
+log = logging.getLogger("jogmusic.hr")
+
+# Most devices send bare "72\r\n" lines; anything else goes through the regex
+_HR_PATTERN = re.compile(rb'\d+')
+
+
+def parse_hr(line):
+    """
+    Extract a heart rate from a raw serial line.
+    :param line: Bytes as returned by readline().
+    :return: Heart rate as int, or None if the line holds no number.
+    """
+    line = line.strip()
+    if line.isdigit():
+        return int(line)
+    match = _HR_PATTERN.search(line)
+    if match:
+        return int(match.group())
+    return None
+
+
+class HeartRateReader:
+    """
+    Reads heart-rate lines from a serial port and reconnects when the link drops.
+
+    readline() blocks in the OS until a line or the read timeout arrives, so an
+    idle link costs no CPU. Every reading is timestamped on arrival. Connection
+    errors close the port and retry with exponential backoff.
+    """
+
+    def __init__(self, port='/dev/rfcomm0', baud_rate=9600, read_timeout=1.0,
+                 settle_seconds=2.0, max_backoff=30.0):
+        """
+        :param port: Serial device of the Bluetooth link.
+        :param baud_rate: Must match the device.
+        :param read_timeout: Seconds readline() waits before returning empty.
+        :param settle_seconds: Wait after opening the port before reading.
+        :param max_backoff: Upper bound of the reconnect delay in seconds.
+        """
+        self.port = port
+        self.baud_rate = baud_rate
+        self.read_timeout = read_timeout
+        self.settle_seconds = settle_seconds
+        self.max_backoff = max_backoff
+        self.stop_event = threading.Event()
+        self._connection = None
+
+        self.samples = 0
+        self.parse_errors = 0
+        self.reconnects = 0
+        self.gaps = 0
+        self.last_time = None
+        self._interval = None  # smoothed interval between readings, seconds
+
+    def _connect(self):
+        connection = serial.Serial(self.port, self.baud_rate, timeout=self.read_timeout)
+        self.stop_event.wait(self.settle_seconds)  # Wait for connection to stabilize
+        connection.reset_input_buffer()  # Clear buffer to prevent stale data
+        return connection
+
+    def _record(self, now):
+        if self.last_time is not None:
+            interval = now - self.last_time
+            if self._interval is not None and interval > 2.5 * self._interval:
+                # Readings normally arrive at a steady pace; a long silence means some were lost
+                self.gaps += 1
+            self._interval = interval if self._interval is None else self._interval + 0.1 * (interval - self._interval)
+        self.last_time = now
+        self.samples += 1
+
+    def run(self, on_sample):
+        """
+        Read until stop() is called.
+        :param on_sample: Called with (timestamp, heart rate) for every reading.
+        """
+        backoff = 1.0
+        while not self.stop_event.is_set():
+            try:
+                self._connection = self._connect()
+                log.info("Connected to Bluetooth device", extra={"port": self.port, "baud": self.baud_rate})
+                REGISTRY.trace("hr.connected", port=self.port)
+                backoff = 1.0
+                while not self.stop_event.is_set():
+                    raw_data = self._connection.readline()
+                    if not raw_data:
+                        continue  # read timeout; check the stop flag and keep waiting
+                    now = time.time()
+                    hr = parse_hr(raw_data)
+                    if hr is None:
+                        self.parse_errors += 1
+                        continue
+                    self._record(now)
+                    on_sample(now, hr)
+            except (serial.SerialException, OSError) as e:
+                log.warning("Bluetooth link error, reconnecting", extra={"error": str(e), "backoff_s": backoff})
+                REGISTRY.trace("hr.link_error", error=str(e))
+                self.reconnects += 1
+                self._close()
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        self._close()
+
+    def _close(self):
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+            log.info("Bluetooth connection closed")
+        self._connection = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stats(self):
+        """
+        :return: Dict with sample, parse error, reconnect and gap counts, the mean interval
+            between readings and the age of the latest reading, in seconds.
+        """
+        return {
+            "samples": self.samples,
+            "parse_errors": self.parse_errors,
+            "reconnects": self.reconnects,
+            "gaps": self.gaps,
+            "mean_interval": self._interval,
+            "last_age": time.time() - self.last_time if self.last_time is not None else None,
+        }
+
+
+def main(bluetooth_queue, reader=None, session=None):
+    """
+    Publish heart-rate readings on bluetooth_queue, reconnecting whenever the link drops.
+    :param bluetooth_queue: Channel (or queue-like object) receiving one int per reading.
+    :param reader: Optional HeartRateReader (e.g. to read its stats or stop it).
+    :param session: Optional session_log.SessionWriter that also records every reading.
+    """
+    if reader is None:
+        reader = HeartRateReader()
+    REGISTRY.gauge("hr.reader", reader.stats)
+    log.info("Listening for heart-rate data")
+
+    def publish(timestamp, hr):
+        bluetooth_queue.put(hr, block=False, timestamp=timestamp)
+        if session is not None:
+            session.hr(timestamp, hr)
 
     try:
-        # Initialize serial connection
-        bt_connection = serial.Serial(bluetooth_port, baud_rate, timeout=1)
-        print(f"Connected to Bluetooth device on {bluetooth_port} at {baud_rate} baud.")
-        time.sleep(2)  # Wait for connection to stabilize
-        bt_connection.reset_input_buffer()  # Clear buffer to prevent stale data
-        
-        print("Listening for data...")
-        while True:
-            if bt_connection.in_waiting > 0:
-                raw_data = bt_connection.readline()
-                try:
-                    data = raw_data.decode('utf-8').strip()
-
-                    match = re.search(r'\d+', data)
-                    if match:
-                        data = int(match.group())
-
-                    print(f"Received: {data}")
-                    bluetooth_queue.put(data)
-                except UnicodeDecodeError as e:
-                    print(f"Decode error: {e}")
-
-                except Exception as e:
-                    print(f"Error processing data: {e}")
-    except serial.SerialException as e:
-        print(f"Error connecting to Bluetooth device: {e}")
+        reader.run(publish)
     except KeyboardInterrupt:
-        print("Exiting program.")
+        log.info("Exiting")
     finally:
-        if 'bt_connection' in locals() and bt_connection.is_open:
-            bt_connection.close()
-            print("Bluetooth connection closed.")
+        reader.stop()
 
 if __name__ == '__main__':
-    bluetooth_queue = queue.Queue()
+    configure_logging()
+    bluetooth_queue = Channel(policy=LATEST)
     main(bluetooth_queue)
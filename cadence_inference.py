@@ -1,24 +1,188 @@
+import logging
 import socket
 import time
 import numpy as np
-from scipy.signal import find_peaks, butter, filtfilt
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-import queue
 
-def wifi_connect():
+from udp_ingest import UdpIngestor
+from channels import Channel, LATEST
+from metrics import REGISTRY, configure_logging
+
+log = logging.getLogger("jogmusic.cadence")
+_filter_seconds = REGISTRY.histogram("dsp.filter_seconds")
+_cadence_age = REGISTRY.histogram("cadence.sample_age_seconds")
+_strides = REGISTRY.counter("cadence.strides")
+
+# scipy.signal takes most of a second to import, so the functions below import
+# it when first called instead of delaying everything that imports this module.
+# Plots of recorded sessions live in cadence_plot.
+
+def wifi_connect(server_ip="192.168.22.72", server_port=12345):
     # Set up the UDP server
-    server_ip = "192.168.22.72"  # Replace with your computer's IP address if different
-    server_port = 12345  # Must match the port used in the phone's code
+    # server_ip: replace with your computer's IP address if different
+    # server_port: must match the port used in the phone's code
 
     # Create the socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind((server_ip, server_port))
 
-    print(f"Listening for data on {server_ip}:{server_port}...")
+    log.info("Listening for accelerometer data", extra={"address": f"{server_ip}:{server_port}"})
 
     return sock
 
+class SampleRingBuffer:
+    """
+    Fixed-capacity ring of (x, y, z) samples stored as float32.
+
+    Every sample is written twice, at i and i + capacity, so the most recent
+    samples are always one contiguous slice and view() never copies.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = np.zeros((2 * capacity, 3), dtype=np.float32)
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, sample):
+        self._data[self._next] = sample
+        self._data[self._next + self.capacity] = sample
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def extend(self, samples):
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1, 3)[-self.capacity:]
+        n = len(samples)
+        index = (self._next + np.arange(n)) % self.capacity
+        self._data[index] = samples
+        self._data[index + self.capacity] = samples
+        self._next = (self._next + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+
+    def view(self):
+        """
+        :return: Read-only (n, 3) view of the buffered samples, oldest first.
+        """
+        end = self._next + self.capacity
+        view = self._data[end - self._size:end]
+        view.flags.writeable = False
+        return view
+
+
+class TimestampRing:
+    """
+    Fixed-capacity ring of timestamps with a running sum of the intervals
+    between them, so the sampling rate is available in O(1).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=np.float64)
+        self._next = 0
+        self._size = 0
+        self.interval_sum = 0.0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp):
+        if self._size:
+            self.interval_sum += timestamp - self.newest
+        if self._size == self.capacity:
+            oldest = self._data[self._next]
+            second = self._data[(self._next + 1) % self.capacity]
+            self.interval_sum -= second - oldest
+        else:
+            self._size += 1
+        self._data[self._next] = timestamp
+        self._next = (self._next + 1) % self.capacity
+        if self._next == 0:
+            # Resynchronise once per lap so rounding errors cannot accumulate
+            self.interval_sum = self.newest - self._data[0]
+
+    def extend(self, timestamps):
+        for timestamp in timestamps:
+            self.append(timestamp)
+
+    @property
+    def newest(self):
+        return self._data[self._next - 1]
+
+    def sampling_rate(self):
+        """
+        :return: Estimated sampling rate in Hz, or None with fewer than two timestamps.
+        """
+        if self._size < 2 or self.interval_sum <= 0:
+            return None
+        return (self._size - 1) / self.interval_sum
+
+
+class UniformResampler:
+    """
+    Resamples irregularly timed (x, y, z) samples onto a uniform time grid.
+
+    The last input sample is carried over between calls so interpolation is
+    continuous across blocks. Gaps longer than max_gap are not bridged; the
+    grid restarts at the first sample after the gap instead.
+    """
+
+    def __init__(self, rate=50, max_gap=0.5):
+        """
+        :param rate: Output sampling rate in Hz.
+        :param max_gap: Longest gap in seconds that is interpolated across.
+        """
+        self.rate = rate
+        self.max_gap = max_gap
+        self._last_time = None
+        self._last_sample = None
+        self._next_time = None
+
+    def process(self, timestamps, samples):
+        """
+        :param timestamps: n sample times in seconds.
+        :param samples: Array of shape (n, 3).
+        :return: Tuple (grid_times, grid_samples) with the uniform samples now available.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, 3)
+        if len(timestamps) == 0:
+            return np.zeros(0), np.zeros((0, 3))
+
+        if self._last_time is not None:
+            timestamps = np.concatenate(([self._last_time], timestamps))
+            samples = np.concatenate((self._last_sample[None, :], samples))
+        # np.interp needs increasing times; drop samples that do not move forward
+        keep = np.concatenate(([True], np.diff(timestamps) > 0))
+        if not keep.all():
+            keep &= timestamps >= np.maximum.accumulate(timestamps)
+            timestamps, samples = timestamps[keep], samples[keep]
+
+        gaps = np.flatnonzero(np.diff(timestamps) > self.max_gap)
+        if len(gaps):
+            # Start over after the last long gap
+            restart = gaps[-1] + 1
+            timestamps, samples = timestamps[restart:], samples[restart:]
+            self._next_time = None
+        if self._next_time is None:
+            self._next_time = timestamps[0]
+
+        step = 1.0 / self.rate
+        count = int(np.floor((timestamps[-1] - self._next_time) / step)) + 1
+        self._last_time = timestamps[-1]
+        self._last_sample = samples[-1]
+        if count <= 0:
+            return np.zeros(0), np.zeros((0, 3))
+
+        grid = self._next_time + step * np.arange(count)
+        self._next_time = grid[-1] + step
+        resampled = np.empty((count, 3))
+        for axis in range(3):
+            resampled[:, axis] = np.interp(grid, timestamps, samples[:, axis])
+        return grid, resampled
+
+
 def calculate_sampling_rate(timestamps):
     """
     Calculate the sampling rate based on time intervals between received data.
@@ -28,9 +192,10 @@ def calculate_sampling_rate(timestamps):
     if len(timestamps) < 2:
         return None  # Not enough data points to calculate sampling rate
     
-    # Calculate intervals between timestamps
-    intervals = [t2 - t1 for t1, t2 in zip(timestamps[:-1], timestamps[1:])]
-    mean_interval = sum(intervals) / len(intervals)  # Average interval in seconds
+    # The intervals between consecutive timestamps telescope to last - first
+    mean_interval = (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1)  # Average interval in seconds
+    if mean_interval <= 0:
+        return None
     sampling_rate = 1 / mean_interval  # Convert to Hz
     return sampling_rate
 
@@ -43,32 +208,43 @@ def apply_low_pass_filter(data, cutoff, fs, order=3):
     :param order: The filter order.
     :return: The filtered data array.
     """
+    from scipy.signal import butter, filtfilt
+
     nyquist = 0.5 * fs
     normal_cutoff = cutoff / nyquist
     b, a = butter(order, normal_cutoff, btype='low', analog=False)
     return filtfilt(b, a, data)
 
-def estimate_stride_rate(data_buffer, sampling_rate, stride_rate_threshold=30):
+def estimate_stride_rate(data_buffer, sampling_rate, stride_rate_threshold=30, cutoff=3, height=6,
+                         distance=5, n_peaks=5):
     """
     Estimate the stride rate from accelerometer data using peak detection.
-    :param data_buffer: List of accelerometer Z-axis values.
+    :param data_buffer: Array of shape (n, 3) (or list of (x, y, z) arrays) with accelerometer values.
     :param sampling_rate: Sampling rate of the accelerometer in Hz.
+    :param stride_rate_threshold: Stride rates below this are reported as None.
+    :param cutoff: Low-pass cutoff frequency in Hz.
+    :param height: Minimum filtered magnitude for a peak.
+    :param distance: Minimum number of samples between peaks.
+    :param n_peaks: Number of most recent peaks used to average the stride time.
     :return: Stride rate in strides per minute.
     """
+    from scipy.signal import find_peaks
+
     if len(data_buffer) < 10:
         return None  # Not enough data to calculate stride rate
     # Convert the buffer to a NumPy array for processing
-    acc_vector = [np.sqrt(np.sum(x ** 2)) - 9.8 for x in data_buffer]# Calculate the acceleration vector magnitude
+    data_buffer = np.asarray(data_buffer)
+    acc_vector = np.sqrt(np.einsum('ij,ij->i', data_buffer, data_buffer)) - 9.8  # Calculate the acceleration vector magnitude
 
 
 
     # Apply a low-pass filter to reduce noise
-    filtered_data = apply_low_pass_filter(acc_vector, cutoff=3, fs=sampling_rate)
+    filtered_data = apply_low_pass_filter(acc_vector, cutoff=cutoff, fs=sampling_rate)
     # Find peaks in the filtered Z-axis data
-    peaks, _ = find_peaks(filtered_data, height=6, distance=5)  # Adjust height and distance as needed
+    peaks, _ = find_peaks(filtered_data, height=height, distance=distance)
     # Calculate time intervals between peaks (stride times)
     if len(peaks) > 1:
-        last_peaks = peaks[-5:] if len(peaks) >= 5 else peaks
+        last_peaks = peaks[-n_peaks:]
         time_intervals = np.diff(last_peaks) / sampling_rate  # Convert to seconds
         mean_stride_time = np.mean(time_intervals)  # Average time per stride
         stride_rate = 60 / mean_stride_time  # Strides per minute
@@ -79,121 +255,267 @@ def estimate_stride_rate(data_buffer, sampling_rate, stride_rate_threshold=30):
         return stride_rate, filtered_data, peaks
     return None
 
-# Function to update the plot
-def update_plot(frame, ax, line, filtered_data, peaks):
-    filtered_data = filtered_data['data']
-    peaks = peaks['peaks']
-    if len(filtered_data) > 0:
-        # Compute the acceleration magnitude
-        acc_vector = filtered_data
-        line.set_ydata(acc_vector[-500:])  # Show only the latest 500 samples
-        line.set_xdata(range(len(acc_vector[-500:])))  # Update x-axis
-
-        # Clear previous peaks
-        [vline.remove() for vline in ax.collections if isinstance(vline, plt.Line2D)]
-        
-        # Add vertical lines for detected peaks
-        if peaks is not None:
-            for peak in peaks:
-                ax.axvline(x=peak, color='r', linestyle='--', linewidth=0.7)
-
-        ax.relim()
-        ax.autoscale_view()
-    return line,
-
-
-def setup_plot():
-    fig, ax = plt.subplots()
-    line, = ax.plot([], [], lw=2)
-    ax.set_xlim(0, 500)  # Default buffer size
-    ax.set_ylim(-10, 10)  # Adjust as per your expected accelerometer range
-    ax.set_title('Real-Time Stride Rate Visualization')
-    ax.set_xlabel('Time (samples)')
-    ax.set_ylabel('Acceleration (m/s²)')
-    return fig, ax, line
-
-def main(sock, cadence_queue):
-    print(cadence_queue)
+class StreamingStrideEstimator:
+    """
+    Incremental counterpart of estimate_stride_rate.
+
+    Samples are filtered with a causal Butterworth low-pass whose lfilter state
+    is kept between calls, and peaks are detected as soon as the sample after
+    them arrives, so each new sample costs O(1) work. Filter coefficients are
+    only redesigned when the sampling rate drifts by more than fs_tolerance.
+
+    Because the filter is causal instead of zero-phase, peaks come out a few
+    samples later and slightly attenuated compared with the batch path. On
+    steady gait the reported cadence agrees with estimate_stride_rate to within
+    about 2% (see benchmark.py cadence). Event timestamps are corrected for the
+    filter's phase delay at stride_frequency (filter_delay seconds).
+    """
+
+    def __init__(self, cutoff=3, order=3, height=6, distance=5, n_peaks=5, window=100,
+                 stride_rate_threshold=30, fs_tolerance=0.05, stride_frequency=2.75):
+        """
+        :param cutoff: Low-pass cutoff frequency in Hz.
+        :param order: Butterworth filter order.
+        :param height: Minimum filtered magnitude for a peak.
+        :param distance: Minimum number of samples between peaks.
+        :param n_peaks: Number of most recent peaks used to average the stride time.
+        :param window: Peaks older than this many samples are forgotten.
+        :param stride_rate_threshold: Stride rates below this are reported as None.
+        :param fs_tolerance: Relative sampling rate change that triggers a filter redesign.
+        :param stride_frequency: Typical step frequency in Hz used for the delay correction.
+        """
+        self.cutoff = cutoff
+        self.order = order
+        self.height = height
+        self.distance = distance
+        self.n_peaks = n_peaks
+        self.window = window
+        self.stride_rate_threshold = stride_rate_threshold
+        self.fs_tolerance = fs_tolerance
+        self.stride_frequency = stride_frequency
+        self.reset()
+
+    def reset(self):
+        self._fs = None
+        self._b = None
+        self._a = None
+        self._zi = None
+        self._count = 0           # samples seen so far
+        self._prev = [None, None]  # last two filtered values
+        self._prev_time = None
+        self.peaks = []           # (sample index, timestamp) of recent peaks
+        self._peak_value = None
+        self.redesigns = 0
+        self.filter_delay = 0.0
+
+    def _design(self, sampling_rate):
+        from scipy.signal import butter, freqz
+
+        nyquist = 0.5 * sampling_rate
+        self._b, self._a = butter(self.order, min(self.cutoff / nyquist, 0.99), btype='low', analog=False)
+        self._fs = sampling_rate
+        self.redesigns += 1
+        # Phase delay at the step frequency: how late a sinusoidal peak leaves the filter
+        frequency = min(self.stride_frequency, 0.45 * sampling_rate)
+        _, response = freqz(self._b, self._a, worN=[frequency], fs=sampling_rate)
+        phase = np.angle(response[0])
+        if phase > 0:
+            phase -= 2 * np.pi  # a low-pass only lags
+        self.filter_delay = float(-phase / (2 * np.pi * frequency))
+
+    def _expire_peaks(self):
+        oldest = self._count - self.window
+        while self.peaks and self.peaks[0][0] < oldest:
+            self.peaks.pop(0)
+
+    def update_block(self, samples, sampling_rate, timestamps=None):
+        """
+        Feed new accelerometer samples.
+        :param samples: Array of shape (n, 3) with x, y, z acceleration.
+        :param sampling_rate: Current sampling rate in Hz.
+        :param timestamps: Optional sequence of n sample times in seconds.
+        :return: List of (sample index, timestamp) stride events detected in this block,
+            with timestamps corrected for the filter delay.
+        """
+        from scipy.signal import lfilter, lfilter_zi
+
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, 3)
+        if len(samples) == 0:
+            return []
+        if self._fs is None or abs(sampling_rate - self._fs) > self.fs_tolerance * self._fs:
+            self._design(sampling_rate)
+
+        magnitudes = np.sqrt(np.einsum('ij,ij->i', samples, samples)) - 9.8
+        if self._zi is None:
+            self._zi = lfilter_zi(self._b, self._a) * magnitudes[0]
+        filtered, self._zi = lfilter(self._b, self._a, magnitudes, zi=self._zi)
+
+        events = []
+        before, last = self._prev
+        last_time = self._prev_time
+        for i, value in enumerate(filtered.tolist()):
+            # The previous sample is a peak if it rises above its left neighbour and is not below this one
+            if before is not None and before < last >= value and last >= self.height:
+                index = self._count - 1
+                if self.peaks and index - self.peaks[-1][0] < self.distance:
+                    # Too close to the last peak: keep whichever is higher, as find_peaks does
+                    if last > self._peak_value:
+                        self.peaks[-1] = (index, last_time)
+                        self._peak_value = last
+                        events.append(self.peaks[-1])
+                else:
+                    self.peaks.append((index, last_time))
+                    self._peak_value = last
+                    events.append(self.peaks[-1])
+            before, last = last, value
+            last_time = timestamps[i] - self.filter_delay if timestamps is not None else None
+            self._count += 1
+        self._prev = [before, last]
+        self._prev_time = last_time
+        self._expire_peaks()
+        return events
+
+    def update(self, sample, sampling_rate, timestamp=None):
+        """
+        Feed a single (x, y, z) sample.
+        :return: List of stride events detected, see update_block.
+        """
+        return self.update_block(sample, sampling_rate, None if timestamp is None else [timestamp])
+
+    @property
+    def stride_rate(self):
+        """
+        Stride rate in strides per minute from the most recent peaks, or None.
+        """
+        if len(self.peaks) < 2:
+            return None
+        last_peaks = self.peaks[-self.n_peaks:]
+        mean_stride_samples = (last_peaks[-1][0] - last_peaks[0][0]) / (len(last_peaks) - 1)
+        stride_rate = 60 * self._fs / mean_stride_samples
+        if stride_rate < self.stride_rate_threshold:
+            return None
+        return stride_rate
+
+def main(sock, cadence_queue, streaming=True, resample_rate=50, stride_queue=None, stop_event=None,
+         session=None):
+    """
+    Receive accelerometer packets and publish stride rates on cadence_queue.
+    :param sock: Bound UDP socket.
+    :param cadence_queue: Channel (or queue-like object) receiving one stride rate, None if unknown,
+        per received batch.
+    :param streaming: Use StreamingStrideEstimator instead of refiltering the whole buffer.
+    :param resample_rate: Rate in Hz of the uniform grid samples are resampled onto before
+        filtering, or None to filter the raw samples at the measured sampling rate.
+    :param stride_queue: Optional channel receiving the timestamp of every detected footfall
+        (streaming mode only).
+    :param stop_event: Optional threading.Event that ends the loop when set.
+    :param session: Optional session_log.SessionWriter receiving the raw samples, stride
+        events and cadence estimates.
+    """
     # Buffers to store data and timestamps
-    data_buffer = []
-    timestamps = []
-    peaks = {"peaks": []}
-    filtered_data = {"data": []}
+    buffer_size = 100  # Number of samples to keep in the buffer
+    data_buffer = SampleRingBuffer(buffer_size)
+    timestamps = TimestampRing(100)
 
     # Parameters
-    buffer_size = 100  # Number of samples to keep in the buffer
     default_sampling_rate = 50  # Default sampling rate in Hz (used if dynamic calculation fails)
     stride_rate_threshold = 50  # Minimum realistic stride rate in strides per minute
+    estimator = StreamingStrideEstimator(window=buffer_size) if streaming else None
+    resampler = UniformResampler(resample_rate) if resample_rate else None
 
-    """
-    # Set up the real-time plot
-    fig, ax, line = setup_plot()
-    ani = FuncAnimation(fig, update_plot, fargs=(ax, line, filtered_data, peaks), interval=50)
-    plt.show(block=False)
-    """
+    ingestor = UdpIngestor(sock)
+    stats_interval = 10  # Seconds between ingestion reports
+    last_report = time.time()
 
     try:
-        i = 0
-        while True:
-            # Receive data from the phone
-            data, addr = sock.recvfrom(1024)  # Buffer size is 1024 bytes
-            accelerometer_data = data.decode('utf-8')  # Decode byte data to string
+        while stop_event is None or not stop_event.is_set():
+            # Drain every datagram that is pending, then process them as one block
+            samples, sample_times = ingestor.drain(timeout=1.0)
+
+            if time.time() - last_report >= stats_interval:
+                log.info("Ingest stats", extra=ingestor.stats())
+                last_report = time.time()
 
-            # Record the current timestamp
-            current_time = time.time()
-            timestamps.append(current_time)
+            if len(samples) == 0:
+                continue
 
-            # Maintain a limited buffer of timestamps
-            if len(timestamps) > 100:  # Adjust buffer size if needed
-                timestamps.pop(0)
+            timestamps.extend(sample_times)
+            if session is not None:
+                session.accel(sample_times, samples)
+            dsp_start = time.perf_counter()
 
             # Calculate the sampling rate dynamically
-            sampling_rate = calculate_sampling_rate(timestamps)
+            sampling_rate = timestamps.sampling_rate()
             if not sampling_rate:
                 sampling_rate = default_sampling_rate  # Use default if dynamic calculation is unavailable
 
-            # Parse the accelerometer data (assuming it's sent as comma-separated x,y,z values)
+            if resampler is not None:
+                # Filter on a uniform grid so delivery jitter cannot distort fs or stride intervals
+                sample_times, samples = resampler.process(sample_times, samples)
+                sampling_rate = resample_rate
+                if len(samples) == 0:
+                    continue
+
+            if estimator is not None:
+                events = estimator.update_block(samples, sampling_rate, sample_times)
+                _filter_seconds.observe_since(dsp_start)
+                if stride_queue is not None:
+                    for _, step_time in events:
+                        stride_queue.put_nowait(step_time)
+                cadence_queue.put_nowait(estimator.stride_rate)
+                if session is not None:
+                    if events:
+                        session.stride([step_time for _, step_time in events])
+                    session.cadence(sample_times[-1], estimator.stride_rate)
+                if events:
+                    # Only blocks with footfalls are counted and timed, which keeps the
+                    # per-block cost to one histogram update
+                    _strides.inc(len(events))
+                    # How old the newest sample is by the time its cadence is published
+                    _cadence_age.observe(time.time() - sample_times[-1])
+                continue
+
+            data_buffer.extend(samples)
+
+            # Estimate stride rate if buffer is sufficiently filled
             try:
-                x, y, z = map(float, accelerometer_data.split(','))
-                data_buffer.append(np.array([x, y, z]))
-
-                # Maintain buffer size
-                if len(data_buffer) > buffer_size:
-                    data_buffer.pop(0)
-
-                # Estimate stride rate if buffer is sufficiently filled
-                try:
-                    stride_rate, filtered_data, peaks = estimate_stride_rate(data_buffer, sampling_rate)
-                    #filtered_data['data'] = filt
-                    #peaks['peaks'] = p 
-                    #print(stride_rate)
-                    cadence_queue.put(stride_rate, timeout=1)
-
-                except  TypeError as e:
-                    #print(i, e)
-                    i += 1
-                    stride_rate = 0
-                    cadence_queue.put(stride_rate)
-
-
+                stride_rate, _, _ = estimate_stride_rate(data_buffer.view(), sampling_rate)
+                _filter_seconds.observe_since(dsp_start)
+            except TypeError:
+                # estimate_stride_rate returned None
+                stride_rate = None
             except ValueError:
-                print("Invalid data format received. Skipping...")
-
-            #plt.pause(0.01)  # Allow the plot to update in real time
+                # Buffer still shorter than the filter padding
+                stride_rate = None
+            cadence_queue.put_nowait(stride_rate)
+            if session is not None:
+                session.cadence(sample_times[-1], stride_rate)
 
-            #print(f"Received data from {addr}: {accelerometer_data}")
     except KeyboardInterrupt:
-        plt.plot(filtered_data)
-        plt.vlines(peaks, min(filtered_data), max(filtered_data), color='r')
-        plt.show()
-        quit()
-        print("Server stopped.")
+        log.info("Server stopped")
 
     finally:
         sock.close()
 
 
 if __name__ == '__main__':
-    sock = wifi_connect()
-    cadence_queue = queue.Queue()
-    main(sock, cadence_queue)
+    import argparse
+    from session_log import SessionWriter
+
+    parser = argparse.ArgumentParser(description="Estimate cadence from phone accelerometer packets")
+    parser.add_argument("--host", default="192.168.22.72", help="address to listen on")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--batch", action="store_true", help="refilter the whole buffer on every packet")
+    parser.add_argument("--session", help="log samples, strides and cadence to this session file "
+                                          "(inspect with session_log.py)")
+    args = parser.parse_args()
+
+    configure_logging()
+    sock = wifi_connect(args.host, args.port)
+    cadence_queue = Channel(policy=LATEST)
+    session = SessionWriter(args.session) if args.session else None
+    try:
+        main(sock, cadence_queue, streaming=not args.batch, session=session)
+    finally:
+        if session is not None:
+            session.close()
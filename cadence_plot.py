@@ -0,0 +1,60 @@
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+
+# Optional plotting for session_log; importing this module loads matplotlib.
+
+
+def plot_session(session, out=None, bin_seconds=1.0):
+    """
+    Plot a session log: acceleration envelope, cadence, heart rate and playback speed
+    with the selected modes shaded.
+    :param session: session_log.SessionLog.
+    :param out: Save the figure to this file instead of showing it.
+    :param bin_seconds: Width of the acceleration envelope bins.
+    """
+    from session_log import MODES, stride_cadence
+
+    span = session.time_range()
+    if span is None:
+        raise ValueError("Empty session")
+    start = span[0]
+
+    def minutes(t):
+        return (t - start) / 60
+
+    fig, axes = plt.subplots(4, 1, sharex=True, figsize=(12, 9))
+    bins, means, lows, highs = session.accel_envelope(bin_seconds)
+    axes[0].fill_between(minutes(bins), lows, highs, alpha=0.3, step='post')
+    axes[0].plot(minutes(bins), means, lw=0.8)
+    axes[0].set_ylabel('|acc| (m/s²)')
+
+    stride_times, stride_rates = stride_cadence(session.column("stride", "t"))
+    axes[1].plot(minutes(stride_times), stride_rates, '.', ms=2, alpha=0.4, label='per stride')
+    axes[1].plot(minutes(session.column("cadence", "t")), session.column("cadence", "cadence"), lw=1,
+                 label='estimated')
+    axes[1].set_ylabel('Cadence (spm)')
+    axes[1].legend(loc='upper right')
+
+    axes[2].plot(minutes(session.column("hr", "t")), session.column("hr", "hr"), color='r', lw=1)
+    axes[2].set_ylabel('HR (bpm)')
+
+    axes[3].step(minutes(session.column("speed", "t")), session.column("speed", "speed"), where='post', lw=1)
+    axes[3].set_ylabel('Speed (x)')
+    axes[3].set_xlabel('Time (min)')
+
+    mode_times = session.column("mode", "t")
+    mode_codes = session.column("mode", "mode")
+    ends = np.append(mode_times[1:], span[1])
+    for code, begin, end in zip(mode_codes, mode_times, ends):
+        if code < len(MODES):
+            axes[3].axvspan(minutes(begin), minutes(end), color=f"C{code}", alpha=0.15, lw=0)
+            axes[3].text(minutes(begin), 1, MODES[code], transform=axes[3].get_xaxis_transform(),
+                         va='top', fontsize=8)
+
+    fig.suptitle(time.strftime('Session %Y-%m-%d %H:%M', time.localtime(start)))
+    fig.tight_layout()
+    if out:
+        fig.savefig(out, dpi=120)
+    else:
+        plt.show()
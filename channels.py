@@ -0,0 +1,145 @@
+import queue
+import threading
+import time
+from collections import deque
+
+# Overflow policies
+LATEST = "latest"            # keep only the newest item
+BLOCK = "block"              # bounded ring; producers wait for space, then drop the new item
+DROP_OLDEST = "drop_oldest"  # bounded ring; the oldest item makes room for the new one
+POLICIES = (LATEST, BLOCK, DROP_OLDEST)
+
+
+class Channel:
+    """
+    Bounded hand-over point between producer and consumer threads.
+
+    Every item is stored with a timestamp (time.time() at put() unless the
+    producer supplies one), so consumers can tell how old it is. Memory is
+    bounded by capacity whatever the producer rate; what happens on overflow
+    depends on the policy. put(), put_nowait(), get() and get_nowait() follow
+    queue.Queue, so code written against a Queue works unchanged; drain()
+    takes everything at once.
+
+    Several channels may share one threading.Condition so a consumer can wait
+    on all of them at once (see FusionController). The condition must be
+    reentrant, which the default threading.Condition() is.
+    """
+
+    def __init__(self, capacity=64, policy=DROP_OLDEST, cond=None):
+        """
+        :param capacity: Maximum number of pending items (always 1 for LATEST).
+        :param policy: LATEST, BLOCK or DROP_OLDEST.
+        :param cond: Optional threading.Condition shared with other channels.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}")
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.policy = policy
+        self.capacity = 1 if policy == LATEST else capacity
+        self._items = deque()
+        self._cond = cond if cond is not None else threading.Condition()
+
+        self.puts = 0
+        self.gets = 0
+        self.dropped = 0   # items lost to overflow
+        self.stale = 0     # items discarded by drain(max_age)
+        self.lag = 0.0     # age of the last item handed to the consumer, seconds
+        self.max_lag = 0.0
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def put(self, item, block=True, timeout=None, timestamp=None):
+        """
+        Add an item.
+        :param block: BLOCK policy only: wait up to timeout seconds for space.
+        :param timestamp: Time the item refers to; defaults to now.
+        :return: True if the item was stored, False if it was dropped.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._cond:
+            self.puts += 1
+            if len(self._items) >= self.capacity:
+                if self.policy == BLOCK:
+                    if not block or not self._cond.wait_for(lambda: len(self._items) < self.capacity, timeout):
+                        self.dropped += 1
+                        return False
+                else:
+                    self._items.popleft()
+                    self.dropped += 1
+            self._items.append((timestamp, item))
+            self._cond.notify_all()
+            return True
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def _taken(self, timestamp, now):
+        self.gets += 1
+        self.lag = now - timestamp
+        self.max_lag = max(self.max_lag, self.lag)
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return the oldest item.
+        :raises queue.Empty: If nothing arrives (immediately when block is False).
+        """
+        with self._cond:
+            if not self._items and (not block or not self._cond.wait_for(lambda: self._items, timeout)):
+                raise queue.Empty
+            timestamp, item = self._items.popleft()
+            self._taken(timestamp, time.time())
+            self._cond.notify_all()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def drain(self, max_age=None):
+        """
+        Remove every pending item.
+        :param max_age: Items older than this many seconds are discarded and counted as stale.
+        :return: List of (timestamp, item), oldest first.
+        """
+        now = time.time()
+        with self._cond:
+            items = list(self._items)
+            self._items.clear()
+            self._cond.notify_all()
+            if max_age is not None:
+                fresh = [(t, item) for t, item in items if now - t <= max_age]
+                self.stale += len(items) - len(fresh)
+                items = fresh
+            if items:
+                self.gets += len(items) - 1
+                self._taken(items[0][0], now)
+            return items
+
+    def latest(self):
+        """
+        :return: The newest pending (timestamp, item) without removing it, or None.
+        """
+        with self._cond:
+            return self._items[-1] if self._items else None
+
+    def stats(self):
+        """
+        :return: Dict with put/get counts, dropped and stale items, the current depth, the age
+            of the oldest pending item (pending_age) and the last and maximum consumer lag, in seconds.
+        """
+        with self._cond:
+            oldest = self._items[0][0] if self._items else None
+            return {
+                "puts": self.puts,
+                "gets": self.gets,
+                "dropped": self.dropped,
+                "stale": self.stale,
+                "depth": len(self._items),
+                "pending_age": time.time() - oldest if oldest is not None else 0.0,
+                "lag": self.lag,
+                "max_lag": self.max_lag,
+            }
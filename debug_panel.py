@@ -0,0 +1,48 @@
+import json
+import time
+import tkinter as tk
+
+
+class DebugPanel(tk.Toplevel):
+    """
+    Window with the live metrics snapshot and the most recent trace events,
+    refreshed from the Tk thread once per second.
+    """
+
+    def __init__(self, root, registry, refresh_ms=1000, n_traces=30):
+        super().__init__(root)
+        self.title("JogMusic debug")
+        self.registry = registry
+        self.refresh_ms = refresh_ms
+        self.n_traces = n_traces
+        self.text = tk.Text(self, width=100, height=45, font=("Courier", 9))
+        self.text.pack(fill=tk.BOTH, expand=True)
+        self.refresh()
+
+    def _lines(self):
+        snapshot = self.registry.snapshot()
+        lines = ["Counters"]
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"  {name:<32} {value}")
+        lines.append("")
+        lines.append(f"  {'Latency (ms)':<32} {'count':>8} {'mean':>8} {'p50':>8} {'p99':>8} {'max':>8}")
+        for name, h in sorted(snapshot["histograms"].items()):
+            lines.append(f"  {name:<32} {h['count']:>8} {h['mean'] * 1e3:>8.2f} {h['p50'] * 1e3:>8.2f} "
+                         f"{h['p99'] * 1e3:>8.2f} {h['max'] * 1e3:>8.2f}")
+        lines.append("")
+        lines.append("Gauges")
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f"  {name:<32} {json.dumps(value, default=str)}")
+        lines.append("")
+        lines.append("Recent events")
+        for event in reversed(self.registry.recent_traces(self.n_traces)):
+            fields = " ".join(f"{k}={v}" for k, v in event.items() if k not in ("time", "event"))
+            lines.append(f"  {time.strftime('%H:%M:%S', time.localtime(event['time']))} {event['event']} {fields}")
+        return lines
+
+    def refresh(self):
+        if not self.winfo_exists():
+            return
+        self.text.delete("1.0", tk.END)
+        self.text.insert(tk.END, "\n".join(self._lines()))
+        self.after(self.refresh_ms, self.refresh)
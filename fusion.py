@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import deque
+
+from channels import Channel, DROP_OLDEST
+from metrics import REGISTRY
+
+_step_seconds = REGISTRY.histogram("fusion.step_seconds")
+_input_lag = REGISTRY.histogram("fusion.input_lag_seconds")
+
+
+class FusionController:
+    """
+    Event-driven fusion of cadence and heart-rate readings into a playback speed.
+
+    Producers put readings on cadence_input and hr_input, two bounded
+    drop-oldest Channels sharing one condition variable, so a producer never
+    blocks and a burst cannot grow memory. The control thread sleeps while
+    nothing arrives, runs at most control_rate times per second, drains both
+    channels (discarding readings older than max_age), and only publishes a
+    new speed when it differs from the last published one by more than the
+    hysteresis threshold. A cadence of None or 0 means "unknown" and is not
+    averaged.
+    """
+
+    def __init__(self, compute_speed, on_speed=None, on_cadence=None, on_hr=None,
+                 control_rate=5.0, hysteresis=0.02, cadence_window=20, max_age=2.0):
+        """
+        :param compute_speed: Callable (cadence_avg, hr) -> speed, or None to keep the current speed.
+        :param on_speed: Called with each published speed.
+        :param on_cadence: Called with each new cadence average.
+        :param on_hr: Called with every heart-rate reading.
+        :param control_rate: Maximum number of control updates per second.
+        :param hysteresis: Minimum absolute speed change that gets published.
+        :param cadence_window: Number of cadence readings averaged.
+        :param max_age: Readings older than this many seconds when the controller gets to them are ignored.
+        """
+        self.compute_speed = compute_speed
+        self.on_speed = on_speed
+        self.on_cadence = on_cadence
+        self.on_hr = on_hr
+        self.control_rate = control_rate
+        self.hysteresis = hysteresis
+        self.max_age = max_age
+
+        self._cond = threading.Condition()
+        self.cadence_input = Channel(capacity=cadence_window, policy=DROP_OLDEST, cond=self._cond)
+        self.hr_input = Channel(capacity=16, policy=DROP_OLDEST, cond=self._cond)
+        self._stop = False
+        self._thread = None
+
+        self.cadence_history = deque(maxlen=cadence_window)
+        self.cadence = None
+        self.hr = None
+        self.speed = None
+
+        self.wakeups = 0
+        self.published = 0
+        self.cpu_seconds = 0.0
+        self._started_at = None
+
+    def start(self):
+        self._stop = False
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        period = 1.0 / self.control_rate
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop or len(self.cadence_input) or len(self.hr_input))
+                if self._stop:
+                    return
+                cadences = [value for _, value in self.cadence_input.drain(self.max_age)]
+                hrs = [value for _, value in self.hr_input.drain(self.max_age)]
+            if cadences:
+                _input_lag.observe(self.cadence_input.lag)
+
+            cpu_start = time.thread_time()
+            step_start = time.perf_counter()
+            self.wakeups += 1
+            self._step(cadences, hrs)
+            _step_seconds.observe_since(step_start)
+            self.cpu_seconds += time.thread_time() - cpu_start
+
+            # Rate-limit the control loop; readings arriving meanwhile are batched
+            with self._cond:
+                if self._cond.wait_for(lambda: self._stop, timeout=period):
+                    return
+
+    def _step(self, cadences, hrs):
+        for hr in hrs:
+            self.hr = hr
+            if self.on_hr is not None:
+                self.on_hr(hr)
+
+        known = [cadence for cadence in cadences if cadence]
+        if known:
+            self.cadence_history.extend(known)
+            self.cadence = sum(self.cadence_history) / len(self.cadence_history)
+            if self.on_cadence is not None:
+                self.on_cadence(self.cadence)
+
+        if not cadences or not cadences[-1] or self.cadence is None:
+            return
+        new_speed = self.compute_speed(self.cadence, self.hr)
+        if new_speed is None:
+            return
+        if self.speed is None or abs(new_speed - self.speed) > self.hysteresis:
+            self.speed = new_speed
+            self.published += 1
+            REGISTRY.trace("fusion.speed", speed=new_speed, cadence=self.cadence, hr=self.hr)
+            if self.on_speed is not None:
+                self.on_speed(new_speed)
+
+    def stats(self):
+        """
+        :return: Dict with wakeups, published speed changes, CPU seconds used by the
+            control thread, its CPU share since start() and the stats of both input channels.
+        """
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        return {
+            "wakeups": self.wakeups,
+            "published": self.published,
+            "cpu_seconds": self.cpu_seconds,
+            "cpu_fraction": self.cpu_seconds / elapsed if elapsed > 0 else 0.0,
+            "cadence_input": self.cadence_input.stats(),
+            "hr_input": self.hr_input.stats(),
+        }
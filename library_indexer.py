@@ -0,0 +1,172 @@
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from metrics import configure_logging
+from song_cache import DEFAULT_CACHE_DIR, SongAnalysisCache, analyze_file, file_hash, write_entry
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg')
+DEFAULT_INDEX_PATH = os.path.join(DEFAULT_CACHE_DIR, "library.sqlite")
+
+log = logging.getLogger("jogmusic.library")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    tempo REAL NOT NULL,
+    duration REAL NOT NULL,
+    n_beats INTEGER NOT NULL,
+    analyzed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracks_tempo ON tracks (tempo);
+"""
+
+
+def find_audio_files(directory):
+    """
+    :return: Sorted absolute paths of the audio files below directory.
+    """
+    found = []
+    for dirpath, _, filenames in os.walk(directory):
+        for name in filenames:
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                found.append(os.path.abspath(os.path.join(dirpath, name)))
+    return sorted(found)
+
+
+def analyze_for_index(path, cache_dir):
+    """
+    Worker-process job: hash and analyze one track and write its cache entry.
+    Only small metadata travels back to the parent; the PCM stays on disk.
+    :return: Dict with the index row fields plus the cache entry size.
+    """
+    st = os.stat(path)
+    key = file_hash(path)
+    analysis = analyze_file(path)
+    entry_size = write_entry(cache_dir, key, analysis, source=path)
+    return {
+        "path": path,
+        "hash": key,
+        "mtime": st.st_mtime,
+        "size": st.st_size,
+        "tempo": analysis["tempo"],
+        "duration": len(analysis["audio"]) / analysis["sample_rate"],
+        "n_beats": len(analysis["beat_times"]),
+        "entry_size": entry_size,
+    }
+
+
+class LibraryIndex:
+    """
+    SQLite index of analyzed tracks, keyed by path and content hash.
+    """
+
+    def __init__(self, index_path=DEFAULT_INDEX_PATH, cache=None):
+        """
+        :param index_path: SQLite database file.
+        :param cache: SongAnalysisCache that receives the decoded tracks.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        self.index_path = index_path
+        self.cache = cache if cache is not None else SongAnalysisCache()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(index_path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def _known(self):
+        with self._lock:
+            rows = self._db.execute("SELECT path, mtime, size FROM tracks").fetchall()
+        return {path: (mtime, size) for path, mtime, size in rows}
+
+    def scan(self, directory, workers=None, progress=None):
+        """
+        Analyze every new or changed track below directory in a process pool.
+        Tracks that disappeared from the directory are removed from the index.
+        :param directory: Music folder.
+        :param workers: Number of worker processes (default: CPU count).
+        :param progress: Optional callable (done, total, path) called after each track.
+        :return: Dict with counts of analyzed, unchanged, removed and failed tracks.
+        """
+        directory = os.path.abspath(directory)
+        files = find_audio_files(directory)
+        known = self._known()
+
+        todo = []
+        for path in files:
+            st = os.stat(path)
+            if known.get(path) != (st.st_mtime, st.st_size):
+                todo.append(path)
+
+        present = set(files)
+        removed = [path for path in known
+                   if path.startswith(directory + os.sep) and path not in present]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM tracks WHERE path = ?", [(path,) for path in removed])
+
+        failed = 0
+        if progress is not None:
+            progress(0, len(todo), None)
+        # Spawned, not forked: scan_library runs this inside the app, which has Tk and audio threads
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+            futures = {pool.submit(analyze_for_index, path, self.cache.cache_dir): path for path in todo}
+            for done, future in enumerate(as_completed(futures), 1):
+                path = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    failed += 1
+                    log.warning("Could not analyze track", extra={"path": path, "error": str(e)})
+                else:
+                    self._store(row)
+                if progress is not None:
+                    progress(done, len(todo), path)
+
+        return {
+            "analyzed": len(todo) - failed,
+            "unchanged": len(files) - len(todo),
+            "removed": len(removed),
+            "failed": failed,
+        }
+
+    def _store(self, row):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tracks (path, hash, mtime, size, tempo, duration, n_beats, analyzed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (row["path"], row["hash"], row["mtime"], row["size"], row["tempo"],
+                 row["duration"], row["n_beats"], time.time()))
+        self.cache.register(row["hash"], row["entry_size"], path=row["path"],
+                            mtime=row["mtime"], file_size=row["size"])
+
+    def tracks(self):
+        """
+        :return: List of (path, tempo, duration) for every indexed track, sorted by tempo.
+        """
+        with self._lock:
+            return self._db.execute("SELECT path, tempo, duration FROM tracks ORDER BY tempo").fetchall()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pre-analyze a music folder for JogMusic")
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH)
+    args = parser.parse_args()
+
+    configure_logging()
+    index = LibraryIndex(args.index)
+    result = index.scan(args.directory, workers=args.workers,
+                        progress=lambda done, total, path: print(f"[{done}/{total}] {path or ''}"))
+    print(result)
+    index.close()
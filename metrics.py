@@ -0,0 +1,261 @@
+import bisect
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets from 1 us to ~8 s, doubling
+LATENCY_BOUNDS = tuple(1e-6 * 2 ** k for k in range(24))
+
+
+class Counter:
+    """Monotonic count. Updates are not locked; keep one writer thread per counter."""
+
+    __slots__ = ("name", "value")
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+class Histogram:
+    """
+    Distribution of values in fixed buckets, e.g. per-stage latencies in seconds.
+    observe() is a bisect and three additions, so it is cheap enough for the
+    hot path. Percentiles are reported as bucket upper bounds.
+    """
+
+    def __init__(self, name, bounds=LATENCY_BOUNDS):
+        self.name = name
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def observe_since(self, start):
+        """Record time.perf_counter() - start."""
+        self.observe(time.perf_counter() - start)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        target = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class Registry:
+    """
+    Named counters, histograms and gauges plus a ring buffer of recent trace events.
+
+    Metrics are created once (usually at import time) and then updated
+    without locking. Gauges are callables evaluated only when a snapshot is
+    taken, so exposing a value costs nothing until somebody looks. Each
+    process has its own registry; worker processes of the multiprocess
+    pipeline do not report here.
+    """
+
+    def __init__(self, trace_capacity=1024):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.traces = deque(maxlen=trace_capacity)
+
+    def counter(self, name):
+        with self._lock:
+            if name not in self.counters:
+                self.counters[name] = Counter(name)
+            return self.counters[name]
+
+    def histogram(self, name, bounds=LATENCY_BOUNDS):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, bounds)
+            return self.histograms[name]
+
+    def gauge(self, name, read):
+        """Register read() as the source of a value reported in snapshots."""
+        with self._lock:
+            self.gauges[name] = read
+
+    def trace(self, event, **fields):
+        """Append a timestamped event to the trace ring."""
+        self.traces.append((time.time(), event, fields))
+
+    def snapshot(self):
+        """
+        :return: JSON-serialisable dict with every counter, histogram summary and gauge value.
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+            gauges = dict(self.gauges)
+        values = {}
+        for name, read in gauges.items():
+            try:
+                values[name] = read()
+            except Exception as e:
+                values[name] = f"error: {e}"
+        return {
+            "time": time.time(),
+            "counters": {name: c.value for name, c in counters.items()},
+            "histograms": {name: h.snapshot() for name, h in histograms.items()},
+            "gauges": values,
+        }
+
+    def recent_traces(self, n=100):
+        """
+        :return: The last n trace events as dicts, oldest first.
+        """
+        events = list(self.traces)[-n:]
+        return [{"time": t, "event": event, **fields} for t, event, fields in events]
+
+
+REGISTRY = Registry()
+
+
+def _json_response(registry, path):
+    if path.startswith("/traces"):
+        return json.dumps(registry.recent_traces(), default=str)
+    return json.dumps(registry.snapshot(), default=str)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics", "/traces"):
+            self.send_error(404)
+            return
+        body = _json_response(self.registry, self.path).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep request logs off the console
+
+
+def serve_http(port=9100, host="127.0.0.1", registry=REGISTRY):
+    """
+    Serve GET /metrics (snapshot) and /traces (recent events) as JSON from a daemon thread.
+    :return: The server; call shutdown() to stop it.
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _UnixHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # One request line ("metrics" or "traces"), one JSON reply
+        request = self.rfile.readline().strip().decode(errors="replace") or "metrics"
+        self.wfile.write(_json_response(self.server.registry, "/" + request).encode() + b"\n")
+
+
+def serve_unix(path, registry=REGISTRY):
+    """
+    Serve the same JSON over a UNIX socket: send "metrics" or "traces" and read one line back.
+    :return: The server; call shutdown() to stop it.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socketserver.ThreadingUnixStreamServer(path, _UnixHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets each message template through at most once per interval. Suppressed
+    repeats are counted and reported as suppressed=N on the next one let through.
+    """
+
+    def __init__(self, interval=5.0):
+        super().__init__()
+        self.interval = interval
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        with self._lock:
+            last, suppressed = self._seen.get(key, (None, 0))
+            if last is not None and record.created - last < self.interval:
+                self._seen[key] = (last, suppressed + 1)
+                return False
+            self._seen[key] = (record.created, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+_STANDARD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One line per record: time, level, logger, message, then every field
+    passed through extra= as key=value.
+    """
+
+    def format(self, record):
+        line = "%s %-7s %s: %s" % (self.formatTime(record, "%H:%M:%S"), record.levelname, record.name,
+                                   record.getMessage())
+        fields = {k: v for k, v in vars(record).items() if k not in _STANDARD_FIELDS}
+        if fields:
+            line += " " + " ".join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}"
+                                   for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging(level=logging.INFO, rate_limit=5.0):
+    """
+    Send the "jogmusic" loggers to stderr with structured, rate-limited output.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter())
+    if rate_limit:
+        handler.addFilter(RateLimitFilter(rate_limit))
+    logger = logging.getLogger("jogmusic")
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
@@ -0,0 +1,258 @@
+import logging
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from metrics import REGISTRY, configure_logging
+
+log = logging.getLogger("jogmusic.pipeline")
+
+# Record kinds carried over the shared-memory rings
+CADENCE = 1
+STRIDE = 2
+HR = 3
+
+_HEADER_FIELDS = 4  # write count, read count, dropped records, capacity
+_RECORD_FIELDS = 3  # kind, time.time() when produced, value
+
+
+class SharedRecordRing:
+    """
+    Single-producer/single-consumer ring of (kind, timestamp, value) records in
+    a multiprocessing.shared_memory block.
+
+    The producer writes a record and then advances the write counter; the
+    consumer copies records out and then advances the read counter. Each
+    counter has a single writer, so no lock is needed across processes. When
+    the ring is full the newest record is dropped and counted.
+    """
+
+    def __init__(self, capacity=4096, name=None, create=True):
+        size = 8 * (_HEADER_FIELDS + capacity * _RECORD_FIELDS)
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self._header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        if create:
+            self._header[:] = (0, 0, 0, capacity)
+        self.capacity = int(self._header[3])
+        self._records = np.ndarray((self.capacity, _RECORD_FIELDS), dtype=np.float64,
+                                   buffer=self.shm.buf, offset=8 * _HEADER_FIELDS)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def dropped(self):
+        return int(self._header[2])
+
+    def push(self, kind, timestamp, value):
+        write, read = int(self._header[0]), int(self._header[1])
+        if write - read >= self.capacity:
+            self._header[2] += 1
+            return False
+        self._records[write % self.capacity] = (kind, timestamp, value)
+        self._header[0] = write + 1
+        return True
+
+    def pop_all(self):
+        """
+        :return: (n, 3) array with every unread record, oldest first.
+        """
+        write, read = int(self._header[0]), int(self._header[1])
+        if write == read:
+            return np.zeros((0, _RECORD_FIELDS))
+        records = self._records[np.arange(read, write) % self.capacity].copy()
+        self._header[1] = write
+        return records
+
+    def close(self):
+        # Views into the buffer must go before the mapping can be closed
+        self._header = None
+        self._records = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class RingWriter:
+    """
+    Channel-like producer endpoint that writes one kind of record into a SharedRecordRing.
+    None is stored as 0.0, which consumers treat as "unknown".
+    """
+
+    def __init__(self, ring, kind):
+        self.ring = ring
+        self.kind = kind
+
+    def put(self, item, block=True, timeout=None, timestamp=None):
+        self.ring.push(self.kind, timestamp if timestamp is not None else time.time(),
+                       float(item) if item is not None else 0.0)
+
+    def put_nowait(self, item):
+        self.put(item)
+
+
+def cadence_worker(ring_name, address=None, session_path=None):
+    """
+    Process entry point: UDP ingestion and cadence DSP.
+    :param address: Optional (host, port) to listen on instead of wifi_connect's default.
+    :param session_path: Optional session file for this worker's samples, strides and cadence.
+    """
+    import cadence_inference
+    from session_log import SessionWriter
+
+    configure_logging()
+    ring = SharedRecordRing(name=ring_name, create=False)
+    sock = cadence_inference.wifi_connect(*address) if address else cadence_inference.wifi_connect()
+    session = SessionWriter(session_path) if session_path else None
+    try:
+        cadence_inference.main(sock, RingWriter(ring, CADENCE), stride_queue=RingWriter(ring, STRIDE),
+                               session=session)
+    finally:
+        if session is not None:
+            session.close()
+
+
+def hr_worker(ring_name, session_path=None):
+    """
+    Process entry point: Bluetooth heart-rate reader.
+    :param session_path: Optional session file for this worker's readings.
+    """
+    import bluetooth_receive
+    from session_log import SessionWriter
+
+    configure_logging()
+    ring = SharedRecordRing(name=ring_name, create=False)
+    session = SessionWriter(session_path) if session_path else None
+    try:
+        bluetooth_receive.main(RingWriter(ring, HR), session=session)
+    finally:
+        if session is not None:
+            session.close()
+
+
+class PipelineSupervisor:
+    """
+    Runs the sensor pipeline in worker processes and forwards their records to
+    consumers in this process.
+
+    Every worker gets its own SharedRecordRing. A dispatcher thread drains the
+    rings and calls the sink registered for each record kind. Workers that exit
+    are restarted with exponential backoff.
+    """
+
+    def __init__(self, sinks, workers=None, poll_interval=0.005, ring_capacity=4096,
+                 max_backoff=30.0):
+        """
+        :param sinks: Dict mapping record kind to a Channel, or any object with a put() that
+            accepts block and timestamp keywords.
+        :param workers: Dict mapping worker name to its entry point; the entry point
+            receives the ring name. Defaults to the cadence and heart-rate workers.
+        :param poll_interval: Seconds between ring drains.
+        :param ring_capacity: Records per ring.
+        :param max_backoff: Upper bound of the restart delay in seconds.
+        """
+        self.sinks = sinks
+        self.targets = workers if workers is not None else {"cadence": cadence_worker, "hr": hr_worker}
+        self.poll_interval = poll_interval
+        self.ring_capacity = ring_capacity
+        self.max_backoff = max_backoff
+
+        self._ctx = mp.get_context("spawn")
+        self._rings = {}
+        self._processes = {}
+        self._restart_at = {}
+        self._spawned_at = {}
+        self._backoff = {}
+        self.restarts = {name: 0 for name in self.targets}
+        self.records = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for name in self.targets:
+            self._rings[name] = SharedRecordRing(self.ring_capacity)
+            self._backoff[name] = 1.0
+            self._spawn(name)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _spawn(self, name):
+        process = self._ctx.Process(target=self.targets[name], args=(self._rings[name].name,),
+                                    name=f"jogmusic-{name}", daemon=True)
+        process.start()
+        self._processes[name] = process
+        self._spawned_at[name] = time.time()
+        self._restart_at[name] = None
+        log.info("Started worker", extra={"worker": name, "pid": process.pid})
+        REGISTRY.trace("pipeline.worker_started", worker=name, pid=process.pid)
+
+    def _check_health(self, now):
+        for name, process in self._processes.items():
+            if process.is_alive():
+                if now - self._spawned_at[name] > self.max_backoff:
+                    self._backoff[name] = 1.0  # healthy for a while; reset the backoff
+                continue
+            if self._restart_at[name] is None:
+                delay = self._backoff[name]
+                log.warning("Worker exited, restarting", extra={"worker": name, "exitcode": process.exitcode,
+                                                                "backoff_s": delay})
+                self._restart_at[name] = now + delay
+                self._backoff[name] = min(delay * 2, self.max_backoff)
+            elif now >= self._restart_at[name]:
+                self.restarts[name] += 1
+                self._spawn(name)
+
+    def _run(self):
+        last_check = 0.0
+        while not self._stop.wait(self.poll_interval):
+            for ring in self._rings.values():
+                for kind, timestamp, value in ring.pop_all():
+                    kind = int(kind)
+                    sink = self.sinks.get(kind)
+                    if sink is not None:
+                        # Records are stored as float64; heart rate arrives from the reader as an int
+                        value = int(value) if kind == HR else float(value)
+                        # Keep the producer's timestamp so the sink sees the true age
+                        sink.put(value, block=False, timestamp=timestamp)
+                    self.records += 1
+            now = time.time()
+            if now - last_check >= 1.0:
+                self._check_health(now)
+                last_check = now
+
+    def stop(self, timeout=2.0):
+        """Stop the dispatcher, terminate the workers and release the shared memory."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+        for ring in self._rings.values():
+            ring.close()
+            ring.unlink()
+        self._processes.clear()
+        self._rings.clear()
+
+    def stats(self):
+        """
+        :return: Dict with per-worker liveness, restart counts and dropped records.
+        """
+        return {
+            name: {
+                "alive": process.is_alive(),
+                "restarts": self.restarts[name],
+                "dropped": self._rings[name].dropped,
+            }
+            for name, process in self._processes.items()
+        }
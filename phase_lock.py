@@ -0,0 +1,136 @@
+import threading
+import time
+import numpy as np
+
+from channels import Channel, DROP_OLDEST
+
+
+class PhaseLockController:
+    """
+    Nudges the playback rate so song beats land on detected footfalls.
+
+    Producers put footfall timestamps on input, a bounded drop-oldest Channel,
+    so ingest threads never wait for the audio clock lookup; the audio thread
+    calls process_pending() once per chunk. For every footfall it asks locate() which song position was
+    audible at that moment, measures the distance to the nearest beat as a
+    fraction of the beat period, and turns it into a small multiplicative rate
+    correction (proportional control, clamped to +-max_correction). The
+    cadence-derived speed keeps the average tempo; this only fixes the phase.
+
+    Latency budget. A footfall reaches the controller after:
+      - delivery: sensor to local clock, removed by sender timestamps when the
+        phone sends binary frames, otherwise included in the arrival time;
+      - filter: the causal low-pass phase delay, subtracted from the event
+        timestamp by StreamingStrideEstimator;
+      - detection: one sample plus the ingestion wakeup and the wait in
+        input until the next audio chunk, measured here as the age of each
+        event when it is processed (detection_latency);
+    and a correction is heard only after the output latency (ring buffer fill
+    plus device latency). Because events carry the time the step happened
+    and the audio clock is looked up retrospectively, these delays do not
+    bias the phase error; they only make the correction act later. Events
+    older than max_event_age are dropped, and the correction falls back to
+    1.0 when no footfall has arrived for hold_seconds.
+
+    When the speed is matched against a half- or double-time alias of the
+    song tempo, beats_per_step is set accordingly: in half time a footfall may
+    land on any beat, in double time also halfway between two beats, and the
+    phase is wrapped to that spacing so an aligned runner reads zero error.
+    """
+
+    def __init__(self, locate, output_latency=None, gain=0.3, max_correction=0.04,
+                 max_event_age=0.5, hold_seconds=2.0):
+        """
+        :param locate: Callable wall_time -> (song seconds, beat_times array) or None when not playing.
+        :param output_latency: Optional callable returning the current output latency in seconds.
+        :param gain: Fraction of the phase error (in beats) corrected per footfall.
+        :param max_correction: Largest relative rate change applied.
+        :param max_event_age: Footfalls older than this many seconds on arrival are ignored.
+        :param hold_seconds: Time after the last footfall before the correction is released.
+        """
+        self.locate = locate
+        self.output_latency = output_latency
+        self.gain = gain
+        self.max_correction = max_correction
+        self.max_event_age = max_event_age
+        self.hold_seconds = hold_seconds
+
+        self.input = Channel(capacity=16, policy=DROP_OLDEST)
+        self._lock = threading.Lock()
+        self._correction = 1.0
+        self._last_update = 0.0
+        self.beats_per_step = 1.0      # song beats per footfall at the tempo alias in use
+
+        self.updates = 0
+        self.stale_events = 0
+        self.phase_error = 0.0         # last error in beats, positive when the song is ahead
+        self.detection_latency = 0.0   # smoothed age of footfall events on arrival, seconds
+
+    def process_pending(self):
+        """
+        Run update() for every footfall waiting on input.
+        :return: Number of footfalls processed.
+        """
+        pending = self.input.drain()
+        for _, step_time in pending:
+            self.update(step_time)
+        return len(pending)
+
+    def update(self, step_time):
+        """
+        Process one footfall.
+        :param step_time: time.time() at which the foot struck.
+        :return: The new correction factor, or None if the event was not usable.
+        """
+        now = time.time()
+        age = now - step_time
+        self.detection_latency += 0.1 * (age - self.detection_latency)
+        if age > self.max_event_age:
+            self.stale_events += 1
+            return None
+
+        located = self.locate(step_time)
+        if located is None:
+            return None
+        song_position, beat_times = located
+        if beat_times is None or len(beat_times) < 2:
+            return None
+
+        i = int(np.clip(np.searchsorted(beat_times, song_position), 1, len(beat_times) - 1))
+        period = beat_times[i] - beat_times[i - 1]
+        if period <= 0:
+            return None
+        # Phase of the song relative to the beat grid, wrapped to the nearest place a
+        # footfall may land: every beat, or every half beat in double time
+        spacing = min(self.beats_per_step, 1.0)
+        phase = (song_position - beat_times[i - 1]) / period
+        phase = ((phase / spacing + 0.5) % 1.0 - 0.5) * spacing
+
+        correction = 1.0 - self.gain * phase
+        correction = min(max(correction, 1.0 - self.max_correction), 1.0 + self.max_correction)
+        with self._lock:
+            self._correction = correction
+            self._last_update = now
+        self.phase_error = phase
+        self.updates += 1
+        return correction
+
+    def correction(self):
+        """
+        :return: Factor to multiply the playback rate by.
+        """
+        with self._lock:
+            if time.time() - self._last_update > self.hold_seconds:
+                return 1.0
+            return self._correction
+
+    def latency_budget(self):
+        """
+        :return: Dict with the measured detection latency, the output latency and their sum, in ms.
+        """
+        output = self.output_latency() if self.output_latency is not None else 0.0
+        return {
+            "detection_ms": self.detection_latency * 1e3,
+            "output_ms": output * 1e3,
+            "total_ms": (self.detection_latency + output) * 1e3,
+        }
@@ -0,0 +1,268 @@
+import argparse
+import logging
+import math
+import multiprocessing as mp
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from time_stretch import StreamingTimeStretcher
+from metrics import configure_logging
+from song_cache import SongAnalysisCache, write_rendition
+
+# Neighbouring renditions differ by 6%, so the resample residual stays within 3%. Nine renditions cover
+# the default 0.8-1.25 range, about 18 bytes per source sample.
+RENDITION_SPACING = 1.06
+PCM_SCALE = 32767.0
+
+log = logging.getLogger("jogmusic.renditions")
+
+
+def rendition_rates(min_rate=0.8, max_rate=1.25, spacing=RENDITION_SPACING):
+    """
+    :return: Geometrically spaced stretch rates covering [min_rate, max_rate], always including 1.0.
+    """
+    low = math.floor(math.log(min_rate) / math.log(spacing))
+    high = math.ceil(math.log(max_rate) / math.log(spacing))
+    return tuple(round(spacing ** k, 4) for k in range(low, high + 1))
+
+
+def rendition_size(length, rates):
+    """
+    :return: Approximate bytes taken by int16 renditions of a track of length samples at rates.
+    """
+    return sum(2 * int(length / rate) for rate in rates)
+
+
+def render_rendition(audio, rate, n_fft=2048, hop_length=512, chunk_size=1 << 16):
+    """
+    Time-stretch a whole track with StreamingTimeStretcher.
+    :return: int16 PCM of the stretched track.
+    """
+    stretcher = StreamingTimeStretcher(n_fft=n_fft, hop_length=hop_length, rate=rate)
+    blocks = [stretcher.process(np.asarray(audio[start:start + chunk_size], dtype=np.float32))
+              for start in range(0, len(audio), chunk_size)]
+    blocks.append(stretcher.flush())
+    pcm = np.concatenate(blocks)
+    return np.round(np.clip(pcm, -1.0, 1.0) * PCM_SCALE).astype(np.int16)
+
+
+def render_for_cache(cache_dir, key, rates):
+    """
+    Worker-process job: render the missing renditions of a cached track.
+    The decoded PCM is read memory-mapped from its cache entry.
+    :return: Dict mapping each rendered rate to the size of its file.
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    audio = np.load(os.path.join(entry_dir, "pcm.npy"), mmap_mode='r')
+    sizes = {}
+    for rate in rates:
+        if os.path.exists(os.path.join(entry_dir, "renditions", "r%.4f.npy" % rate)):
+            continue
+        sizes[rate] = write_rendition(cache_dir, key, rate, render_rendition(audio, rate))
+    return sizes
+
+
+class RenditionRenderer:
+    """
+    Renders renditions of cached tracks in a background process, so the
+    phase vocoder never competes with the audio thread for the GIL.
+    """
+
+    def __init__(self, cache, rates=None, workers=1):
+        """
+        :param cache: SongAnalysisCache holding the tracks and receiving the renditions.
+        :param rates: Stretch rates to render (default: rendition_rates()).
+        :param workers: Number of worker processes.
+        """
+        self.cache = cache
+        self.rates = tuple(rates) if rates is not None else rendition_rates()
+        self.workers = workers
+        self._pool = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def ready(self, path):
+        """
+        :return: True if every rendition of path is on disk.
+        """
+        return len(self.cache.renditions(path)) >= len(self.rates)
+
+    def submit(self, path):
+        """
+        Queue path for rendering unless it is done or already queued. The track
+        must already be in the cache (see SongAnalysisCache.load).
+        """
+        key = self.cache.key_for(path)
+        with self._lock:
+            if key in self._pending or self.ready(path):
+                return
+            self._pending.add(key)
+            if self._pool is None:
+                # Spawned, not forked: the app process runs Tk and audio threads
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context("spawn"))
+        future = self._pool.submit(render_for_cache, self.cache.cache_dir, key, self.rates)
+        future.add_done_callback(lambda f: self._done(key, path, f))
+
+    def _done(self, key, path, future):
+        with self._lock:
+            self._pending.discard(key)
+        try:
+            sizes = future.result()
+        except Exception as e:
+            log.warning("Could not render renditions", extra={"path": path, "error": str(e)})
+            return
+        for size in sizes.values():
+            self.cache.add_rendition(key, size)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class RenditionSource:
+    """
+    Plays a track at any rate from its precomputed renditions.
+
+    The rendition nearest to the requested rate is read with linear
+    resampling for the small remaining difference, which shifts the pitch by
+    at most half the rendition spacing. When the nearest rendition changes, the
+    old and new ones are crossfaded at the same song position. Reading is a
+    memory-mapped slice plus one np.interp per rendition, so real-time CPU is
+    a small fraction of live stretching.
+    """
+
+    def __init__(self, renditions, sample_rate, output_rate, length, info=None, rate=1.0,
+                 fade_samples=2048, n_fft=2048, hop_length=512):
+        """
+        :param renditions: Dict mapping stretch rate to int16 PCM (see SongAnalysisCache.renditions).
+        :param sample_rate: Sample rate of the renditions.
+        :param output_rate: Sample rate to deliver.
+        :param length: Length of the unstretched track in samples.
+        :param info: Track metadata, as for TrackSource.
+        :param rate: Initial playback rate.
+        :param fade_samples: Length of the crossfade between renditions.
+        :param n_fft: FFT size the renditions were rendered with.
+        :param hop_length: Hop the renditions were rendered with.
+        """
+        if not renditions:
+            raise ValueError("No renditions given")
+        self.renditions = renditions
+        self.rates = np.array(sorted(renditions))
+        self.sample_rate = sample_rate
+        self.output_rate = output_rate
+        self.length = length
+        self.info = info or {}
+        self.rate = rate
+        self.fade_samples = fade_samples
+        # Rendition sample c + k maps to song sample hop + c + k * rate (frame centres, see StreamingTimeStretcher)
+        self._center = n_fft // 2
+        self._hop = hop_length
+
+        self._song_pos = 0.0        # position in the unstretched track, in samples
+        self._current = self._nearest(rate)
+        self._previous = None       # rendition being faded out
+        self._fade_done = 0
+        self._produced = 0
+        self.position_marks = deque(maxlen=256)  # (output index, song sample)
+
+    def _nearest(self, rate):
+        return float(self.rates[np.argmin(np.abs(np.log(self.rates / rate)))])
+
+    def remaining(self):
+        step = self.rate * self.sample_rate / self.output_rate
+        return max(int((self.length - self._song_pos) / step), 0)
+
+    def _read_rendition(self, rendition_rate, song_positions):
+        pcm = self.renditions[rendition_rate]
+        index = self._center + (song_positions - self._hop - self._center) / rendition_rate
+        index = np.clip(index, 0, len(pcm) - 1)
+        start = int(index[0])
+        stop = min(int(index[-1]) + 2, len(pcm))
+        window = np.asarray(pcm[start:stop], dtype=np.float32) / PCM_SCALE
+        return np.interp(index - start, np.arange(len(window)), window).astype(np.float32)
+
+    def read(self, n):
+        n = min(n, self.remaining())
+        if n <= 0:
+            return np.zeros(0, dtype=np.float32)
+        step = self.rate * self.sample_rate / self.output_rate
+        song_positions = self._song_pos + step * np.arange(n)
+
+        nearest = self._nearest(self.rate)
+        if nearest != self._current and self._previous is None:
+            self._previous, self._current = self._current, nearest
+            self._fade_done = 0
+
+        chunk = self._read_rendition(self._current, song_positions)
+        if self._previous is not None:
+            progress = np.clip((self._fade_done + np.arange(n)) / self.fade_samples, 0, 1)
+            outgoing = self._read_rendition(self._previous, song_positions)
+            chunk = outgoing * np.cos(0.5 * np.pi * progress) + chunk * np.sin(0.5 * np.pi * progress)
+            self._fade_done += n
+            if self._fade_done >= self.fade_samples:
+                self._previous = None
+
+        self.position_marks.append((self._produced, self._song_pos))
+        self._song_pos += step * n
+        self._produced += n
+        return chunk.astype(np.float32)
+
+    def seconds_at(self, index):
+        """
+        :param index: Output sample index since the start of the track.
+        :return: Seconds into the track, or None if index is outside the recent history.
+        """
+        marks = list(self.position_marks) + [(self._produced, self._song_pos)]
+        outputs, positions = np.array(marks, dtype=np.float64).T
+        if index < outputs[0] or index > outputs[-1] + self.output_rate:
+            return None
+        if index >= outputs[-1]:
+            song_pos = positions[-1] + (index - outputs[-1]) * self.rate * self.sample_rate / self.output_rate
+        else:
+            song_pos = float(np.interp(index, outputs, positions))
+        return song_pos / self.sample_rate
+
+
+if __name__ == '__main__':
+    from library_indexer import LibraryIndex, DEFAULT_INDEX_PATH
+
+    parser = argparse.ArgumentParser(description="Pre-render stretched renditions of indexed tracks")
+    parser.add_argument("paths", nargs="*", help="tracks to render (default: every indexed track)")
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH)
+    parser.add_argument("--min-rate", type=float, default=0.8)
+    parser.add_argument("--max-rate", type=float, default=1.25)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    configure_logging()
+    cache = SongAnalysisCache()
+    paths = args.paths or [path for path, _, _ in LibraryIndex(args.index, cache).tracks()]
+    rates = rendition_rates(args.min_rate, args.max_rate)
+    print(f"Rendering {len(paths)} tracks at rates {', '.join(f'{r:.3f}' for r in rates)}")
+    # Rendering past the budget would only evict the renditions written earlier in this run
+    planned = cache.rendition_bytes()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = []
+        for path in paths:
+            analysis = cache.load(path)  # decodes on a cache miss
+            missing = [rate for rate in rates if rate not in cache.renditions(path)]
+            planned += rendition_size(len(analysis["audio"]), missing)
+            if planned > cache.rendition_max_bytes:
+                print(f"Stopping before {path}: renditions would exceed the "
+                      f"{cache.rendition_max_bytes / 1024 ** 3:.1f} GiB budget")
+                break
+            key = cache.key_for(path)
+            futures.append((path, key, pool.submit(render_for_cache, cache.cache_dir, key, rates)))
+        for done, (path, key, future) in enumerate(futures, 1):
+            try:
+                sizes = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(futures)}] Could not render {path}: {e}")
+                continue
+            for size in sizes.values():
+                cache.add_rendition(key, size)
+            print(f"[{done}/{len(futures)}] {path}: {len(sizes)} renditions")
@@ -0,0 +1,296 @@
+import argparse
+import os
+import pty
+import socket
+import struct
+import threading
+import time
+import numpy as np
+
+from udp_ingest import encode_frame, frame_session_id, parse_frame
+
+# Recording file: magic line, then records of
+# (timestamp f64, kind u8, payload length u16) followed by the payload bytes.
+RECORDING_MAGIC = b'JMREC1\n'
+RECORD_HEADER = struct.Struct('<dBH')
+UDP = 1     # raw accelerometer datagram
+SERIAL = 2  # raw heart-rate line
+
+
+class Recorder:
+    """
+    Appends raw sensor payloads with their arrival time to a recording file.
+    Safe to share between the UDP and serial capture threads.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(RECORDING_MAGIC)
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def record(self, kind, payload, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            self._file.write(RECORD_HEADER.pack(timestamp, kind, len(payload)))
+            self._file.write(payload)
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def capture_udp(sock, recorder, stop_event):
+    """Record every datagram received on sock until stop_event is set."""
+    sock.settimeout(0.5)
+    while not stop_event.is_set():
+        try:
+            data, _ = sock.recvfrom(2048)
+        except socket.timeout:
+            continue
+        recorder.record(UDP, data)
+
+
+def capture_serial(port, recorder, stop_event, baud_rate=9600):
+    """Record every line read from a serial port until stop_event is set."""
+    import serial
+
+    with serial.Serial(port, baud_rate, timeout=0.5) as connection:
+        while not stop_event.is_set():
+            line = connection.readline()
+            if line:
+                recorder.record(SERIAL, line)
+
+
+def read_recording(path):
+    """
+    :return: Iterator of (timestamp, kind, payload) records.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a JogMusic recording")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, kind, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield timestamp, kind, payload
+
+
+def recorded_samples(path):
+    """
+    Extract the accelerometer stream of a recording for offline analysis.
+    Binary frames are timed with their sender timestamps, shifted onto the
+    recording clock by the smallest observed delivery delay; text datagrams
+    use their arrival time.
+    :return: Tuple (timestamps, samples) with n times and an (n, 3) array.
+    """
+    frames = []
+    rows = []
+    for timestamp, kind, payload in read_recording(path):
+        if kind != UDP:
+            continue
+        try:
+            samples, _, sender_time, interval = parse_frame(payload)
+        except ValueError:
+            try:
+                rows.append((timestamp, [float(v) for v in payload.split(b',')]))
+            except ValueError:
+                pass
+            continue
+        times = sender_time + interval * np.arange(len(samples))
+        frames.append((timestamp, times, samples))
+
+    times, samples = [], []
+    if frames:
+        offset = min(arrival - frame_times[-1] for arrival, frame_times, _ in frames)
+        for _, frame_times, frame_samples in frames:
+            times.append(frame_times + offset)
+            samples.append(frame_samples)
+    for timestamp, row in rows:
+        if len(row) == 3:
+            times.append([timestamp])
+            samples.append([row])
+    if not times:
+        return np.zeros(0), np.zeros((0, 3))
+    times = np.concatenate(times)
+    samples = np.concatenate(samples).astype(np.float64).reshape(-1, 3)
+    order = np.argsort(times, kind='stable')
+    return times[order], samples[order]
+
+
+def synthetic_records(rate=100.0, duration=10.0, cadence=165.0, hr=140, frame_samples=10,
+                      amplitude=14.0, noise=0.5, seed=0, session_id=None):
+    """
+    Generate a recording-like stream of binary accelerometer frames at an arbitrary
+    sampling rate, plus one heart-rate line per second.
+    :param rate: Accelerometer sampling rate in Hz (several kHz is fine).
+    :param duration: Length in seconds.
+    :param cadence: Simulated steps per minute.
+    :param hr: Simulated heart rate.
+    :param frame_samples: Samples per datagram.
+    :param session_id: Optional runner session ID carried in every frame.
+    :return: Iterator of (timestamp, kind, payload) with timestamps starting at 0.
+    """
+    rng = np.random.default_rng(seed)
+    interval = 1.0 / rate
+    n = int(rate * duration)
+    t = np.arange(n) * interval
+    samples = np.zeros((n, 3), dtype=np.float32)
+    samples[:, 2] = 9.8 + amplitude * np.sin(2 * np.pi * cadence / 60 * t)
+    samples += (noise * rng.standard_normal(samples.shape)).astype(np.float32)
+
+    next_hr = 0.0
+    for seq, start in enumerate(range(0, n, frame_samples)):
+        frame_end = t[min(start + frame_samples, n) - 1]
+        while next_hr <= frame_end:
+            yield next_hr, SERIAL, f"{hr}\r\n".encode()
+            next_hr += 1.0
+        # A frame leaves the phone once its last sample has been taken
+        yield frame_end, UDP, encode_frame(samples[start:start + frame_samples], seq, t[start], interval,
+                                             session_id)
+
+
+class Replayer:
+    """
+    Plays recorded or synthetic records into a local UDP socket and a
+    pty-backed fake serial port.
+
+    Point cadence_inference.main at udp_target and HeartRateReader at
+    serial_port to run the whole pipeline without a phone or HR strap.
+
+    At speeds other than 1 the sender timestamps inside binary frames are
+    rescaled too, so the receiver's clock sync stays consistent; the stream
+    then looks like a runner going speed times faster, which is fine for load
+    tests but not for judging cadence accuracy.
+    """
+
+    def __init__(self, udp_target=("127.0.0.1", 12345), speed=1.0, fake_serial=True):
+        """
+        :param udp_target: (host, port) datagrams are sent to.
+        :param speed: Playback speed; 0 sends everything as fast as possible.
+        :param fake_serial: Open a pty pair whose slave side acts as the serial device.
+        """
+        self.udp_target = udp_target
+        self.speed = speed
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._master = None
+        self.serial_port = None
+        if fake_serial:
+            self._master, slave = pty.openpty()
+            self.serial_port = os.ttyname(slave)
+            self._slave = slave
+        self.stop_event = threading.Event()
+        self.sent = {UDP: 0, SERIAL: 0}
+
+    def play(self, records):
+        """
+        Send records, paced by their timestamps divided by speed.
+        :param records: Iterable of (timestamp, kind, payload).
+        :return: Wall-clock seconds taken.
+        """
+        start = time.perf_counter()
+        first = None
+        for timestamp, kind, payload in records:
+            if self.stop_event.is_set():
+                break
+            if first is None:
+                first = timestamp
+            if self.speed > 0:
+                delay = (timestamp - first) / self.speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if kind == UDP:
+                if self.speed > 0 and self.speed != 1.0:
+                    payload = self._retime(payload)
+                self._sock.sendto(payload, self.udp_target)
+            elif kind == SERIAL and self._master is not None:
+                os.write(self._master, payload)
+            self.sent[kind] = self.sent.get(kind, 0) + 1
+        return time.perf_counter() - start
+
+    def _retime(self, payload):
+        try:
+            samples, seq, timestamp, interval = parse_frame(payload)
+        except ValueError:
+            return payload  # legacy text datagram, no timestamp to fix
+        return encode_frame(samples, seq, timestamp / self.speed, interval / self.speed,
+                            frame_session_id(payload))
+
+    def close(self):
+        self._sock.close()
+        if self._master is not None:
+            os.close(self._master)
+            os.close(self._slave)
+
+
+def _address(text):
+    host, port = text.rsplit(':', 1)
+    return host, int(port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record and replay JogMusic sensor streams")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    record = sub.add_parser("record", help="capture raw sensor streams to a file")
+    record.add_argument("output")
+    record.add_argument("--udp", type=_address, help="HOST:PORT to listen on for the phone")
+    record.add_argument("--serial", help="heart-rate serial device, e.g. /dev/rfcomm0")
+    record.add_argument("--duration", type=float, default=None)
+
+    play = sub.add_parser("replay", help="replay a recording")
+    play.add_argument("input")
+    play.add_argument("--target", type=_address, default=("127.0.0.1", 12345))
+    play.add_argument("--speed", type=float, default=1.0, help="0 = as fast as possible")
+
+    synth = sub.add_parser("synth", help="send a synthetic stream")
+    synth.add_argument("--target", type=_address, default=("127.0.0.1", 12345))
+    synth.add_argument("--rate", type=float, default=100.0)
+    synth.add_argument("--duration", type=float, default=10.0)
+    synth.add_argument("--cadence", type=float, default=165.0)
+    synth.add_argument("--speed", type=float, default=1.0, help="0 = as fast as possible")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        recorder = Recorder(args.output)
+        stop_event = threading.Event()
+        threads = []
+        if args.udp:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(args.udp)
+            threads.append(threading.Thread(target=capture_udp, args=[sock, recorder, stop_event], daemon=True))
+        if args.serial:
+            threads.append(threading.Thread(target=capture_serial, args=[args.serial, recorder, stop_event],
+                                            daemon=True))
+        for thread in threads:
+            thread.start()
+        print(f"Recording to {args.output}... (Ctrl+C to stop)")
+        try:
+            stop_event.wait(args.duration)
+        except KeyboardInterrupt:
+            pass
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+        recorder.close()
+        print(f"Recorded {recorder.records} records.")
+    else:
+        replayer = Replayer(args.target, speed=args.speed)
+        print(f"Fake serial port: {replayer.serial_port}")
+        if args.command == "replay":
+            records = read_recording(args.input)
+        else:
+            records = synthetic_records(args.rate, args.duration, args.cadence)
+        try:
+            elapsed = replayer.play(records)
+            print(f"Sent {replayer.sent[UDP]} datagrams and {replayer.sent[SERIAL]} HR lines in {elapsed:.2f} s")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            replayer.close()
@@ -0,0 +1,472 @@
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import queue
+import select
+import socket
+import socketserver
+import threading
+import time
+import zlib
+import numpy as np
+
+from cadence_inference import StreamingStrideEstimator, UniformResampler, wifi_connect
+from channels import Channel, DROP_OLDEST
+from metrics import REGISTRY, configure_logging, serve_http
+from song_cache import DEFAULT_CACHE_DIR
+from udp_ingest import FRAME_MAGIC, MAX_DATAGRAM, ClockSync, frame_session_id, parse_frame
+
+DEFAULT_SOCKET = os.path.join(DEFAULT_CACHE_DIR, "runners.sock")
+ALL_RUNNERS = "*"
+
+log = logging.getLogger("jogmusic.server")
+_datagrams = REGISTRY.counter("server.datagrams")
+_updates = REGISTRY.counter("server.updates")
+_dispatch_seconds = REGISTRY.histogram("server.dispatch_seconds")
+_publish_lag = REGISTRY.histogram("server.publish_lag_seconds")
+
+
+def runner_key(data, addr):
+    """
+    :return: "session-<id>" for frames that carry a session ID, else "<ip>:<port>" of the sender.
+    """
+    session_id = frame_session_id(data)
+    if session_id is not None:
+        return f"session-{session_id}"
+    return f"{addr[0]}:{addr[1]}"
+
+
+def shard_of(key, shards):
+    """Stable shard index of a runner key, the same in every process and run."""
+    return zlib.crc32(key.encode()) % shards
+
+
+class RunnerEstimator:
+    """
+    Cadence state of one runner: clock sync, resampling onto a uniform grid
+    and the streaming stride estimator, as in cadence_inference.main's
+    streaming path.
+    """
+
+    def __init__(self, resample_rate=50, window=100):
+        self.clock = ClockSync()
+        self.resampler = UniformResampler(resample_rate)
+        self.resample_rate = resample_rate
+        self.estimator = StreamingStrideEstimator(window=window)
+        self.last_seen = 0.0
+        self.samples = 0
+        self.parse_errors = 0
+        self._last_time = 0.0
+
+    def decode(self, data, arrival):
+        """
+        Decode one datagram and time its samples on the local clock.
+        :return: Tuple (samples, times), or None if the datagram is malformed.
+        """
+        self.last_seen = arrival
+        if data[:2] == FRAME_MAGIC:
+            try:
+                samples, _, sender_time, interval = parse_frame(data)
+            except ValueError:
+                self.parse_errors += 1
+                return None
+            times = sender_time + interval * np.arange(len(samples))
+            times += self.clock.update(times[-1], arrival)
+        else:
+            try:
+                samples = np.array([float(v) for v in data.split(b',')], dtype=np.float32).reshape(1, 3)
+            except ValueError:
+                self.parse_errors += 1
+                return None
+            times = np.array([max(arrival, self._last_time)])
+        self._last_time = times[-1]
+        return samples, times
+
+    def process(self, samples, times):
+        """
+        :return: Tuple (stride rate or None, list of footfall times) after this block.
+        """
+        self.samples += len(samples)
+        times, samples = self.resampler.process(times, samples)
+        if len(samples) == 0:
+            return self.estimator.stride_rate, []
+        events = self.estimator.update_block(samples, self.resample_rate, times)
+        return self.estimator.stride_rate, [step_time for _, step_time in events]
+
+
+def shard_worker(inbox, outbox, resample_rate=50, idle_timeout=60.0):
+    """
+    Process entry point: owns the RunnerEstimators of every runner routed to this shard.
+    Reads batches of (runner, arrival, datagram) from inbox and puts lists of update
+    dicts on outbox.
+    """
+    # cadence_inference loads scipy.signal on first use; do it now so the first
+    # datagrams do not wait behind the import
+    import scipy.signal  # noqa: F401
+
+    configure_logging()
+    outbox.put([])  # ready
+    runners = {}
+    last_expiry = time.time()
+    while True:
+        try:
+            batch = inbox.get(timeout=1.0)
+        except queue.Empty:
+            batch = []
+        if batch is None:
+            break
+
+        # Every runner's datagrams of this batch are filtered as one block
+        blocks = {}
+        for key, arrival, data in batch:
+            runner = runners.get(key)
+            if runner is None:
+                runner = runners[key] = RunnerEstimator(resample_rate)
+            decoded = runner.decode(data, arrival)
+            if decoded is not None:
+                blocks.setdefault(key, []).append(decoded)
+
+        updates = []
+        for key, parts in blocks.items():
+            samples = np.concatenate([samples for samples, _ in parts])
+            times = np.concatenate([times for _, times in parts])
+            cadence, strides = runners[key].process(samples, times)
+            updates.append({"runner": key, "t": float(times[-1]), "cadence": cadence, "strides": strides})
+
+        now = time.time()
+        if now - last_expiry >= 1.0:
+            last_expiry = now
+            for key in [key for key, runner in runners.items() if now - runner.last_seen > idle_timeout]:
+                del runners[key]
+                updates.append({"runner": key, "t": now, "cadence": None, "strides": [], "left": True})
+        if updates:
+            outbox.put(updates)
+
+
+class _Subscriber:
+    def __init__(self, runner, capacity):
+        self.runner = runner
+        self.channel = Channel(capacity, policy=DROP_OLDEST)
+
+    def wants(self, runner):
+        return self.runner == ALL_RUNNERS or self.runner == runner
+
+
+class _SubscriberHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # One request line: "subscribe <runner or *>" streams JSON updates,
+        # "runners" returns the latest update of every active runner
+        server = self.server.runner_server
+        words = self.rfile.readline().decode(errors="replace").split()
+        if not words or words[0] == "runners":
+            self.wfile.write(json.dumps(server.runners()).encode() + b"\n")
+            return
+        if words[0] != "subscribe":
+            self.wfile.write(json.dumps({"error": f"unknown request {words[0]!r}"}).encode() + b"\n")
+            return
+        subscriber = server.add_subscriber(words[1] if len(words) > 1 else ALL_RUNNERS)
+        try:
+            while not server.stopping.is_set():
+                try:
+                    line = subscriber.channel.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                self.wfile.write(line)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            server.remove_subscriber(subscriber)
+
+
+class RunnerServer:
+    """
+    Serves cadence for many runners from one UDP port.
+
+    A receiver thread drains the socket and routes every datagram by runner
+    key (session ID, else sender address) to the worker process that owns the
+    runner, so each runner's filter state lives in exactly one process and
+    workers share nothing. Datagrams are forwarded in per-wakeup batches to
+    keep the inter-process overhead per packet small. Workers return cadence
+    and footfall updates, which a publisher thread encodes once and fans out
+    as JSON lines to every subscriber of the local UNIX socket. Each
+    subscriber has its own bounded channel, so a slow player loses old updates
+    instead of holding up the others.
+    """
+
+    def __init__(self, sock, workers=None, socket_path=DEFAULT_SOCKET, resample_rate=50, idle_timeout=60.0,
+                 subscriber_capacity=256, max_datagrams=512):
+        """
+        :param sock: Bound UDP socket receiving every runner's phone.
+        :param workers: Number of shard processes (default: CPU count).
+        :param socket_path: UNIX socket players subscribe on.
+        :param resample_rate: Rate in Hz of each runner's uniform filtering grid.
+        :param idle_timeout: Seconds of silence after which a runner's state is dropped.
+        :param subscriber_capacity: Updates buffered per subscriber before the oldest are dropped.
+        :param max_datagrams: Upper bound of datagrams read per wakeup.
+        """
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.workers = workers or os.cpu_count() or 1
+        self.socket_path = socket_path
+        self.resample_rate = resample_rate
+        self.idle_timeout = idle_timeout
+        self.subscriber_capacity = subscriber_capacity
+        self.max_datagrams = max_datagrams
+
+        # Spawned, not forked, as elsewhere: the parent runs several threads
+        self._ctx = mp.get_context("spawn")
+        self._inboxes = []
+        self._outbox = None
+        self._processes = []
+        self._threads = []
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+        self._latest = {}
+        self._unix_server = None
+        self.stopping = threading.Event()
+
+        self.datagrams = 0
+        self.updates = 0
+        self.per_shard = [0] * self.workers
+
+    def start(self, ready_timeout=60.0):
+        """
+        Spawn the shard workers and wait until they are ready, so no datagrams queue up
+        behind their imports, then start receiving and publishing.
+        """
+        self.stopping.clear()
+        self._outbox = self._ctx.Queue()
+        for shard in range(self.workers):
+            inbox = self._ctx.Queue()
+            process = self._ctx.Process(target=shard_worker, args=(inbox, self._outbox, self.resample_rate,
+                                                                   self.idle_timeout),
+                                        name=f"jogmusic-shard-{shard}", daemon=True)
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        deadline = time.time() + ready_timeout
+        ready = 0
+        while ready < self.workers:
+            try:
+                self._outbox.get(timeout=0.5)
+                ready += 1
+            except queue.Empty:
+                if not all(process.is_alive() for process in self._processes) or time.time() > deadline:
+                    self.stop()
+                    raise RuntimeError("Shard workers failed to start")
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._unix_server = socketserver.ThreadingUnixStreamServer(self.socket_path, _SubscriberHandler)
+        self._unix_server.daemon_threads = True
+        self._unix_server.runner_server = self
+
+        self._threads = [threading.Thread(target=self._receive, daemon=True),
+                         threading.Thread(target=self._publish, daemon=True),
+                         threading.Thread(target=self._unix_server.serve_forever, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        REGISTRY.gauge("server", self.stats)
+        log.info("Runner server started", extra={"workers": self.workers, "socket": self.socket_path})
+
+    def stop(self):
+        self.stopping.set()
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+        if self._unix_server is not None:
+            self._unix_server.shutdown()
+            self._unix_server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._inboxes, self._processes, self._threads = [], [], []
+
+    def _receive(self):
+        buffer = bytearray(MAX_DATAGRAM)
+        view = memoryview(buffer)
+        while not self.stopping.is_set():
+            ready, _, _ = select.select([self.sock], [], [], 0.5)
+            if not ready:
+                continue
+            dispatch_start = time.perf_counter()
+            batches = [[] for _ in range(self.workers)]
+            for _ in range(self.max_datagrams):
+                try:
+                    nbytes, addr = self.sock.recvfrom_into(buffer)
+                except (BlockingIOError, InterruptedError):
+                    break
+                data = bytes(view[:nbytes])
+                key = runner_key(data, addr)
+                batches[shard_of(key, self.workers)].append((key, time.time(), data))
+            for shard, batch in enumerate(batches):
+                if batch:
+                    self._inboxes[shard].put(batch)
+                    self.per_shard[shard] += len(batch)
+                    self.datagrams += len(batch)
+                    _datagrams.inc(len(batch))
+            _dispatch_seconds.observe_since(dispatch_start)
+
+    def _publish(self):
+        while not self.stopping.is_set():
+            try:
+                updates = self._outbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            now = time.time()
+            with self._subscribers_lock:
+                subscribers = list(self._subscribers)
+            for update in updates:
+                runner = update["runner"]
+                if update.get("left"):
+                    self._latest.pop(runner, None)
+                    log.info("Runner left", extra={"runner": runner})
+                else:
+                    if runner not in self._latest:
+                        log.info("Runner joined", extra={"runner": runner})
+                        REGISTRY.trace("server.runner_joined", runner=runner)
+                    self._latest[runner] = update
+                _publish_lag.observe(now - update["t"])
+                line = json.dumps(update).encode() + b"\n"
+                for subscriber in subscribers:
+                    if subscriber.wants(runner):
+                        subscriber.channel.put(line, block=False, timestamp=update["t"])
+            self.updates += len(updates)
+            _updates.inc(len(updates))
+
+    def add_subscriber(self, runner):
+        subscriber = _Subscriber(runner, self.subscriber_capacity)
+        # New players start from the latest known cadence instead of waiting for the next packet
+        for key, update in list(self._latest.items()):
+            if subscriber.wants(key):
+                subscriber.channel.put(json.dumps(update).encode() + b"\n", timestamp=update["t"])
+        with self._subscribers_lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def remove_subscriber(self, subscriber):
+        with self._subscribers_lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def runners(self):
+        """
+        :return: Dict mapping every active runner to its latest update.
+        """
+        return dict(self._latest)
+
+    def stats(self):
+        """
+        :return: Dict with datagram and update counts, datagrams per shard, active runners,
+            subscribers and updates dropped for slow subscribers.
+        """
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        return {
+            "datagrams": self.datagrams,
+            "updates": self.updates,
+            "per_shard": list(self.per_shard),
+            "runners": len(self._latest),
+            "subscribers": len(subscribers),
+            "subscriber_dropped": sum(s.channel.dropped for s in subscribers),
+        }
+
+
+def subscribe(cadence_queue, runner=None, socket_path=DEFAULT_SOCKET, stride_queue=None,
+              stop_event=None, reconnect_delay=1.0):
+    """
+    Feed a runner's cadence from a RunnerServer into cadence_queue, in place of
+    running cadence_inference.main on a local socket. Reconnects when the
+    server restarts.
+    :param cadence_queue: Channel (or queue-like object) receiving the stride rate, None if unknown.
+    :param runner: Runner key to follow (see runner_key). None follows the first runner seen and
+        ignores the others; "*" forwards every runner's updates, for monitoring and logging only,
+        since a player fed by several runners would average their cadences and steps.
+    :param socket_path: The server's UNIX socket.
+    :param stride_queue: Optional channel receiving the time of every footfall.
+    :param stop_event: Optional threading.Event that ends the loop when set.
+    """
+    ignored = set()
+    while stop_event is None or not stop_event.is_set():
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.connect(socket_path)
+                conn.sendall(f"subscribe {runner or ALL_RUNNERS}\n".encode())
+                log.info("Subscribed to runner server", extra={"runner": runner or ALL_RUNNERS, "socket": socket_path})
+                pending = b""
+                while stop_event is None or not stop_event.is_set():
+                    ready, _, _ = select.select([conn], [], [], 1.0)
+                    if not ready:
+                        continue
+                    data = conn.recv(1 << 16)
+                    if not data:
+                        break
+                    *lines, pending = (pending + data).split(b"\n")
+                    for line in lines:
+                        update = json.loads(line)
+                        if runner is None:
+                            runner = update["runner"]
+                            log.info("Following runner", extra={"runner": runner})
+                        elif runner != ALL_RUNNERS and update["runner"] != runner:
+                            if update["runner"] not in ignored:
+                                ignored.add(update["runner"])
+                                log.warning("Ignoring another runner, pass --runner to choose",
+                                            extra={"runner": update["runner"], "following": runner})
+                            continue
+                        cadence_queue.put(update["cadence"], block=False, timestamp=update["t"])
+                        if stride_queue is not None:
+                            for step_time in update["strides"]:
+                                stride_queue.put(step_time, block=False, timestamp=step_time)
+        except OSError as e:
+            log.warning("Runner server unavailable", extra={"socket": socket_path, "error": str(e)})
+        if stop_event is not None:
+            stop_event.wait(reconnect_delay)
+        else:
+            time.sleep(reconnect_delay)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve cadence for many runners from one box")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="receive phone packets and publish per-runner cadence")
+    serve.add_argument("--host", default="0.0.0.0", help="address to receive phone packets on")
+    serve.add_argument("--port", type=int, default=12345)
+    serve.add_argument("--workers", type=int, default=None, help="shard processes (default: CPU count)")
+    serve.add_argument("--socket", default=DEFAULT_SOCKET, help="UNIX socket players subscribe on")
+    serve.add_argument("--metrics-port", type=int, default=None)
+    watch = commands.add_parser("watch", help="print updates from a running server")
+    watch.add_argument("--runner", default=ALL_RUNNERS)
+    watch.add_argument("--socket", default=DEFAULT_SOCKET)
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.command == "serve":
+        if args.metrics_port is not None:
+            serve_http(args.metrics_port)
+        server = RunnerServer(wifi_connect(args.host, args.port), workers=args.workers, socket_path=args.socket)
+        server.start()
+        try:
+            while True:
+                time.sleep(10)
+                log.info("Server stats", extra=server.stats())
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(args.socket)
+            conn.sendall(f"subscribe {args.runner}\n".encode())
+            try:
+                for line in conn.makefile('rb'):
+                    update = json.loads(line)
+                    cadence = "-" if update["cadence"] is None else f"{update['cadence']:.1f}"
+                    print(f"{update['runner']:<24} {cadence:>6} spm  {len(update['strides'])} strides")
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,440 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import numpy as np
+
+from channels import Channel, BLOCK
+from metrics import configure_logging
+from song_cache import DEFAULT_CACHE_DIR
+
+# Session file: 8-byte magic, then chunks of (stream id u8, 3 pad bytes, record count u32)
+# followed by the chunk's columns one after another, each padded to 8 bytes.
+# Every column of a chunk is therefore an aligned array that can be memory-mapped in place.
+SESSION_MAGIC = b'JMSES1\n\0'
+CHUNK_HEADER = struct.Struct('<BxxxI')
+DEFAULT_SESSION_DIR = os.path.join(DEFAULT_CACHE_DIR, "sessions")
+
+# Stream name -> (id, columns). Every stream starts with its time column (time.time() seconds).
+STREAMS = {
+    "accel": (1, (("t", "<f8"), ("x", "<f4"), ("y", "<f4"), ("z", "<f4"))),
+    "stride": (2, (("t", "<f8"),)),
+    "cadence": (3, (("t", "<f8"), ("cadence", "<f4"))),  # NaN while unknown
+    "hr": (4, (("t", "<f8"), ("hr", "<f4"))),
+    "speed": (5, (("t", "<f8"), ("speed", "<f4"))),
+    "mode": (6, (("t", "<f8"), ("mode", "u1"))),
+}
+STREAM_IDS = {stream_id: name for name, (stream_id, _) in STREAMS.items()}
+MODES = ("resting", "warmup", "workout", "slow down")
+UNKNOWN_MODE = 255
+
+log = logging.getLogger("jogmusic.session")
+
+
+def session_path(directory=DEFAULT_SESSION_DIR, suffix=""):
+    """
+    :return: A new timestamped session file path in directory, e.g. session-20250101-0930.jms.
+    """
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, time.strftime("session-%Y%m%d-%H%M%S") + suffix + ".jms")
+
+
+def _padded(nbytes):
+    return (nbytes + 7) & ~7
+
+
+def _chunk_size(columns, n):
+    return sum(_padded(n * np.dtype(dtype).itemsize) for _, dtype in columns)
+
+
+def _walk_chunks(data, path):
+    """
+    Walk the chunk headers of a session file's bytes.
+    :return: Iterator of (stream name, record count, offset of the first column, end of the chunk).
+        Stops at a truncated or unrecognised chunk.
+    """
+    if bytes(data[:len(SESSION_MAGIC)]) != SESSION_MAGIC:
+        raise ValueError(f"{path} is not a session log")
+    pos = len(SESSION_MAGIC)
+    while pos + CHUNK_HEADER.size <= len(data):
+        stream_id, n = CHUNK_HEADER.unpack_from(data, pos)
+        if stream_id not in STREAM_IDS:
+            log.warning("Unknown stream, ignoring the rest of the file",
+                        extra={"path": path, "stream": stream_id, "offset": pos})
+            return
+        name = STREAM_IDS[stream_id]
+        end = pos + CHUNK_HEADER.size + _chunk_size(STREAMS[name][1], n)
+        if end > len(data):
+            return  # truncated tail
+        yield name, n, pos + CHUNK_HEADER.size, end
+        pos = end
+
+
+class _StreamBuffer:
+    """Preallocated columns collecting one stream's records until a chunk is full."""
+
+    def __init__(self, stream_id, columns, capacity):
+        self.stream_id = stream_id
+        self.columns = [np.empty(capacity, dtype=dtype) for _, dtype in columns]
+        self.capacity = capacity
+        self.size = 0
+        self.started = None  # time.monotonic() of the first buffered record
+
+    def append(self, values, start, n):
+        for column, value in zip(self.columns, values):
+            column[self.size:self.size + n] = value[start:start + n] if value.ndim else value
+        if self.size == 0:
+            self.started = time.monotonic()
+        self.size += n
+
+    def take_chunk(self):
+        parts = [CHUNK_HEADER.pack(self.stream_id, self.size)]
+        for column in self.columns:
+            data = column[:self.size].tobytes()
+            parts.append(data + bytes(_padded(len(data)) - len(data)))
+        self.size = 0
+        self.started = None
+        return b"".join(parts)
+
+
+class SessionWriter:
+    """
+    Appends sensor and control streams of a run to a chunked columnar file.
+
+    Producers from any thread add records to per-stream buffers; full chunks
+    (or partial ones older than flush_interval) are handed to a background
+    thread that does the file I/O, so a slow disk never stalls the DSP or audio
+    threads. Memory is bounded by one buffer per stream plus max_pending
+    chunks; when the disk falls that far behind, chunks are dropped and
+    counted. Because the file is only ever appended to in whole chunks, a
+    crash loses at most the last unflushed seconds.
+    """
+
+    def __init__(self, path, chunk_records=4096, max_pending=64, flush_interval=2.0):
+        """
+        :param path: Session file; appended to if it exists.
+        :param chunk_records: Records per stream buffered before a chunk is written.
+        :param max_pending: Chunks that may wait for the writer thread before new ones are dropped.
+        :param flush_interval: Seconds after which partial chunks are written anyway.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(SESSION_MAGIC)
+        else:
+            # A process killed mid-write leaves a partial chunk; drop it before appending
+            data = np.memmap(path, dtype=np.uint8, mode='r')
+            end = len(SESSION_MAGIC)
+            for _, _, _, end in _walk_chunks(data, path):
+                pass
+            size = len(data)
+            del data
+            if end < size:
+                self._file.truncate(end)
+        self._buffers = {name: _StreamBuffer(stream_id, columns, chunk_records)
+                         for name, (stream_id, columns) in STREAMS.items()}
+        self._lock = threading.Lock()
+        self._pending = Channel(max_pending, policy=BLOCK)
+        self._closed = False
+        self.records = 0
+        self.dropped_records = 0
+        self.bytes_written = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, stream, t, *values):
+        """
+        Add records to a stream.
+        :param stream: Stream name (see STREAMS).
+        :param t: Time or array of times, in time.time() seconds.
+        :param values: One scalar or array per remaining column of the stream.
+        """
+        columns = [np.asarray(t, dtype=np.float64)] + [np.asarray(v) for v in values]
+        n = max(len(c) if c.ndim else 1 for c in columns)
+        buffer = self._buffers[stream]
+        with self._lock:
+            if self._closed:
+                return
+            done = 0
+            while done < n:
+                count = min(n - done, buffer.capacity - buffer.size)
+                buffer.append(columns, done, count)
+                done += count
+                if buffer.size == buffer.capacity:
+                    self._emit(buffer)
+            if buffer.size and time.monotonic() - buffer.started >= self.flush_interval:
+                self._emit(buffer)
+            self.records += n
+
+    def accel(self, timestamps, samples):
+        """Raw accelerometer block: n timestamps and an (n, 3) array."""
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1, 3)
+        self.write("accel", timestamps, samples[:, 0], samples[:, 1], samples[:, 2])
+
+    def stride(self, timestamps):
+        self.write("stride", timestamps)
+
+    def cadence(self, timestamp, cadence):
+        self.write("cadence", timestamp, np.nan if cadence is None else cadence)
+
+    def hr(self, timestamp, hr):
+        self.write("hr", timestamp, hr)
+
+    def speed(self, timestamp, speed):
+        self.write("speed", timestamp, speed)
+
+    def mode(self, timestamp, mode):
+        self.write("mode", timestamp, MODES.index(mode) if mode in MODES else UNKNOWN_MODE)
+
+    def _emit(self, buffer):
+        # Called with self._lock held
+        n = buffer.size
+        if not self._pending.put(buffer.take_chunk(), block=False):
+            self.dropped_records += n
+
+    def _flush_stale(self):
+        now = time.monotonic()
+        with self._lock:
+            for buffer in self._buffers.values():
+                if buffer.size and now - buffer.started >= self.flush_interval:
+                    self._emit(buffer)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                chunk = self._pending.get(timeout=self.flush_interval)
+            except queue.Empty:
+                chunk = b""
+                self._flush_stale()
+            if chunk is None:
+                break
+            if chunk:
+                self._file.write(chunk)
+                self.bytes_written += len(chunk)
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = time.monotonic()
+        self._file.close()
+
+    def close(self):
+        """Write out every buffered record and wait for the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            chunks = [buffer.take_chunk() for buffer in self._buffers.values() if buffer.size]
+        # Outside the lock: the writer thread may need it while we wait for space
+        for chunk in chunks + [None]:
+            self._pending.put(chunk, block=True)
+        self._thread.join()
+
+    def stats(self):
+        """
+        :return: Dict with records accepted, records dropped, bytes written and chunks waiting.
+        """
+        return {
+            "records": self.records,
+            "dropped_records": self.dropped_records,
+            "bytes_written": self.bytes_written,
+            "pending_chunks": len(self._pending),
+        }
+
+
+class SessionLog:
+    """
+    Memory-mapped reader for one or more session files.
+
+    Opening a log only walks the chunk headers; column data stays on disk and
+    chunks() hands out views into the mapping, so summaries and plots of long
+    runs touch each chunk once and never hold a whole stream in RAM. A
+    truncated last chunk (e.g. after a crash) is ignored.
+    """
+
+    def __init__(self, *paths):
+        self.paths = paths
+        self._chunks = {name: [] for name in STREAMS}  # name -> [(first time, {column: view})]
+        for path in paths:
+            self._scan(path)
+        for chunks in self._chunks.values():
+            chunks.sort(key=lambda chunk: chunk[0])
+
+    def _scan(self, path):
+        if os.path.getsize(path) <= len(SESSION_MAGIC):
+            return
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        for name, n, offset, _ in _walk_chunks(data, path):
+            views = {}
+            for column, dtype in STREAMS[name][1]:
+                views[column] = np.frombuffer(data, dtype=dtype, count=n, offset=offset)
+                offset += _padded(n * np.dtype(dtype).itemsize)
+            if n:
+                self._chunks[name].append((float(views["t"][0]), views))
+
+    def chunks(self, stream):
+        """
+        :return: Iterator of dicts mapping column name to a memory-mapped array, in time order.
+        """
+        return (views for _, views in self._chunks[stream])
+
+    def count(self, stream):
+        return sum(len(views["t"]) for views in self.chunks(stream))
+
+    def column(self, stream, name):
+        """
+        :return: One column of a stream as a single array. Copies it into memory, so meant
+            for the low-rate streams (everything except accel).
+        """
+        parts = [views[name] for views in self.chunks(stream)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dict(STREAMS[stream][1])[name])
+
+    def time_range(self):
+        """
+        :return: (first, last) timestamp over all streams, or None for an empty log.
+        """
+        firsts = [views["t"][0] for chunks in self._chunks.values() for _, views in chunks]
+        lasts = [views["t"][-1] for chunks in self._chunks.values() for _, views in chunks]
+        if not firsts:
+            return None
+        return float(min(firsts)), float(max(lasts))
+
+    def accel_envelope(self, bin_seconds=1.0):
+        """
+        Acceleration magnitude per time bin, computed chunk by chunk.
+        :return: (bin start times, mean, min, max) arrays; empty bins are NaN.
+        """
+        span = self.time_range()
+        if span is None:
+            return (np.zeros(0),) * 4
+        start = span[0]
+        n_bins = int((span[1] - start) // bin_seconds) + 1
+        sums = np.zeros(n_bins)
+        counts = np.zeros(n_bins)
+        lows = np.full(n_bins, np.inf)
+        highs = np.full(n_bins, -np.inf)
+        for views in self.chunks("accel"):
+            magnitude = np.sqrt(views["x"].astype(np.float64) ** 2 + views["y"] ** 2 + views["z"] ** 2)
+            bins = ((views["t"] - start) // bin_seconds).astype(np.intp)
+            sums += np.bincount(bins, magnitude, n_bins)
+            counts += np.bincount(bins, minlength=n_bins)
+            np.minimum.at(lows, bins, magnitude)
+            np.maximum.at(highs, bins, magnitude)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        empty = counts == 0
+        lows[empty] = np.nan
+        highs[empty] = np.nan
+        return start + bin_seconds * np.arange(n_bins), means, lows, highs
+
+
+def stride_cadence(stride_times, max_gap=2.0):
+    """
+    :return: (times, cadence) with one cadence per interval between consecutive strides,
+        in strides per minute; intervals longer than max_gap seconds are skipped.
+    """
+    intervals = np.diff(stride_times)
+    keep = (intervals > 0) & (intervals <= max_gap)
+    return stride_times[1:][keep], 60.0 / intervals[keep]
+
+
+def _describe(values):
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return {"count": 0}
+    return {
+        "count": int(len(values)),
+        "mean": float(np.mean(values)),
+        "min": float(np.min(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(np.max(values)),
+    }
+
+
+def summarize(session):
+    """
+    :return: JSON-serialisable dict with the session's time span, accelerometer sample
+        count and rate, and cadence, stride cadence, HR and speed statistics, plus the
+        seconds spent in each mode.
+    """
+    span = session.time_range()
+    if span is None:
+        return {"files": list(session.paths), "duration_s": 0.0}
+    n_accel = 0
+    accel_span = [np.inf, -np.inf]
+    for views in session.chunks("accel"):
+        n_accel += len(views["t"])
+        accel_span = [min(accel_span[0], views["t"][0]), max(accel_span[1], views["t"][-1])]
+    accel_seconds = accel_span[1] - accel_span[0] if n_accel > 1 else 0.0
+
+    strides = session.column("stride", "t")
+    mode_times = session.column("mode", "t")
+    mode_codes = session.column("mode", "mode")
+    mode_seconds = {}
+    ends = np.append(mode_times[1:], span[1])
+    for code, begin, end in zip(mode_codes, mode_times, ends):
+        name = MODES[code] if code < len(MODES) else "unknown"
+        mode_seconds[name] = mode_seconds.get(name, 0.0) + float(end - begin)
+
+    return {
+        "files": list(session.paths),
+        "start": span[0],
+        "end": span[1],
+        "duration_s": span[1] - span[0],
+        "accel": {"samples": n_accel, "rate_hz": (n_accel - 1) / accel_seconds if accel_seconds else 0.0},
+        "strides": int(len(strides)),
+        "cadence": _describe(session.column("cadence", "cadence").astype(np.float64)),
+        "stride_cadence": _describe(stride_cadence(strides)[1]),
+        "hr": _describe(session.column("hr", "hr").astype(np.float64)),
+        "speed": _describe(session.column("speed", "speed").astype(np.float64)),
+        "mode_seconds": mode_seconds,
+    }
+
+
+def print_summary(summary):
+    if not summary["duration_s"]:
+        print("Empty session")
+        return
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(summary['start']))}, "
+          f"{summary['duration_s'] / 60:.1f} min, {summary['accel']['samples']} accelerometer samples "
+          f"at {summary['accel']['rate_hz']:.1f} Hz, {summary['strides']} strides")
+    print(f"{'':<16} {'count':>7} {'mean':>8} {'min':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+    for name in ("cadence", "stride_cadence", "hr", "speed"):
+        stats = summary[name]
+        if stats["count"]:
+            print(f"{name:<16} {stats['count']:>7} " + " ".join(f"{stats[k]:>8.2f}"
+                                                              for k in ("mean", "min", "p50", "p95", "max")))
+        else:
+            print(f"{name:<16} {0:>7}")
+    for mode, seconds in summary["mode_seconds"].items():
+        print(f"mode {mode:<11} {seconds / 60:>7.1f} min")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarise or plot JogMusic session logs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary_cmd = commands.add_parser("summary", help="print cadence, HR and speed statistics")
+    summary_cmd.add_argument("paths", nargs="+", help="session files of one run (e.g. app and worker logs)")
+    summary_cmd.add_argument("--json", action="store_true", help="print the summary as JSON")
+    plot_cmd = commands.add_parser("plot", help="plot a session (needs matplotlib)")
+    plot_cmd.add_argument("paths", nargs="+")
+    plot_cmd.add_argument("--out", help="save the figure to this file instead of showing it")
+    plot_cmd.add_argument("--bin", type=float, default=1.0, help="accelerometer envelope bin in seconds")
+    args = parser.parse_args()
+
+    configure_logging()
+    session = SessionLog(*args.paths)
+    if args.command == "summary":
+        summary = summarize(session)
+        if args.json:
+            print(json.dumps(summary, indent=2))
+        else:
+            print_summary(summary)
+    else:
+        from cadence_plot import plot_session
+        plot_session(session, out=args.out, bin_seconds=args.bin)
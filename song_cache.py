@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "jogmusic")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_RENDITION_MAX_BYTES = 2 * 1024 ** 3
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    :return: Hex SHA-1 of the file contents.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def analyze_file(path):
+    """
+    Decode a track to mono PCM and compute its tempo, beat grid and onset envelope.
+    :param path: Audio file path.
+    :return: Dict with audio, sample_rate, tempo, beat_times and onset_env.
+    """
+    import librosa
+
+    audio, sample_rate = librosa.load(path, sr=None, mono=True)
+    onset_env = librosa.onset.onset_strength(y=audio, sr=sample_rate)
+    tempo = float(librosa.feature.tempo(onset_envelope=onset_env, sr=sample_rate)[0])
+    _, beat_times = librosa.beat.beat_track(onset_envelope=onset_env, sr=sample_rate, bpm=tempo, units='time')
+    return {
+        "audio": audio.astype(np.float32),
+        "sample_rate": int(sample_rate),
+        "tempo": tempo,
+        "beat_times": np.asarray(beat_times, dtype=np.float64),
+        "onset_env": onset_env.astype(np.float32),
+    }
+
+
+def write_entry(cache_dir, key, analysis, source=None):
+    """
+    Write an analysis into the entry directory for key, replacing it atomically.
+    Only touches that entry, so worker processes can call it in parallel.
+    :return: Size of the entry in bytes.
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    tmp_dir = "%s.tmp%d-%d" % (entry_dir, os.getpid(), threading.get_ident())
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, "pcm.npy"), analysis["audio"])
+    np.save(os.path.join(tmp_dir, "beats.npy"), analysis["beat_times"])
+    np.save(os.path.join(tmp_dir, "onset_env.npy"), analysis["onset_env"])
+    with open(os.path.join(tmp_dir, "meta.json"), 'w') as f:
+        json.dump({"sample_rate": analysis["sample_rate"], "tempo": analysis["tempo"], "source": source}, f)
+    size = sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir))
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+    return size
+
+
+def write_rendition(cache_dir, key, rate, pcm):
+    """
+    Store a pre-stretched rendition of an entry as int16 PCM, replacing it atomically.
+    Like write_entry, safe to call from worker processes.
+    :return: Size of the rendition file in bytes.
+    """
+    rendition_dir = os.path.join(cache_dir, key, "renditions")
+    os.makedirs(rendition_dir, exist_ok=True)
+    path = os.path.join(rendition_dir, "r%.4f.npy" % rate)
+    tmp_path = "%s.tmp%d-%d" % (path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, pcm)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+class SongAnalysisCache:
+    """
+    On-disk cache of decoded PCM and tempo analysis, keyed by content hash.
+
+    Each entry is a directory named after the file's SHA-1 holding the mono
+    PCM as a .npy file (loaded memory-mapped), the beat grid, the onset
+    envelope and a small JSON metadata file. An index maps paths to their
+    hash together with the mtime and size seen when it was computed, so an
+    unchanged file is never re-hashed. Least recently used entries are
+    evicted once the cache grows beyond max_bytes.
+
+    Pre-stretched renditions (see renditions.py) live in a subdirectory of
+    the entry. They are many times larger than the decoded track, so they
+    have their own budget, rendition_max_bytes: going over it deletes the
+    renditions of the least recently used tracks and leaves their analysis
+    in place.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 rendition_max_bytes=DEFAULT_RENDITION_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.rendition_max_bytes = rendition_max_bytes
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"paths": {}, "entries": {}}
+
+    def _write_index(self):
+        # Unique per writer: the app and the indexer and renditions CLIs may share the cache
+        tmp_path = "%s.tmp%d-%d" % (self._index_path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def key_for(self, path):
+        """
+        :return: Content hash of path, reusing the stored one while mtime and size are unchanged.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            known = self._index["paths"].get(path)
+        if known and known["mtime"] == st.st_mtime and known["size"] == st.st_size:
+            return known["hash"]
+        key = file_hash(path)
+        with self._lock:
+            self._index["paths"][path] = {"mtime": st.st_mtime, "size": st.st_size, "hash": key}
+            self._write_index()
+        return key
+
+    def get(self, path):
+        """
+        :return: Cached analysis of path (see analyze_file, with audio memory-mapped), or None.
+        """
+        key = self.key_for(path)
+        with self._lock:
+            if key not in self._index["entries"]:
+                return None
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, "meta.json")) as f:
+                meta = json.load(f)
+            result = {
+                "audio": np.load(os.path.join(entry_dir, "pcm.npy"), mmap_mode='r'),
+                "sample_rate": meta["sample_rate"],
+                "tempo": meta["tempo"],
+                "beat_times": np.load(os.path.join(entry_dir, "beats.npy")),
+                "onset_env": np.load(os.path.join(entry_dir, "onset_env.npy"), mmap_mode='r'),
+            }
+        except (OSError, ValueError, KeyError):
+            # Damaged entry; drop it so it gets rebuilt
+            self._remove(key)
+            return None
+        with self._lock:
+            self._index["entries"][key]["last_used"] = time.time()
+            self._write_index()
+        return result
+
+    def put(self, path, analysis):
+        """
+        Store an analysis (as returned by analyze_file) for path.
+        """
+        key = self.key_for(path)
+        size = write_entry(self.cache_dir, key, analysis, source=os.path.abspath(path))
+        self.register(key, size)
+
+    def register(self, key, size, path=None, mtime=None, file_size=None):
+        """
+        Record an entry written with write_entry (possibly by another process).
+        If path, mtime and file_size are given, the path is mapped to key as well.
+        """
+        with self._lock:
+            if path is not None:
+                self._index["paths"][os.path.abspath(path)] = {"mtime": mtime, "size": file_size, "hash": key}
+            self._index["entries"][key] = {"size": size, "last_used": time.time()}
+            self._write_index()
+        self._evict()
+
+    def add_rendition(self, key, size):
+        """
+        Account for a rendition written with write_rendition.
+        """
+        with self._lock:
+            entry = self._index["entries"].get(key)
+            if entry is None:
+                return  # evicted while it was being rendered
+            entry["renditions"] = entry.get("renditions", 0) + size
+            entry["last_used"] = time.time()
+            self._write_index()
+        self._evict_renditions()
+
+    def rendition_bytes(self):
+        """
+        :return: Total size of the renditions on disk, as counted against rendition_max_bytes.
+        """
+        with self._lock:
+            return sum(entry.get("renditions", 0) for entry in self._index["entries"].values())
+
+    def renditions(self, path):
+        """
+        :return: Dict mapping stretch rate to the memory-mapped int16 rendition of path.
+        """
+        key = self.key_for(path)
+        rendition_dir = os.path.join(self._entry_dir(key), "renditions")
+        try:
+            names = os.listdir(rendition_dir)
+        except OSError:
+            return {}
+        renditions = {}
+        for name in names:
+            if name.startswith("r") and name.endswith(".npy"):
+                try:
+                    renditions[float(name[1:-4])] = np.load(os.path.join(rendition_dir, name), mmap_mode='r')
+                except (OSError, ValueError):
+                    continue
+        return renditions
+
+    def load(self, path):
+        """
+        Return the analysis of path, computing and caching it on a miss.
+        This can take seconds on a miss, so call it off the Tk thread.
+        """
+        cached = self.get(path)
+        if cached is not None:
+            return cached
+        self.put(path, analyze_file(path))
+        return self.get(path)
+
+    def _remove(self, key):
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        with self._lock:
+            self._index["entries"].pop(key, None)
+            self._write_index()
+
+    def _remove_renditions(self, key):
+        shutil.rmtree(os.path.join(self._entry_dir(key), "renditions"), ignore_errors=True)
+        with self._lock:
+            entry = self._index["entries"].get(key)
+            if entry is not None:
+                entry["renditions"] = 0
+            self._write_index()
+
+    def _evict_renditions(self):
+        with self._lock:
+            entries = sorted((entry["last_used"], key, entry["renditions"])
+                             for key, entry in self._index["entries"].items() if entry.get("renditions"))
+            total = sum(size for _, _, size in entries)
+        for _, key, size in entries[:-1]:
+            if total <= self.rendition_max_bytes:
+                break
+            self._remove_renditions(key)
+            total -= size
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._index["entries"].items(), key=lambda item: item[1]["last_used"])
+            total = sum(entry["size"] for _, entry in entries)
+        for key, entry in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= entry["size"]
@@ -0,0 +1,135 @@
+from collections import deque
+import numpy as np
+
+
+class StreamingTimeStretcher:
+    """
+    Stateful phase-vocoder time stretcher for chunked playback.
+
+    Unlike librosa.effects.time_stretch, the overlap-add buffer, the analysis
+    position and the phase accumulators are kept between calls to process(),
+    so consecutive chunks join without clicks. Every synthesis frame costs two
+    forward FFTs and one inverse FFT whatever the rate is, so the work per
+    output block is bounded.
+
+    For every synthesis hop the stretcher remembers which input sample it
+    started from, so input_position() can map an output sample back to the
+    position in the input stream it was rendered from.
+    """
+
+    def __init__(self, n_fft=2048, hop_length=512, rate=1.0):
+        """
+        :param n_fft: FFT size in samples.
+        :param hop_length: Synthesis hop in samples (output advance per frame).
+        :param rate: Initial stretch rate. Values above 1 play faster.
+        """
+        if hop_length <= 0 or hop_length > n_fft:
+            raise ValueError("hop_length must be in (0, n_fft]")
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.rate = rate
+
+        self.window = np.hanning(n_fft + 1)[:-1].astype(np.float32)
+        # Overlap-add gain of the squared window at the synthesis hop
+        self.norm = float(np.sum(self.window ** 2) / hop_length)
+        self.reset()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        if value <= 0:
+            raise ValueError("rate must be positive")
+        self._rate = float(value)
+
+    def reset(self):
+        """Drop all buffered audio and phase state."""
+        self._input = np.zeros(0, dtype=np.float32)
+        self._analysis_pos = 0.0
+        self._output = np.zeros(self.n_fft, dtype=np.float32)
+        self._phase = None
+        self._input_offset = 0   # input samples discarded so far
+        self.output_count = 0    # output samples produced so far
+        self.position_marks = deque(maxlen=512)  # (output index, input index) of each frame centre
+
+    def _frame_spectrum(self, start):
+        frame = self._input[start:start + self.n_fft] * self.window
+        return np.fft.rfft(frame)
+
+    def process(self, samples):
+        """
+        Feed a chunk of mono samples and return whatever output is ready.
+        The stretch rate may be changed between calls.
+        :param samples: 1-D array of input samples.
+        :return: 1-D float32 array of stretched samples (possibly empty).
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        self._input = np.concatenate((self._input, samples))
+
+        hop = self.hop_length
+        analysis_hop = self._rate * hop
+        needed = self.n_fft + hop
+        blocks = []
+
+        while int(self._analysis_pos) + needed <= len(self._input):
+            start = int(self._analysis_pos)
+            current = self._frame_spectrum(start)
+            ahead = self._frame_spectrum(start + hop)
+
+            if self._phase is None:
+                self._phase = np.angle(ahead)
+            else:
+                # Phase advance over one synthesis hop, measured directly
+                self._phase += np.angle(ahead) - np.angle(current)
+
+            frame = np.fft.irfft(np.abs(ahead) * np.exp(1j * self._phase), n=self.n_fft)
+            self._output += (frame * self.window).astype(np.float32)
+
+            # Frame centres: the output sample here was rendered from this input sample
+            center = self.n_fft // 2
+            self.position_marks.append((self.output_count + center, self._input_offset + start + hop + center))
+            self.output_count += hop
+            blocks.append(self._output[:hop] / self.norm)
+            self._output = np.concatenate((self._output[hop:], np.zeros(hop, dtype=np.float32)))
+            self._analysis_pos += analysis_hop
+
+        # Discard input that no future frame can reach
+        consumed = int(self._analysis_pos)
+        if consumed:
+            consumed = min(consumed, len(self._input))
+            self._input = self._input[consumed:]
+            self._analysis_pos -= consumed
+            self._input_offset += consumed
+
+        if not blocks:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(blocks).astype(np.float32)
+
+    def input_position(self, output_index):
+        """
+        Map an output sample index to the input sample it was rendered from.
+        :param output_index: Index into the output stream since the last reset().
+        :return: Fractional input sample index, or None if it is outside the recent history.
+        """
+        marks = list(self.position_marks)
+        if not marks or output_index > marks[-1][0] + self.n_fft:
+            return None
+        outputs, inputs = np.array(marks, dtype=np.float64).T
+        if output_index < outputs[0]:
+            if output_index < outputs[0] - self.n_fft:
+                return None
+            return inputs[0] - (outputs[0] - output_index)
+        if len(marks) == 1 or output_index >= outputs[-1]:
+            return inputs[-1] + (output_index - outputs[-1]) * self._rate
+        return float(np.interp(output_index, outputs, inputs))
+
+    def flush(self):
+        """
+        Push out the audio still held in the internal buffers.
+        :return: 1-D float32 array with the remaining samples.
+        """
+        tail = self.process(np.zeros(self.n_fft + self.hop_length, dtype=np.float32))
+        self.reset()
+        return tail
@@ -0,0 +1,263 @@
+import math
+import threading
+import numpy as np
+
+from time_stretch import StreamingTimeStretcher
+
+# Half-time and double-time aliases: a 85 BPM track runs fine at 170 steps/min
+TEMPO_ALIASES = (0.5, 1.0, 2.0)
+
+
+def nearest_alias(tempo, cadence):
+    """
+    :return: The alias of tempo (half, same or double) closest to cadence on a log scale.
+    """
+    return min((tempo * factor for factor in TEMPO_ALIASES), key=lambda bpm: abs(math.log(cadence / bpm)))
+
+
+class BpmIndex:
+    """
+    Sorted index of track tempos, including half-time and double-time aliases,
+    for picking the track that needs the least stretching at a given cadence.
+    """
+
+    def __init__(self, tracks):
+        """
+        :param tracks: Iterable of (path, tempo, duration) rows, e.g. LibraryIndex.tracks().
+        """
+        entries = []
+        for path, tempo, duration in tracks:
+            if tempo and tempo > 0:
+                for factor in TEMPO_ALIASES:
+                    entries.append((tempo * factor, path, tempo))
+        entries.sort()
+        self._tempos = np.array([entry[0] for entry in entries])
+        self._entries = entries
+
+    def __len__(self):
+        return len(self._entries) // len(TEMPO_ALIASES)
+
+    def pick(self, cadence, exclude=(), candidates=8):
+        """
+        Choose the track whose (aliased) tempo is closest to cadence.
+        :param cadence: Current cadence in steps per minute.
+        :param exclude: Paths that should not be picked (e.g. recently played).
+        :param candidates: How many neighbours on each side of cadence to consider.
+        :return: Tuple (path, tempo, effective_tempo), or None if nothing is eligible.
+        """
+        if not self._entries or not cadence or cadence <= 0:
+            return None
+        exclude = set(exclude)
+        pos = int(np.searchsorted(self._tempos, cadence))
+        best = None
+        # Widen the window until something not excluded turns up
+        width = candidates
+        while best is None and width <= 2 * len(self._entries) + candidates:
+            for i in range(max(pos - width, 0), min(pos + width, len(self._entries))):
+                effective, path, tempo = self._entries[i]
+                if path in exclude:
+                    continue
+                cost = abs(math.log(cadence / effective))
+                if best is None or cost < best[0]:
+                    best = (cost, path, tempo, effective)
+            width *= 2
+        if best is None:
+            return None
+        return best[1], best[2], best[3]
+
+
+class TrackSource:
+    """
+    Read cursor over a decoded track that delivers samples at the output rate,
+    linearly resampling when the track was decoded at a different rate.
+    """
+
+    def __init__(self, audio, sample_rate, output_rate, info=None):
+        self.audio = audio
+        self.sample_rate = sample_rate
+        self.output_rate = output_rate
+        self.info = info or {}
+        self._step = sample_rate / output_rate
+        self._pos = 0.0
+
+    def remaining(self):
+        """Number of output-rate samples left."""
+        return int((len(self.audio) - self._pos) / self._step)
+
+    def read(self, n):
+        if self._step == 1.0:
+            start = int(self._pos)
+            chunk = np.asarray(self.audio[start:start + n], dtype=np.float32)
+            self._pos += len(chunk)
+            return chunk
+        n = min(n, self.remaining())
+        if n <= 0:
+            return np.zeros(0, dtype=np.float32)
+        positions = self._pos + self._step * np.arange(n)
+        start = int(positions[0])
+        stop = min(int(positions[-1]) + 2, len(self.audio))
+        window = np.asarray(self.audio[start:stop], dtype=np.float32)
+        chunk = np.interp(positions - start, np.arange(len(window)), window).astype(np.float32)
+        self._pos += self._step * n
+        return chunk
+
+    def seconds_at(self, index):
+        """
+        :param index: Output sample index since the start of the track.
+        :return: Seconds into the track.
+        """
+        return index / self.output_rate
+
+
+class StretchedSource:
+    """
+    Time-stretches a TrackSource on the fly, for tracks without precomputed
+    renditions. Delivers exactly the number of samples asked for, so it can be
+    mixed after stretching like a RenditionSource.
+    """
+
+    def __init__(self, source, rate=1.0, chunk_seconds=0.1):
+        """
+        :param source: TrackSource to read from.
+        :param rate: Initial stretch rate.
+        :param chunk_seconds: Input fed to the stretcher at a time.
+        """
+        self.source = source
+        self.info = source.info
+        self.output_rate = source.output_rate
+        self.stretcher = StreamingTimeStretcher(rate=rate)
+        self._chunk = int(chunk_seconds * source.output_rate)
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._flushed = False
+
+    @property
+    def rate(self):
+        return self.stretcher.rate
+
+    @rate.setter
+    def rate(self, value):
+        self.stretcher.rate = value
+
+    def remaining(self):
+        return int(self.source.remaining() / self.stretcher.rate) + len(self._buffer)
+
+    def read(self, n):
+        while len(self._buffer) < n and not self._flushed:
+            chunk = self.source.read(self._chunk)
+            if len(chunk):
+                stretched = self.stretcher.process(chunk)
+            else:
+                # flush() resets the position history, so only done once at the very end
+                stretched = self.stretcher.flush()
+                self._flushed = True
+            self._buffer = np.concatenate((self._buffer, stretched))
+        chunk, self._buffer = self._buffer[:n], self._buffer[n:]
+        return chunk
+
+    def seconds_at(self, index):
+        """
+        :param index: Output sample index since the start of the track.
+        :return: Seconds into the track, or None if index is outside the stretcher's history.
+        """
+        position = self.stretcher.input_position(index)
+        return None if position is None else position / self.output_rate
+
+
+class PlaybackQueue:
+    """
+    Current track plus an optional queued next track, mixed with an
+    equal-power crossfade so the transition is gapless.
+
+    Sources stretch themselves (StretchedSource or RenditionSource), so mixing
+    happens after time-stretching and the rate set here is passed on to both
+    tracks. Plain TrackSources work too when no stretching is wanted.
+    """
+
+    def __init__(self, current, crossfade_seconds=3.0, on_switch=None):
+        """
+        :param current: TrackSource to start with.
+        :param crossfade_seconds: Length of the overlap between consecutive tracks.
+        :param on_switch: Called with the new TrackSource when the crossfade starts.
+        """
+        self.current = current
+        self.next = None
+        self.crossfade = int(crossfade_seconds * current.output_rate)
+        self.on_switch = on_switch
+        self._lock = threading.Lock()
+        self._fading = False
+        # The track being faded in (or playing) and the stream sample where it started
+        self.active = current
+        self.active_origin = 0
+        self.stream_position = 0
+        self._rate = 1.0
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        with self._lock:
+            self._rate = value
+            for source in (self.current, self.next):
+                if source is not None and hasattr(source, "rate"):
+                    source.rate = value
+
+    def set_next(self, source):
+        with self._lock:
+            if hasattr(source, "rate"):
+                source.rate = self._rate
+            self.next = source
+
+    def remaining_seconds(self):
+        return self.current.remaining() / self.current.output_rate
+
+    def track_position(self, stream_index):
+        """
+        :param stream_index: Sample index in the mixed stream returned by read().
+        :return: Tuple (seconds into the active track or None if unknown, active source).
+        """
+        return self.active.seconds_at(stream_index - self.active_origin), self.active
+
+    def read(self, n):
+        """
+        :return: Up to n mixed samples; an empty array once everything has played.
+        """
+        chunk = self._read(n)
+        self.stream_position += len(chunk)
+        return chunk
+
+    def _read(self, n):
+        with self._lock:
+            upcoming = self.next
+        remaining = self.current.remaining()
+
+        if upcoming is None:
+            return self.current.read(n)
+        if not self._fading and remaining > self.crossfade:
+            # Play the current track alone up to the start of the crossfade
+            return self.current.read(min(n, remaining - self.crossfade))
+
+        if not self._fading:
+            self._fading = True
+            # A track queued late fades over whatever is left of the current one
+            self._fade_length = max(min(self.crossfade, remaining), 1)
+            self.active = upcoming
+            self.active_origin = self.stream_position
+            if self.on_switch is not None:
+                self.on_switch(upcoming)
+
+        outgoing = self.current.read(n)
+        incoming = upcoming.read(n)
+        # Fade progress per sample: 0 at the start of the fade, 1 once the old track has ended
+        progress = np.clip(1 - (remaining - np.arange(n)) / self._fade_length, 0, 1)
+        mixed = np.zeros(max(len(outgoing), len(incoming)), dtype=np.float32)
+        mixed[:len(outgoing)] += outgoing * np.cos(0.5 * np.pi * progress[:len(outgoing)])
+        mixed[:len(incoming)] += incoming * np.sin(0.5 * np.pi * progress[:len(incoming)])
+
+        if self.current.remaining() <= 0:
+            with self._lock:
+                self.current = upcoming
+                self.next = None
+            self._fading = False
+        return mixed
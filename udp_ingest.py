@@ -0,0 +1,273 @@
+import select
+import struct
+import time
+from collections import deque
+import numpy as np
+
+from metrics import REGISTRY
+
+# Binary frame: magic, version, sample count, sequence number,
+# sender timestamp of the first sample (s), sample interval (s),
+# followed by count little-endian float32 (x, y, z) triplets.
+# Version 2 appends a u32 session ID to the header, so one runner can be
+# told apart from another behind the same address (see runner_server).
+FRAME_MAGIC = b'JM'
+FRAME_VERSION = 1
+FRAME_SESSION_VERSION = 2
+FRAME_HEADER = struct.Struct('<2sBBIdf')
+FRAME_SESSION_ID = struct.Struct('<I')
+MAX_DATAGRAM = 2048
+
+_recv_seconds = REGISTRY.histogram("ingest.recv_seconds")
+_parse_seconds = REGISTRY.histogram("ingest.parse_seconds")
+_datagrams = REGISTRY.counter("ingest.datagrams")
+
+
+def encode_frame(samples, seq, timestamp, interval, session_id=None):
+    """
+    Pack accelerometer samples into a binary frame.
+    :param samples: Array of shape (n, 3), n <= 255.
+    :param seq: Sequence number of the frame.
+    :param timestamp: Sender time of the first sample in seconds.
+    :param interval: Time between samples in seconds.
+    :param session_id: Optional runner session ID (u32); produces a version-2 frame.
+    :return: bytes ready to send.
+    """
+    samples = np.asarray(samples, dtype='<f4').reshape(-1, 3)
+    version = FRAME_VERSION if session_id is None else FRAME_SESSION_VERSION
+    header = FRAME_HEADER.pack(FRAME_MAGIC, version, len(samples), seq & 0xFFFFFFFF, timestamp, interval)
+    if session_id is not None:
+        header += FRAME_SESSION_ID.pack(session_id & 0xFFFFFFFF)
+    return header + samples.tobytes()
+
+
+def parse_frame(data):
+    """
+    Decode a binary frame.
+    :param data: Datagram payload.
+    :return: Tuple (samples, seq, timestamp, interval) where samples is an (n, 3) float32 view.
+    :raises ValueError: If the payload is not a valid frame.
+    """
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError("Frame shorter than header")
+    magic, version, count, seq, timestamp, interval = FRAME_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC or version not in (FRAME_VERSION, FRAME_SESSION_VERSION):
+        raise ValueError("Unknown frame header")
+    header_size = FRAME_HEADER.size + (FRAME_SESSION_ID.size if version == FRAME_SESSION_VERSION else 0)
+    if len(data) != header_size + count * 12:
+        raise ValueError("Frame length does not match sample count")
+    samples = np.frombuffer(data, dtype='<f4', count=count * 3, offset=header_size).reshape(-1, 3)
+    return samples, seq, timestamp, interval
+
+
+def frame_session_id(data):
+    """
+    :param data: Datagram payload.
+    :return: The session ID of a version-2 frame, or None for any other payload.
+    """
+    if (len(data) >= FRAME_HEADER.size + FRAME_SESSION_ID.size and data[:2] == FRAME_MAGIC
+            and data[2] == FRAME_SESSION_VERSION):
+        return FRAME_SESSION_ID.unpack_from(data, FRAME_HEADER.size)[0]
+    return None
+
+
+class ClockSync:
+    """
+    Maps a sender's clock onto the local time.time() clock.
+
+    The offset is the smallest (arrival - sender time) seen over a sliding
+    window of frames, i.e. the fastest observed delivery, so queueing and
+    Wi-Fi batching delays do not leak into sample times. The spread of the
+    remaining delivery delays is reported as jitter, and the slope of the
+    minimum offset over the window as clock drift.
+    """
+
+    def __init__(self, window=64):
+        self._offsets = deque(maxlen=window)
+
+    def update(self, sender_time, arrival):
+        """
+        Record a frame and return the current sender-to-local offset in seconds.
+        """
+        self._offsets.append((sender_time, arrival - sender_time))
+        return min(offset for _, offset in self._offsets)
+
+    def stats(self):
+        """
+        :return: Dict with jitter_ms (std of delivery delay) and drift_ppm.
+        """
+        if len(self._offsets) < 4:
+            return {"jitter_ms": 0.0, "drift_ppm": 0.0}
+        times, offsets = np.array(self._offsets).T
+        quarter = len(offsets) // 4
+        span = times[-quarter:].mean() - times[:quarter].mean()
+        drift = (offsets[-quarter:].min() - offsets[:quarter].min()) / span if span > 0 else 0.0
+        return {"jitter_ms": float(np.std(offsets) * 1e3), "drift_ppm": float(drift * 1e6)}
+
+
+class UdpIngestor:
+    """
+    Drains every pending datagram from a UDP socket in one wakeup.
+
+    Accepts binary frames (see encode_frame) and legacy "x,y,z" text datagrams
+    side by side, and returns each wakeup's samples as one block. Binary frames
+    are timed with the sender's timestamps mapped onto the local clock; text
+    datagrams, which carry no timestamp, fall back to their arrival time.
+    Python has no recvmmsg wrapper, so the socket is read with non-blocking
+    recv_into calls into a reused buffer until it runs dry.
+    """
+
+    def __init__(self, sock, max_datagrams=256):
+        """
+        :param sock: Bound UDP socket.
+        :param max_datagrams: Upper bound of datagrams handled per drain() call.
+        """
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.max_datagrams = max_datagrams
+        self._buffer = bytearray(MAX_DATAGRAM)
+        self._view = memoryview(self._buffer)
+        self._last_seq = {}
+        self._clocks = {}
+        self._last_time = 0.0
+        self._arrivals = deque(maxlen=256)
+
+        self.packets = 0
+        self.samples = 0
+        self.parse_errors = 0
+        self.seq_gaps = 0
+        self._rate_start = time.time()
+        self._rate_packets = 0
+
+    def _check_sequence(self, addr, seq):
+        last = self._last_seq.get(addr)
+        if last is not None:
+            expected = (last + 1) & 0xFFFFFFFF
+            if seq != expected:
+                self.seq_gaps += 1
+        self._last_seq[addr] = seq
+
+    def drain(self, timeout=1.0):
+        """
+        Wait for data and read everything that is pending.
+        :param timeout: Seconds to wait for the first datagram.
+        :return: Tuple (samples, timestamps) with an (n, 3) float32 array and n local-clock times.
+        """
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if not ready:
+            return np.zeros((0, 3), dtype=np.float32), np.zeros(0)
+        recv_start = time.perf_counter()
+        packets_before = self.packets
+
+        # Text datagrams are gathered into one list and parsed in a single vectorised
+        # call; runs remember where each stretch of them sits in arrival order
+        runs = []
+        csv_values = []
+        csv_times = []
+        for _ in range(self.max_datagrams):
+            try:
+                nbytes, addr = self.sock.recvfrom_into(self._buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            arrival = time.time()
+            self.packets += 1
+            data = self._view[:nbytes]
+
+            if nbytes >= 2 and data[:2] == FRAME_MAGIC:
+                try:
+                    samples, seq, sender_time, interval = parse_frame(bytes(data))
+                except ValueError:
+                    self.parse_errors += 1
+                    continue
+                self._check_sequence(addr, seq)
+                frame_times = sender_time + interval * np.arange(len(samples))
+                clock = self._clocks.get(addr)
+                if clock is None:
+                    clock = self._clocks[addr] = ClockSync()
+                frame_times += clock.update(frame_times[-1], arrival)
+                self._last_time = frame_times[-1]
+                runs.append((samples, frame_times))
+            else:
+                fields = bytes(data).split(b',')
+                if len(fields) != 3:
+                    self.parse_errors += 1
+                    continue
+                if runs and runs[-1][0] is None:
+                    runs[-1] = (None, (runs[-1][1][0], len(csv_times) + 1))
+                else:
+                    runs.append((None, (len(csv_times), len(csv_times) + 1)))
+                csv_values.extend(fields)
+                self._arrivals.append(arrival)
+                self._last_time = max(arrival, self._last_time)
+                csv_times.append(self._last_time)
+
+        _datagrams.inc(self.packets - packets_before)
+        parse_start = time.perf_counter()
+        _recv_seconds.observe(parse_start - recv_start)
+        if csv_values:
+            csv_samples = self._parse_csv(csv_values)
+            csv_times = np.array(csv_times)
+
+        blocks = []
+        times = []
+        for samples, info in runs:
+            if samples is None:
+                start, stop = info
+                samples, info = csv_samples[start:stop], csv_times[start:stop]
+                valid = ~np.isnan(samples[:, 0])
+                if not valid.all():
+                    samples, info = samples[valid], info[valid]
+            blocks.append(samples)
+            times.append(info)
+
+        if not blocks:
+            return np.zeros((0, 3), dtype=np.float32), np.zeros(0)
+        samples = np.concatenate(blocks)
+        _parse_seconds.observe_since(parse_start)
+        self.samples += len(samples)
+        return samples, np.concatenate(times)
+
+    def _parse_csv(self, values):
+        """
+        Convert flat x, y, z byte fields to an (n, 3) array. Rows that fail to
+        parse are counted as errors and set to NaN so indices stay aligned.
+        """
+        try:
+            return np.array(values, dtype=np.float32).reshape(-1, 3)
+        except ValueError:
+            rows = np.full((len(values) // 3, 3), np.nan, dtype=np.float32)
+            for i in range(len(rows)):
+                try:
+                    rows[i] = [float(v) for v in values[3 * i:3 * i + 3]]
+                except ValueError:
+                    self.parse_errors += 1
+            return rows
+
+    def stats(self):
+        """
+        :return: Dict with packets/sec since the last call, totals, parse errors and sequence gaps.
+        """
+        now = time.time()
+        elapsed = now - self._rate_start
+        packets_per_sec = (self.packets - self._rate_packets) / elapsed if elapsed > 0 else 0.0
+        self._rate_start = now
+        self._rate_packets = self.packets
+        if self._clocks:
+            clock_stats = [clock.stats() for clock in self._clocks.values()]
+            jitter_ms = max(c["jitter_ms"] for c in clock_stats)
+            drift_ppm = max((c["drift_ppm"] for c in clock_stats), key=abs)
+        elif len(self._arrivals) > 2:
+            # Without sender timestamps, jitter is the spread of arrival intervals
+            jitter_ms = float(np.std(np.diff(np.array(self._arrivals))) * 1e3)
+            drift_ppm = 0.0
+        else:
+            jitter_ms = drift_ppm = 0.0
+        return {
+            "packets_per_sec": packets_per_sec,
+            "packets": self.packets,
+            "samples": self.samples,
+            "parse_errors": self.parse_errors,
+            "seq_gaps": self.seq_gaps,
+            "jitter_ms": jitter_ms,
+            "drift_ppm": drift_ppm,
+        }
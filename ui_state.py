@@ -0,0 +1,37 @@
+import threading
+
+
+class UIState:
+    """
+    Snapshot of the values shown in the window.
+
+    Worker threads write values with set(); the Tk thread periodically calls
+    take_changes() and redraws only the fields that changed since the last
+    call. Writing a value equal to the current one does not mark it changed,
+    so UI cost does not grow with the rate at which workers publish.
+    """
+
+    def __init__(self, **initial):
+        self._lock = threading.Lock()
+        self._values = dict(initial)
+        self._changed = set(initial)
+
+    def set(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                if name not in self._values or self._values[name] != value:
+                    self._values[name] = value
+                    self._changed.add(name)
+
+    def get(self, name, default=None):
+        with self._lock:
+            return self._values.get(name, default)
+
+    def take_changes(self):
+        """
+        :return: Dict of the fields changed since the previous call, with their latest values.
+        """
+        with self._lock:
+            changes = {name: self._values[name] for name in self._changed}
+            self._changed.clear()
+        return changes